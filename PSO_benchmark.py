@@ -0,0 +1,321 @@
+# reproducible benchmark of the optimizer on the PSO_tests problems, so a speed-up can be checked for what it costs in solution quality
+# every (problem, mode, swarm size, seed) combination is one run, each run records:
+#   evaluations_to_target   real evaluations until the best value first got within the problem's tolerance of the optimum (None if never)
+#   wall_time               seconds for the whole optimize() call
+#   objective_time          seconds of that spent inside the objective, optimizer_time is the rest
+#   error                   objective at the returned design minus the known optimum
+#   infeasible              evaluations that broke the problem's constraint (should always be 0)
+# plus a summary per (problem, mode, swarm size) across seeds, all written to one JSON file
+#
+# python PSO_benchmark.py --seeds 10 --modes object array --output before.json
+# python PSO_benchmark.py --seeds 10 --modes object array --output after.json --compare before.json
+# python PSO_benchmark.py --checks      (consistency checks instead: a resumed run ends where the uninterrupted one does...)
+
+import os
+import copy
+import json
+import time
+import tempfile
+import argparse
+import datetime
+import itertools
+import subprocess
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from mixedvar_PSO import PSO_optimizer, myround
+from array_PSO import PSO_array_optimizer
+from PSO_surrogate import PSO_surrogate
+from PSO_cost import PSO_cost_model
+from PSO_lattice import lattice_of
+import PSO_tests as tests
+
+
+# exact optimum of an all-discrete problem, by trying every lattice point (rounded the way the optimizer rounds them)
+def lattice_optimum(params, objective, constraint=None):
+    # copies, the templates are hashed by value inside their sets
+    params = sorted(copy.deepcopy(list(params)), key=lambda param: param.name)
+    best = np.inf
+    for vals in itertools.product(*[lattice_of(param).values(np.arange(lattice_of(param).n_steps)) for param in params]):
+        for param, val in zip(params, vals):
+            param.val = float(myround(val, param.discretization))
+        if constraint is None or constraint(set(params)):
+            best = min(best, objective(set(params)))
+
+    return float(best)
+
+
+# optimum None means lattice_optimum works it out, tolerance is how close counts as having found it
+# convergence_range goes straight to optimize(), it's in objective units
+PROBLEMS = {
+    'quadratic': dict(params=tests.input_params1, objective=tests.test_objective1, constraint=None, optimum=None, tolerance=1e-9, convergence_range=0.2),
+    'quadratic_c1': dict(params=tests.input_params1, objective=tests.test_objective1, constraint=tests.test_constraint1, optimum=None, tolerance=1e-9, convergence_range=0.2),
+    'sinusoidal': dict(params=tests.input_params2, objective=tests.test_objective2, constraint=None, optimum=None, tolerance=1e-9, convergence_range=0.2),
+    'sinusoidal_c2': dict(params=tests.input_params2, objective=tests.test_objective2, constraint=tests.test_constraint2, optimum=None, tolerance=1e-9, convergence_range=0.2),
+    'hartmann6': dict(params=tests.input_params3, objective=tests.test_objective3, constraint=None, optimum=-3.32237, tolerance=0.05, convergence_range=0.05),
+    'ackley': dict(params=tests.input_params4, objective=tests.test_objective4, constraint=None, optimum=None, tolerance=1e-9, convergence_range=0.5),
+    'plates_c3': dict(params=tests.input_params5, objective=tests.test_objective5, constraint=tests.test_constraint3, optimum=0.2029939606197479, tolerance=0.01, convergence_range=0.05),
+}
+
+MODES = ('object', 'array', 'async', 'surrogate')
+
+
+def optimum(problem):
+    if problem['optimum'] is None:
+        problem['optimum'] = lattice_optimum(problem['params'], problem['objective'], problem['constraint'])
+    return problem['optimum']
+
+
+# the objective as the optimizer sees it: counts evaluations, times them, and notes when the best first reached the target
+class timed_objective:
+    def __init__(self, objective, constraint, target):
+        self.objective = objective
+        self.constraint = constraint
+        self.target = target
+        self.n_evaluations = 0
+        self.time = 0.0
+        self.best = np.inf
+        self.evaluations_to_target = None
+        self.infeasible = 0
+
+    def __call__(self, params):
+        start = time.perf_counter()
+        val = self.objective(params)
+        self.time += time.perf_counter() - start
+
+        self.n_evaluations += 1
+        self.best = min(self.best, val)
+        if self.evaluations_to_target is None and self.best <= self.target:
+            self.evaluations_to_target = self.n_evaluations
+        if self.constraint is not None and not self.constraint(params):
+            self.infeasible += 1
+
+        return val
+
+
+def run_one(name, mode, n_particles, seed, max_iterations, w_inertia=0.8, c_cog=0.1, c_social=0.1, range_count_thresh=5):
+    problem = PROBLEMS[name]
+    best_possible = optimum(problem)
+    objective = timed_objective(problem['objective'], problem['constraint'], best_possible + problem['tolerance'])
+    np.random.seed(seed)
+
+    surrogate = PSO_surrogate(problem['params']) if mode == 'surrogate' else None
+    optimizer_class = PSO_array_optimizer if mode == 'array' else PSO_optimizer
+    optimizer = optimizer_class(problem['params'], objective, problem['constraint'], surrogate=surrogate)
+
+    start = time.perf_counter()
+    if mode == 'async':
+        # one worker thread, so objective time and optimizer time add up to the wall time like they do for the others
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            bparams, bval = optimizer.optimize_async(n_particles, w_inertia, c_cog, c_social, n_particles * max_iterations, range_count_thresh,
+                                                     problem['convergence_range'], logging=False, executor=executor)
+    else:
+        bparams, bval = optimizer.optimize(n_particles, w_inertia, c_cog, c_social, range_count_thresh, problem['convergence_range'],
+                                           max_iterations=max_iterations, logging=False)
+    wall_time = time.perf_counter() - start
+
+    # bval is always a real evaluation (the surrogate only screens out candidates that can't beat their particle's best),
+    # the objective is called once more on the returned design so every mode's error is worked out the same way
+    final = float(problem['objective'](bparams))
+
+    return {'problem': name, 'mode': mode, 'n_particles': n_particles, 'seed': seed,
+            'n_evaluations': objective.n_evaluations, 'evaluations_to_target': objective.evaluations_to_target,
+            'wall_time': wall_time, 'objective_time': objective.time, 'optimizer_time': wall_time - objective.time,
+            'best_value': final, 'optimum': best_possible, 'error': final - best_possible, 'infeasible': objective.infeasible,
+            'best_params': {param.name: float(param.val) for param in bparams}, 'stop_reason': optimizer.stop_reason}
+
+
+def summarize(runs):
+    groups = {}
+    for run in runs:
+        groups.setdefault((run['problem'], run['mode'], run['n_particles']), []).append(run)
+
+    summary = []
+    for (name, mode, n_particles), group in groups.items():
+        hits = [run['evaluations_to_target'] for run in group if run['evaluations_to_target'] is not None]
+        summary.append({'problem': name, 'mode': mode, 'n_particles': n_particles, 'n_runs': len(group),
+                        'success_rate': len(hits) / len(group),
+                        'median_evaluations_to_target': float(np.median(hits)) if hits else None,
+                        'mean_evaluations': float(np.mean([run['n_evaluations'] for run in group])),
+                        'mean_error': float(np.mean([run['error'] for run in group])),
+                        'max_error': float(np.max([run['error'] for run in group])),
+                        'mean_wall_time': float(np.mean([run['wall_time'] for run in group])),
+                        'mean_optimizer_time': float(np.mean([run['optimizer_time'] for run in group])),
+                        'infeasible': int(sum(run['infeasible'] for run in group))})
+
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(summary):
+    print(f'{"problem":<15}{"mode":<11}{"particles":>10}{"success":>9}{"evals":>9}{"to target":>11}{"mean err":>11}{"opt s":>9}{"infeas":>8}')
+    for row in summary:
+        to_target = '-' if row['median_evaluations_to_target'] is None else f'{row["median_evaluations_to_target"]:.0f}'
+        print(f'{row["problem"]:<15}{row["mode"]:<11}{row["n_particles"]:>10}{row["success_rate"]:>9.0%}{row["mean_evaluations"]:>9.0f}'
+              f'{to_target:>11}{row["mean_error"]:>11.3g}{row["mean_optimizer_time"]:>9.3f}{row["infeasible"]:>8}')
+
+
+# same groups in an earlier benchmark file against this one, new minus old
+def compare(old_summary, new_summary):
+    old = {(row['problem'], row['mode'], row['n_particles']): row for row in old_summary}
+    print(f'{"problem":<15}{"mode":<11}{"particles":>10}{"success":>10}{"evals":>9}{"mean err":>11}{"opt s":>9}')
+    for row in new_summary:
+        before = old.get((row['problem'], row['mode'], row['n_particles']))
+        if before is None:
+            continue
+        print(f'{row["problem"]:<15}{row["mode"]:<11}{row["n_particles"]:>10}{row["success_rate"] - before["success_rate"]:>+10.0%}'
+              f'{row["mean_evaluations"] - before["mean_evaluations"]:>+9.0f}{row["mean_error"] - before["mean_error"]:>+11.3g}'
+              f'{row["mean_optimizer_time"] - before["mean_optimizer_time"]:>+9.3f}')
+
+
+# objective that dies after n calls, like a crashed solver
+class crashing_objective:
+    def __init__(self, objective, n):
+        self.objective = objective
+        self.n = n
+
+    def __call__(self, params):
+        self.n -= 1
+        if self.n < 0:
+            raise RuntimeError('simulated crash')
+        return self.objective(params)
+
+
+# the same seed with a crash after crash_after evaluations and a resume from the checkpoint has to end exactly where the
+# uninterrupted run does, after the same number of real evaluations. returns (uninterrupted, resumed), each a (best value, evaluations) pair
+# with surrogate, every run gets a fresh PSO_surrogate, so the resumed one only knows what resume() feeds it (what it screens out changes the count)
+def check_resume(name, mode, seed=5, n_particles=8, max_iterations=15, crash_after=50, surrogate=False):
+    problem = PROBLEMS[name]
+    optimizer_class = PSO_array_optimizer if mode == 'array' else PSO_optimizer
+
+    def kwargs():
+        return {'surrogate': PSO_surrogate(problem['params'])} if surrogate else {}
+
+    settings = (n_particles, 0.8, 0.1, 0.1, max_iterations + 1, problem['convergence_range'])
+    checkpoint_path = os.path.join(tempfile.mkdtemp(prefix='PSO_benchmark_'), 'checkpoint.pkl')
+
+    np.random.seed(seed)
+    optimizer = optimizer_class(problem['params'], problem['objective'], problem['constraint'], **kwargs())
+    _, full = optimizer.optimize(*settings, max_iterations=max_iterations, logging=False)
+    full = (float(full), optimizer.n_evaluations)
+
+    np.random.seed(seed)
+    try:
+        optimizer_class(problem['params'], crashing_objective(problem['objective'], crash_after), problem['constraint'], **kwargs()).optimize(
+            *settings, max_iterations=max_iterations, logging=False, checkpoint_path=checkpoint_path)
+    except RuntimeError:
+        pass
+    np.random.seed(seed + 1000)     # whatever the RNG is doing now, the checkpoint's state has to win
+    optimizer = optimizer_class(problem['params'], problem['objective'], problem['constraint'], **kwargs())
+    _, resumed = optimizer.resume(checkpoint_path)
+
+    return full, (float(resumed), optimizer.n_evaluations)
+
+
+# cost model features for the check below, module level so nothing about it has to pickle
+def n_params(params):
+    return [len(params)]
+
+
+# a process pool gets the same result as evaluating in this process, and every evaluation still gets timed and fed to the cost model
+# returns (serial best, process pool best, objective spans timed, cost model timings, evaluations)
+def check_process_pool(name, mode, seed=0, n_particles=8, max_iterations=10):
+    problem = PROBLEMS[name]
+    optimizer_class = PSO_array_optimizer if mode == 'array' else PSO_optimizer
+    settings = (n_particles, 0.8, 0.1, 0.1, max_iterations + 1, problem['convergence_range'])
+
+    np.random.seed(seed)
+    _, serial = optimizer_class(problem['params'], problem['objective'], problem['constraint']).optimize(*settings, max_iterations=max_iterations, logging=False)
+
+    np.random.seed(seed)
+    optimizer = optimizer_class(problem['params'], problem['objective'], problem['constraint'], cost_model=PSO_cost_model(n_params))
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        _, pooled = optimizer.optimize(*settings, max_iterations=max_iterations, logging=False, executor=executor)
+
+    return (float(serial), float(pooled), len(optimizer.timer.durations.get('objective', [])),
+            sum(len(rows) for rows, _ in optimizer.cost_model.data.values()), optimizer.n_evaluations)
+
+
+# a cost model that has learned something has to cope with iterations where the memo answers for every particle (an empty batch)
+# quadratic is all-discrete, so a long enough run keeps landing on lattice points it already solved
+# returns (best value, batches that had nothing to evaluate, evaluations)
+def check_cost_model_memo(name, mode, seed=0, n_particles=8, max_iterations=40):
+    problem = PROBLEMS[name]
+    optimizer_class = PSO_array_optimizer if mode == 'array' else PSO_optimizer
+    optimizer = optimizer_class(problem['params'], problem['objective'], problem['constraint'], cost_model=PSO_cost_model(n_params, min_points=2))
+
+    batches = []
+    map_f = optimizer.map_f
+    def counting_map_f(params_list, f=None):
+        batches.append(len(params_list))
+        return map_f(params_list, f)
+    optimizer.map_f = counting_map_f
+
+    np.random.seed(seed)
+    _, bval = optimizer.optimize(n_particles, 0.8, 0.1, 0.1, max_iterations + 1, problem['convergence_range'], max_iterations=max_iterations, logging=False)
+    return float(bval), batches.count(0), optimizer.n_evaluations
+
+
+def run_checks():
+    failed = 0
+    for mode in ('object', 'array'):
+        for surrogate in (False, True):
+            full, resumed = check_resume('hartmann6', mode, surrogate=surrogate)
+            ok = full == resumed
+            failed += not ok
+            print(f'resume ({mode}{", surrogate" if surrogate else ""}): uninterrupted {full}, resumed {resumed} -> {"ok" if ok else "MISMATCH"}')
+
+        serial, pooled, n_timed, n_observed, n_evaluations = check_process_pool('hartmann6', mode)
+        ok = serial == pooled and n_timed == n_observed == n_evaluations
+        failed += not ok
+        print(f'process pool ({mode}): serial {serial}, pooled {pooled}, {n_timed} timed and {n_observed} fed to the cost model '
+              f'of {n_evaluations} evaluations -> {"ok" if ok else "MISMATCH"}')
+
+        bval, n_empty, n_evaluations = check_cost_model_memo('quadratic', mode)
+        ok = n_empty > 0
+        failed += not ok
+        print(f'cost model, remembered batches ({mode}): best {bval} after {n_evaluations} evaluations, {n_empty} batches with nothing to evaluate '
+              f'-> {"ok" if ok else "NO EMPTY BATCH"}')
+
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark PSO_optimizer on the PSO_tests problems')
+    parser.add_argument('--problems', nargs='+', default=list(PROBLEMS), choices=list(PROBLEMS))
+    parser.add_argument('--modes', nargs='+', default=['object', 'array'], choices=MODES)
+    parser.add_argument('--particles', nargs='+', type=int, default=[8, 16])
+    parser.add_argument('--seeds', type=int, default=5, help='seeds 0 .. n-1 for every combination')
+    parser.add_argument('--max-iterations', type=int, default=100)
+    parser.add_argument('--output', default='PSO_benchmark.json')
+    parser.add_argument('--compare', help='an earlier benchmark file to compare the summary against')
+    parser.add_argument('--checks', action='store_true', help='run the consistency checks instead of the benchmark')
+    args = parser.parse_args()
+
+    if args.checks:
+        raise SystemExit(run_checks())
+
+    runs = []
+    for name, mode, n_particles, seed in itertools.product(args.problems, args.modes, args.particles, range(args.seeds)):
+        run = run_one(name, mode, n_particles, seed, args.max_iterations)
+        runs.append(run)
+        print(f'{name} {mode} {n_particles} particles seed {seed}: error {run["error"]:.3g} after {run["n_evaluations"]} evaluations, {run["wall_time"]:.2f} s')
+
+    summary = summarize(runs)
+    with open(args.output, 'w') as f:
+        json.dump({'created': datetime.datetime.now().isoformat(), 'commit': git_commit(), 'settings': vars(args),
+                   'summary': summary, 'runs': runs}, f, indent=1)
+
+    print()
+    print_summary(summary)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            old = json.load(f)
+        print(f'\nchange since {args.compare} (commit {old.get("commit")}):')
+        compare(old['summary'], summary)
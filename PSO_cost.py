@@ -0,0 +1,96 @@
+# how long an evaluation of a design will take, learned from the ones already timed
+# PSO_optimizer uses it to hand a batch to the executor longest job first: with the slow designs started first, the cheap ones
+# fill in around them and the workers finish the iteration together, instead of one worker starting a big design at the very end
+#
+# features(params) turns a set of PSO_param into a list of numbers (pin count, predicted cell count... see cpython_script),
+# the model is a ridge regression of log(seconds) on them, one per kind of evaluation ('objective', 'objective_coarse')
+# until a kind has min_points timings every design is predicted the same, so the batch keeps its order
+# observe() is called in the optimizer's process as the timings come back (never in a worker), the model is pickled into checkpoints with the rest of the optimizer
+
+import threading
+import numpy as np
+
+
+class PSO_cost_model:
+    def __init__(self, features, n_workers=1, min_points=5, ridge=1e-3):
+        self.features = features
+        self.n_workers = n_workers
+        self.min_points = min_points
+        self.ridge = ridge
+        self.data = {}          # kind -> ([feature rows], [log seconds])
+        self.weights = {}       # kind -> fitted weights, dropped whenever new data comes in
+        self.errors = []        # |predicted - actual| / actual, for every timing that had a prediction before it came in
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def row(self, params):
+        return [1.0] + [float(x) for x in self.features(params)]
+
+    def observe(self, kind, params, seconds):
+        row = self.row(params)
+        with self.lock:
+            if len(self.data.get(kind, ([],))[0]) >= self.min_points:
+                predicted = self.predict_rows(kind, [row])[0]
+                self.errors.append(abs(predicted - seconds) / max(seconds, 1e-9))
+
+            rows, targets = self.data.setdefault(kind, ([], []))
+            rows.append(row)
+            targets.append(np.log(max(seconds, 1e-9)))
+            self.weights.pop(kind, None)
+
+    def fit(self, kind):
+        if kind not in self.weights:
+            rows, targets = np.array(self.data[kind][0]), np.array(self.data[kind][1])
+
+            # features are scaled so one ridge strength fits pin counts and cell counts alike, the intercept isn't penalized
+            scale = np.maximum(np.abs(rows).max(axis=0), 1e-12)
+            penalty = self.ridge * len(rows) * np.eye(rows.shape[1])
+            penalty[0, 0] = 0
+            scaled = rows / scale
+            self.weights[kind] = np.linalg.solve(scaled.T @ scaled + penalty, scaled.T @ targets) / scale
+
+        return self.weights[kind]
+
+    def predict_rows(self, kind, rows):
+        if not len(rows):
+            return np.zeros(0)
+        if len(self.data.get(kind, ([],))[0]) < self.min_points:
+            known = self.data.get(kind, ([], []))[1]
+            return np.full(len(rows), np.exp(np.mean(known)) if known else 1.0)
+
+        return np.exp(np.array(rows) @ self.fit(kind))
+
+    # predicted seconds for every set of params
+    def predict(self, kind, params_list):
+        rows = [self.row(params) for params in params_list]
+        with self.lock:
+            return self.predict_rows(kind, rows)
+
+    # indices of params_list, most expensive first. ties keep their order
+    def order(self, kind, params_list):
+        return list(np.argsort(-self.predict(kind, params_list), kind='stable'))
+
+    # wall time for n_evaluations more designs like params_list (e.g. the swarm's current positions) spread over the workers,
+    # with the kinds of evaluation mixed the way they have been so far (a fidelity stage runs mostly coarse solves)
+    def remaining_time(self, params_list, n_evaluations):
+        with self.lock:
+            counts = {kind: len(rows) for kind, (rows, _) in self.data.items()}
+        if not counts or not params_list:
+            return None
+
+        per_design = sum(n * float(np.mean(self.predict(kind, params_list))) for kind, n in counts.items()) / sum(counts.values())
+        return per_design * n_evaluations / self.n_workers
+
+    def report(self):
+        with self.lock:
+            counts = ', '.join(f'{len(rows)} {kind}' for kind, (rows, _) in self.data.items())
+            error = f'{np.median(self.errors):.1%}' if self.errors else 'n/a'
+        return f'cost model: {counts or "nothing"} timed, median prediction error {error}'
@@ -0,0 +1,79 @@
+# optional two-level evaluation for PSO_optimizer: every new design gets a cheap coarse solve (f_coarse), and only the designs
+# whose coarse value lands within promote_margin of the swarm best get the real, fine solve (the optimizer's f)
+#
+# coarse values are biased, so before comparing they're shifted by the mean (fine - coarse) seen on promoted designs so far
+# promotion repeats within a batch until nothing left over could beat the best fine value, so the swarm best is always a fine value
+# designs that stay coarse are recorded with their shifted coarse value, they steer the swarm but never become the answer
+#
+# coarse results have their own memo and (optional) store, give the store a different fingerprint than the fine one,
+# e.g. fingerprint(..., fidelity='coarse'), so the two never mix
+
+import numpy as np
+from PSO_memo import PSO_memo
+
+
+class PSO_fidelity:
+    def __init__(self, params, f_coarse, promote_margin=0, store=None, cache_tolerance=0, cache_size=None):
+        self.f_coarse = f_coarse
+        self.promote_margin = promote_margin
+        self.store = store
+        self.memo = PSO_memo(params, cache_tolerance, cache_size)
+
+        self.offsets = []       # fine - coarse, for every promoted design
+        self.n_coarse = 0
+        self.n_fine = 0
+
+    def correction(self):
+        return float(np.mean(self.offsets)) if self.offsets else 0.0
+
+    # coarse value of every row, from memory where possible, the rest in one batch through map_f
+    def coarse_values(self, rows, params_list, map_f):
+        values = [self.memo.lookup(row) for row in rows]
+
+        if self.store is not None:
+            for i, row in enumerate(rows):
+                if values[i] is None:
+                    values[i] = self.store.lookup(dict(zip(self.memo.names, map(float, row))))
+                    if values[i] is not None:
+                        self.memo.store(row, values[i])
+
+        missing = [i for i, val in enumerate(values) if val is None]
+        for i, val in zip(missing, map_f([params_list[i] for i in missing], self.f_coarse)):
+            values[i] = val
+            self.memo.store(rows[i], val)
+            if self.store is not None:
+                self.store.store(dict(zip(self.memo.names, map(float, rows[i]))), val)
+
+        self.n_coarse += len(missing)
+        return values
+
+    # rows and params_list describe distinct designs nobody remembers at fine level
+    # returns the value of every design and whether it's a fine value
+    def evaluate(self, rows, params_list, swarm_bval, map_f):
+        coarse = self.coarse_values(rows, params_list, map_f)
+        correction = self.correction()
+        values = [val + correction for val in coarse]
+        fine = [False] * len(rows)
+
+        # the very first batch has no swarm best yet, its best coarse value stands in
+        best = swarm_bval if np.isfinite(swarm_bval) else min(values, default=swarm_bval)
+        while True:
+            promote = [i for i, val in enumerate(values) if not fine[i] and val <= best + self.promote_margin]
+            if not promote:
+                break
+
+            for i, val in zip(promote, map_f([params_list[i] for i in promote])):
+                # a failed solve (f scoring it inf, see cpython_script) says nothing about the coarse bias
+                if np.isfinite(val) and np.isfinite(coarse[i]):
+                    self.offsets.append(val - coarse[i])
+                values[i] = val
+                fine[i] = True
+
+            self.n_fine += len(promote)
+            best = min([swarm_bval] + [val for val, is_fine in zip(values, fine) if is_fine])
+
+        return values, fine
+
+    def report(self):
+        return (f'fidelity: {self.n_coarse} coarse solves, {self.n_fine} promoted to fine, '
+                f'mean fine - coarse offset {self.correction():.4g}')
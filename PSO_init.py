@@ -0,0 +1,106 @@
+# starting positions for a swarm: space-filling, constraint-aware, and bounded no matter how tight the constraint is
+# rows are parameter values in sorted-name order, same as PSO_memo, PSO_repair and array_PSO
+#
+# candidates come in batches of batch_size rows from one of
+#   'sobol'   scrambled Sobol sequence, the sequence carries on from batch to batch so the accepted points stay evenly spread (default)
+#   'lhs'     Latin hypercube, every parameter's range cut into batch_size strata with one candidate each
+#   'random'  uniform, what the rejection loop used to do
+# discrete params take lattice point floor(u * n_steps) of their lattice (see PSO_lattice), so every legal value gets the same share.
+# duplicates (two candidates on the same lattice point) are dropped, the constraint is asked about each candidate in turn and the
+# first n feasible ones are kept. after max_batches batches whatever is still missing is repaired from the accepted ones (PSO_repair),
+# nothing ever loops forever, and nothing the size of points_per_dim^d gets built. if not a single candidate was feasible there's
+# nothing to repair towards: that's a ValueError, unless the repair has a constraint_margin to project with
+#
+#     rows, vels = initializer.sample(16)
+
+import numpy as np
+from scipy.stats import qmc
+from PSO_lattice import lattice_of
+from PSO_repair import PSO_repair
+
+METHODS = ('sobol', 'lhs', 'random')
+
+
+class PSO_initializer:
+    def __init__(self, params, constraint_func, method='sobol', batch_size=64, max_batches=20, repair=None):
+        if method not in METHODS:
+            raise ValueError(f'Unknown initialization {method}, use one of {METHODS}')
+
+        self.templates = sorted(params, key=lambda p: p.name)
+        self.names = [param.name for param in self.templates]
+        self.method = method
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.repair = PSO_repair(params, constraint_func) if repair is None else repair
+
+        self.discrete = np.array([param.discrete for param in self.templates], dtype=bool)
+        self.min_vals = np.array([param.min_val for param in self.templates], dtype=float)
+        self.max_vals = np.array([param.max_val for param in self.templates], dtype=float)
+        self.discretizations = np.array([param.discretization if param.discrete else 0 for param in self.templates], dtype=float)
+        self.n_steps = np.array([lattice_of(param).n_steps if param.discrete else 0 for param in self.templates])
+
+        self.stats = {'candidates': 0, 'duplicates': 0, 'accepted': 0, 'repaired': 0}
+
+    # batch_size points of the unit cube, from the sampler made for this call to sample()
+    def unit_batch(self, sampler, batch_size):
+        if self.method == 'sobol':
+            return sampler.random(batch_size)
+        if self.method == 'lhs':
+            return qmc.LatinHypercube(len(self.names), seed=np.random.randint(2 ** 31)).random(batch_size)
+        return np.random.uniform(size=(batch_size, len(self.names)))
+
+    # unit cube -> box, discrete columns onto their lattice (rounded to 2 decimals like myround)
+    def scale(self, units):
+        rows = self.min_vals + units * (self.max_vals - self.min_vals)
+        steps = np.minimum(np.floor(units[:, self.discrete] * self.n_steps[self.discrete]), self.n_steps[self.discrete] - 1)
+        rows[:, self.discrete] = np.round(self.min_vals[self.discrete] + steps * self.discretizations[self.discrete], 2)
+        return rows
+
+    # n starting rows and their velocities (uniform within +-0.2 of each range, another day another magic number)
+    def sample(self, n):
+        # powers of two keep the Sobol points balanced
+        batch_size = 2 ** int(np.ceil(np.log2(max(self.batch_size, 2 * n))))
+        # seeded from np.random, so np.random.seed() still makes runs repeatable
+        sampler = qmc.Sobol(len(self.names), scramble=True, seed=np.random.randint(2 ** 31)) if self.method == 'sobol' else None
+
+        accepted, seen = [], set()
+        for _ in range(self.max_batches):
+            for row in self.scale(self.unit_batch(sampler, batch_size)):
+                self.stats['candidates'] += 1
+                key = tuple(row)
+                if key in seen:
+                    self.stats['duplicates'] += 1
+                    continue
+                seen.add(key)
+
+                if self.repair.feasible(row):
+                    accepted.append(row)
+                    if len(accepted) == n:
+                        break
+            if len(accepted) == n:
+                break
+
+        self.stats['accepted'] += len(accepted)
+        rows = np.array(accepted).reshape(-1, len(self.names))
+
+        # repair needs a feasible point to pull the rest towards, or a constraint_margin to project them with
+        if not len(rows) and self.repair.constraint_margin is None:
+            tried = self.stats['candidates'] - self.stats['duplicates']
+            raise ValueError(f'No feasible starting position among {tried} distinct {self.method} candidates ({self.max_batches} batches of {batch_size}), '
+                             f'the acceptance rate is below {1 / max(tried, 1):.1e}. Check constraint_func, raise max_batches or give the optimizer a constraint_margin')
+
+        # the rest: more candidates, repaired towards the accepted points (or SLSQP-projected if there are none)
+        missing = n - len(rows)
+        if missing:
+            self.stats['repaired'] += missing
+            extra = self.scale(self.unit_batch(sampler, batch_size)[:missing])
+            rows = np.vstack([rows, self.repair.repair_rows(extra, rows)])
+
+        vels = np.random.uniform(-1, 1, rows.shape) * (self.max_vals - self.min_vals) * 0.2
+        return rows, vels
+
+    def report(self):
+        stats = self.stats
+        rate = stats['accepted'] / max(stats['candidates'] - stats['duplicates'], 1)
+        return (f'initialization ({self.method}): {stats["accepted"] + stats["repaired"]} particles from {stats["candidates"]} candidates, '
+                f'acceptance rate {rate:.1%}, {stats["duplicates"]} duplicates, {stats["repaired"]} repaired')
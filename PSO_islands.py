@@ -0,0 +1,212 @@
+# island model: n_islands independent swarms, each an optimizer of its own in its own process, trading their best particles
+# every migration_every iterations. for objectives cheap enough that the optimizer is the bottleneck (PSO_tests, a surrogate),
+# every core gets a swarm, and the islands exploring different basins keep the whole thing from collapsing onto the first one it finds
+#
+# migration is asynchronous: an island sends its n_migrants best particle bests to its neighbours and takes in whatever migrants
+# have arrived by then, nobody waits for the slowest island. a migrant replaces the particle with the worst best, if it's better
+# topology says who sends to whom:
+#   'ring'   island i -> island i + 1 (the default, good ideas spread slowly so the islands stay diverse)
+#   'all'    every island -> every other island
+#   or a dict {i: [islands i sends to]}
+#
+# the parent process merges the islands into one run log (see PSO_log.py, the particles of island 0 first, then island 1...)
+# and one text log, and returns the best of them all, same as PSO_optimizer.optimize
+#
+# f, constraint_func and optimizer_kwargs go to the island processes, under the spawn start method (windows) they have to pickle:
+# module-level functions, no lambdas. a PSO_store doesn't survive the trip (SQLite connections don't cross processes), leave it out
+#
+#     islands = PSO_islands(params, f, constraint_func)
+#     bparams, bval = islands.optimize(4, 16, 0.8, 0.1, 0.1, 5, 1, max_iterations=100)
+
+import datetime
+import traceback
+import queue
+import multiprocessing
+import numpy as np
+from config import path
+from mixedvar_PSO import PSO_param, PSO_optimizer
+from PSO_log import PSO_run_log
+
+# seconds between checks that every island process is still alive, while the parent waits on them
+POLL = 5
+
+
+def neighbours(topology, n_islands):
+    if topology == 'ring':
+        return {i: [(i + 1) % n_islands] if n_islands > 1 else [] for i in range(n_islands)}
+    if topology == 'all':
+        return {i: [j for j in range(n_islands) if j != i] for i in range(n_islands)}
+    if isinstance(topology, dict):
+        return {i: list(topology.get(i, [])) for i in range(n_islands)}
+
+    raise ValueError(f'Unknown topology {topology}, use ring, all, or a dict of who sends to whom')
+
+
+# the queue pickles in a background thread, after the array core may already have moved its arrays on
+def snapshot_copy(swarm):
+    return {field: np.copy(value) if isinstance(value, np.ndarray) else value for field, value in swarm.snapshot().items()}
+
+
+# one island, in its own process: runs its optimizer one iteration at a time, reporting every iteration's snapshot to the parent
+def _island(index, seed, params, f, constraint_func, optimizer_class, optimizer_kwargs, run_args, migration, inboxes, targets, results):
+    try:
+        np.random.seed(None if seed is None else seed + index)
+        # migrants nobody picked up (their island already stopped) mustn't keep this process from exiting
+        for inbox in inboxes:
+            inbox.cancel_join_thread()
+        optimizer = optimizer_class(params, f, constraint_func, **optimizer_kwargs)
+
+        # max_iterations=0: place the swarm and evaluate it, then step run() along one iteration at a time
+        optimizer.optimize(run_args['n_particles'], run_args['w_inertia'], run_args['c_cog'], run_args['c_social'], run_args['range_count_thresh'],
+                           run_args['convergence_range'], max_iterations=0, logging=False, box_init=run_args['box_init'], termination=run_args['termination'])
+        results.put(('snapshot', index, 0, snapshot_copy(optimizer.swarm)))
+        migrated = 0
+
+        for iteration in range(1, run_args['max_iterations'] + 1):
+            optimizer.run_args['max_iterations'] = iteration
+            optimizer.stop_reason = None
+            optimizer.run()
+            snapshot = snapshot_copy(optimizer.swarm)
+            results.put(('snapshot', index, iteration, snapshot))
+
+            if iteration % migration['every'] == 0:
+                best = np.argsort(snapshot['bvals'])[:migration['n_migrants']]
+                for target in targets:
+                    inboxes[target].put((np.array(snapshot['bpos'][best]), np.array(snapshot['bvals'][best])))
+
+                while True:
+                    try:
+                        rows, vals = inboxes[index].get_nowait()
+                    except queue.Empty:
+                        break
+                    optimizer.swarm.immigrate(rows, vals)
+                    migrated += len(rows)
+
+            if not optimizer.stop_reason.startswith('max_iterations'):
+                break
+
+        results.put(('done', index, {'bpos': optimizer.swarm.snapshot()['swarm_bpos'], 'bval': optimizer.swarm.bval, 'iterations': optimizer.iterations,
+                                     'n_evaluations': optimizer.n_evaluations, 'stop_reason': optimizer.stop_reason, 'migrated': migrated}))
+    except Exception:
+        results.put(('error', index, traceback.format_exc()))
+
+
+class PSO_islands:
+    def __init__(self, params, f, constraint_func=None, optimizer_class=PSO_optimizer, **optimizer_kwargs):
+        self.params = params
+        self.f = f
+        self.constraint_func = constraint_func
+        self.optimizer_class = optimizer_class
+        self.optimizer_kwargs = optimizer_kwargs
+        self.templates = sorted(params, key=lambda p: p.name)
+
+    # n_particles per island. the other settings are optimize()'s, for every island. termination policies are checked per island
+    # (a max_evaluations budget is each island's own). seed: island i seeds np.random with seed + i, None draws fresh seeds
+    def optimize(self, n_islands, n_particles, w_inertia, c_cog, c_social, range_count_thresh, convergence_range, max_iterations=200, logging=True,
+                 box_init=False, termination=None, migration_every=5, n_migrants=1, topology='ring', seed=None):
+        run_args = {'n_particles': n_particles, 'w_inertia': w_inertia, 'c_cog': c_cog, 'c_social': c_social, 'range_count_thresh': range_count_thresh,
+                    'convergence_range': convergence_range, 'max_iterations': max_iterations, 'box_init': box_init, 'termination': termination}
+        migration = {'every': migration_every, 'n_migrants': n_migrants}
+        targets = neighbours(topology, n_islands)
+
+        self.names = [param.name for param in self.templates]
+        self.n_islands = n_islands
+        self.log_lines = []
+        if logging:
+            self.log_lines.append(f'PSO_islands initialized at {datetime.datetime.now()}, {n_islands} islands of {n_particles} particles, '
+                                  f'{n_migrants} migrants every {migration_every} iterations, topology {topology}')
+            self.run_log = PSO_run_log(path('logging_run_write'), self.names, n_islands * n_particles)
+
+        inboxes = [multiprocessing.Queue() for _ in range(n_islands)]
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=_island, args=(i, seed, self.params, self.f, self.constraint_func, self.optimizer_class,
+                                                                   self.optimizer_kwargs, run_args, migration, inboxes, targets[i], results))
+                     for i in range(n_islands)]
+        for process in processes:
+            process.start()
+
+        try:
+            self.finals = self.collect(processes, results, logging)
+        finally:
+            for process in processes:
+                process.join(timeout=POLL)
+                if process.is_alive():
+                    process.terminate()
+
+        best = min(range(n_islands), key=lambda i: self.finals[i]['bval'])
+        self.n_evaluations = sum(final['n_evaluations'] for final in self.finals.values())
+        bparams = {PSO_param(param.name, param.discrete, param.min_val, param.max_val, self.finals[best]['bpos'][j], None, param.discretization)
+                   for j, param in enumerate(self.templates)}
+        bval = float(self.finals[best]['bval'])
+
+        if logging:
+            for i, final in sorted(self.finals.items()):
+                self.log_lines.append(f'Island {i}: best value {final["bval"]} after {final["iterations"]} iterations, {final["n_evaluations"]} evaluations, '
+                                      f'{final["migrated"]} migrants received, {final["stop_reason"]}')
+            self.log_lines.append(f'Finished after {self.n_evaluations} evaluations, best value: {bval} (island {best}), {bparams}')
+            print('\n'.join(self.log_lines[-n_islands - 1:]))
+            self.write_log()
+
+        return bparams, bval
+
+    # reads the islands' messages until they're all done, writing a merged record every time each island has reported an iteration
+    # (an island that stopped early keeps its last snapshot in the records after). returns every island's 'done' message
+    def collect(self, processes, results, logging):
+        pending = {}        # iteration -> {island: snapshot}
+        last = {}           # island -> (iteration, snapshot) of its latest report
+        finals = {}
+        next_iteration = 0
+
+        while len(finals) < len(processes):
+            try:
+                kind, index, *payload = results.get(timeout=POLL)
+            except queue.Empty:
+                dead = [i for i, process in enumerate(processes) if i not in finals and not process.is_alive()]
+                if dead:
+                    raise RuntimeError(f'Island processes {dead} died without finishing (exit codes {[processes[i].exitcode for i in dead]})')
+                continue
+
+            if kind == 'error':
+                raise RuntimeError(f'Island {index} failed:\n{payload[0]}')
+            if kind == 'done':
+                finals[index] = payload[0]
+            else:
+                iteration, snapshot = payload
+                last[index] = (iteration, snapshot)
+                pending.setdefault(iteration, {})[index] = snapshot
+
+            # an island can be counted on for next_iteration if it reported it, or it's done and reported everything it ever will
+            # (and once nobody reported it, every island is past its last iteration)
+            while True:
+                snapshots = pending.get(next_iteration, {})
+                if not snapshots or any(i not in snapshots and (i not in finals or last[i][0] >= next_iteration) for i in range(len(processes))):
+                    break
+
+                merged = [snapshots[i] if i in snapshots else last[i][1] for i in range(len(processes))]
+                pending.pop(next_iteration, None)
+                if logging:
+                    self.append_log(next_iteration, merged)
+                next_iteration += 1
+
+        return finals
+
+    def append_log(self, iteration, snapshots):
+        best = min(range(len(snapshots)), key=lambda i: snapshots[i]['swarm_bval'])
+        self.run_log.append(iteration, **{field: np.concatenate([snapshot[field] for snapshot in snapshots])
+                                          for field in ('pos', 'vel', 'vals', 'bpos', 'bvals')},
+                            swarm_bpos=snapshots[best]['swarm_bpos'], swarm_bval=snapshots[best]['swarm_bval'])
+
+        line = f'Iteration {iteration}, best value: {snapshots[best]["swarm_bval"]} (island {best}), island bests: ' + \
+               ', '.join(f'{snapshot["swarm_bval"]:.6g}' for snapshot in snapshots)
+        self.log_lines.append(line)
+        print(line)
+
+        if iteration == 0 or len(self.log_lines) >= 50:
+            self.write_log(clear=iteration == 0)
+
+    def write_log(self, clear=False):
+        with open(path('logging_txt_write'), 'w' if clear else 'a') as f:
+            for line in self.log_lines:
+                f.write(line + '\n')
+
+        self.log_lines = []
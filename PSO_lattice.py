@@ -0,0 +1,52 @@
+# legal values of a discrete PSO_param, and the gaussian jump onto them that discrete moves use
+# a lattice is built once per (min_val, max_val, discretization) and shared by every particle, values are min_val + k * discretization
+#
+# the jump is the same as always: lattice point k gets probability ~ norm.pdf(value_k, loc=target, scale=discretization)
+# but only the window_sds standard deviations around the target are looked at (past 6 the weights are below 1e-8),
+# so a draw costs the same for 10 legal values or 100000, and every particle's draw for a param happens in one go
+
+import numpy as np
+
+_lattices = {}
+
+
+def lattice_of(param):
+    key = (param.min_val, param.max_val, param.discretization)
+    if key not in _lattices:
+        _lattices[key] = PSO_lattice(*key)
+    return _lattices[key]
+
+
+class PSO_lattice:
+    def __init__(self, min_val, max_val, discretization, window_sds=6):
+        self.min_val = min_val
+        self.max_val = max_val
+        self.discretization = discretization
+        self.n_steps = int(np.floor((max_val - min_val) / discretization + 1e-9)) + 1
+        self.offsets = np.arange(-window_sds, window_sds + 1)
+
+    def values(self, steps):
+        return self.min_val + np.asarray(steps) * self.discretization
+
+    # one draw per target, targets is anything array-like
+    def sample(self, targets):
+        targets = np.atleast_1d(np.asarray(targets, dtype=float))
+        centers = (targets - self.min_val) / self.discretization
+
+        # window around the nearest legal step, a target outside the range still gets the end of the lattice
+        nearest = np.clip(np.round(centers), 0, self.n_steps - 1)
+        steps = nearest[:, None] + self.offsets[None, :]
+        inside = (steps >= 0) & (steps < self.n_steps)
+
+        # scale = discretization means one step is one standard deviation
+        weights = np.where(inside, np.exp(-0.5 * (steps - centers[:, None]) ** 2), 0)
+        cdf = np.cumsum(weights, axis=1)
+
+        # a target miles outside the range underflows every weight, it would have landed on the nearest end anyway
+        lost = cdf[:, -1] == 0
+        if np.any(lost):
+            cdf[lost] = np.where(self.offsets >= 0, 1.0, 0.0)
+
+        draws = np.random.rand(len(targets)) * cdf[:, -1]
+        picks = (cdf < draws[:, None]).sum(axis=1)
+        return self.values(steps[np.arange(len(targets)), picks])
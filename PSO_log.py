@@ -0,0 +1,140 @@
+# compact append-only record of a PSO run, just the numbers, one fixed-size record per iteration
+# replaces pickling the whole swarm every iteration: no particles, no PSO_param objects, no objective function,
+# so reading a run back never needs the code that produced it
+#
+# file layout:
+#   b'PSOLOG1\n', 4-byte little-endian header length, JSON header {"names": [...], "n_particles": n}, zero padding to 8 bytes
+#   then records of little-endian float64, each one:
+#       iteration, swarm_bval, swarm_bpos (n_params), pos, vel, bpos (n_particles x n_params each), vals, bvals (n_particles each)
+# columns are the parameter names in sorted order, same as array_PSO and PSO_memo
+#
+# PSO_run_reader memory-maps the file, so opening a huge run is instant and an iteration is only read when you look at it
+
+import os
+import json
+import struct
+import numpy as np
+
+MAGIC = b'PSOLOG1\n'
+DTYPE = np.dtype('<f8')
+
+
+def record_fields(n_particles, n_params):
+    return [('iteration', ()), ('swarm_bval', ()), ('swarm_bpos', (n_params,)),
+            ('pos', (n_particles, n_params)), ('vel', (n_particles, n_params)), ('bpos', (n_particles, n_params)),
+            ('vals', (n_particles,)), ('bvals', (n_particles,))]
+
+
+def record_dtype(n_particles, n_params):
+    return np.dtype([(name, DTYPE, shape) for name, shape in record_fields(n_particles, n_params)])
+
+
+def read_header(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError('Not a PSO run log')
+
+    header_len, = struct.unpack('<I', f.read(4))
+    header = json.loads(f.read(header_len).decode('utf-8'))
+    header['data_offset'] = -(-(len(MAGIC) + 4 + header_len) // 8) * 8     # round up to a multiple of 8
+    return header
+
+
+class PSO_run_log:
+    # clear=False appends to an existing log (resumed runs), after checking it's the same kind of run
+    def __init__(self, filepath, names, n_particles, clear=True):
+        self.filepath = filepath
+        self.names = list(names)
+        self.n_particles = n_particles
+        self.dtype = record_dtype(n_particles, len(self.names))
+
+        if clear or not os.path.exists(filepath):
+            header = json.dumps({'names': self.names, 'n_particles': n_particles}).encode('utf-8')
+            data_offset = -(-(len(MAGIC) + 4 + len(header)) // 8) * 8
+            with open(filepath, 'wb') as f:
+                f.write(MAGIC + struct.pack('<I', len(header)) + header)
+                f.write(b'\0' * (data_offset - len(MAGIC) - 4 - len(header)))
+        else:
+            with open(filepath, 'rb') as f:
+                header = read_header(f)
+            if header['names'] != self.names or header['n_particles'] != n_particles:
+                raise ValueError(f'{filepath} is a log of a different run ({header["names"]}, {header["n_particles"]} particles)')
+
+            # a crash in the middle of append() leaves part of a record behind, drop it
+            data_size = os.path.getsize(filepath) - header['data_offset']
+            with open(filepath, 'r+b') as f:
+                f.truncate(header['data_offset'] + data_size // self.dtype.itemsize * self.dtype.itemsize)
+
+    # swarm_bpos can be None before anything has been evaluated, it's stored as NaNs
+    def append(self, iteration, pos, vel, vals, bpos, bvals, swarm_bpos, swarm_bval):
+        record = np.zeros((), dtype=self.dtype)
+        record['iteration'] = iteration
+        record['swarm_bval'] = swarm_bval
+        record['swarm_bpos'] = np.nan if swarm_bpos is None else swarm_bpos
+        record['pos'] = pos
+        record['vel'] = vel
+        record['bpos'] = bpos
+        record['vals'] = vals
+        record['bvals'] = bvals
+
+        with open(self.filepath, 'ab') as f:
+            f.write(record.tobytes())
+
+
+# one iteration of a run, every array is a read-only view into the memory-mapped file
+class PSO_frame:
+    def __init__(self, record, names):
+        self.names = names
+        self.index = {name: j for j, name in enumerate(names)}
+        self.iteration = int(record['iteration'])
+        self.swarm_bval = float(record['swarm_bval'])
+        self.swarm_bpos = record['swarm_bpos']
+        self.pos = record['pos']
+        self.vel = record['vel']
+        self.bpos = record['bpos']
+        self.vals = record['vals']
+        self.bvals = record['bvals']
+
+    # one column for every particle, e.g. frame.param('pin_width')
+    def param(self, name):
+        return self.pos[:, self.index[name]]
+
+    def bparam(self, name):
+        return self.bpos[:, self.index[name]]
+
+    def swarm_bparam(self, name):
+        return self.swarm_bpos[self.index[name]]
+
+
+class PSO_run_reader:
+    def __init__(self, filepath):
+        self.filepath = filepath
+        with open(filepath, 'rb') as f:
+            header = read_header(f)
+
+        self.names = header['names']
+        self.n_particles = header['n_particles']
+        self.data_offset = header['data_offset']
+        self.dtype = record_dtype(self.n_particles, len(self.names))
+        self.records = None
+        self.refresh()
+
+    # picks up iterations appended since the file was opened (a run that's still going), returns how many there are now
+    def refresh(self):
+        n_records = (os.path.getsize(self.filepath) - self.data_offset) // self.dtype.itemsize
+        if self.records is None or n_records != len(self.records):
+            self.records = np.memmap(self.filepath, dtype=self.dtype, mode='r', offset=self.data_offset, shape=(n_records,)) if n_records else []
+        return len(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, i):
+        return PSO_frame(self.records[i], self.names)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    # whole-run series without touching the rest of each record, e.g. reader.column('swarm_bval')
+    def column(self, field):
+        return np.asarray(self.records[field]) if len(self) else np.array([])
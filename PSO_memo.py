@@ -0,0 +1,115 @@
+# in-run memory of evaluations for PSO_swarm / PSO_array_swarm
+# keys are flat tuples in sorted-name order: discrete params become their lattice index, continuous params stay floats
+# so nothing needs deep-copying or hashing of whole PSO_param objects
+#
+# tolerance > 0 also lets continuous params match a past evaluation that lies within tolerance (euclidean, over the continuous params,
+# discrete params still have to match exactly). neighbours are found with a hash grid of tolerance-sized cells, so a lookup only
+# looks at the 3^(continuous params) cells around the point no matter how much is stored
+#
+# max_size bounds the number of entries, least recently used ones get evicted first
+
+import itertools
+import numpy as np
+from collections import OrderedDict
+
+
+class PSO_memo:
+    def __init__(self, params, tolerance=0, max_size=None):
+        templates = sorted(params, key=lambda p: p.name)
+        self.names = [param.name for param in templates]
+        self.discrete = [param.discrete for param in templates]
+        self.min_vals = [param.min_val for param in templates]
+        self.discretizations = [param.discretization for param in templates]
+        self.continuous_cols = [j for j, discrete in enumerate(self.discrete) if not discrete]
+
+        self.tolerance = tolerance
+        self.max_size = max_size
+        self.entries = OrderedDict()     # key -> value, in least to most recently used order
+
+        self.use_grid = tolerance > 0 and len(self.continuous_cols) > 0
+        if self.use_grid:
+            self.grid = {}      # cell -> set of keys
+            self.neighbour_offsets = list(itertools.product((-1, 0, 1), repeat=len(self.continuous_cols)))
+
+    # values in sorted-name order, from a set of PSO_param objects
+    def row(self, params):
+        vals = {param.name: param.val for param in params}
+        return [vals[name] for name in self.names]
+
+    def key(self, row):
+        return tuple(int(round((val - min_val) / disc)) if discrete else float(val)
+                     for val, discrete, min_val, disc in zip(row, self.discrete, self.min_vals, self.discretizations))
+
+    # the other way round, discrete lattice indices back to values (rounded to 2 decimals like myround)
+    def unkey(self, key):
+        return [round(min_val + val * disc, 2) if discrete else val
+                for val, discrete, min_val, disc in zip(key, self.discrete, self.min_vals, self.discretizations)]
+
+    def cell(self, key):
+        return tuple(val if discrete else int(np.floor(val / self.tolerance)) for val, discrete in zip(key, self.discrete))
+
+    def lookup(self, row):
+        key = self.key(row)
+        val = self.entries.get(key)
+
+        if val is None and self.use_grid:
+            key = self.nearby(key)
+            if key is not None:
+                val = self.entries[key]
+
+        if val is not None:
+            self.entries.move_to_end(key)
+
+        return val
+
+    # closest stored key within tolerance of key, or None
+    def nearby(self, key):
+        cell = self.cell(key)
+        point = np.array([key[j] for j in self.continuous_cols])
+        best_key, best_dist = None, self.tolerance
+
+        for candidate in itertools.chain.from_iterable(self.grid.get(neighbour, ()) for neighbour in self.neighbour_cells(cell)):
+            dist = np.sqrt(sum((candidate[j] - p) ** 2 for j, p in zip(self.continuous_cols, point)))
+            if dist <= best_dist:
+                best_key, best_dist = candidate, dist
+
+        return best_key
+
+    # cells that can hold a point within tolerance of cell: either walk the 3^k block around it, or, while the memo is still sparse,
+    # just check the occupied cells - whichever is fewer
+    def neighbour_cells(self, cell):
+        if len(self.grid) < len(self.neighbour_offsets):
+            return [other for other in self.grid
+                    if all(a == b if discrete else abs(a - b) <= 1 for a, b, discrete in zip(cell, other, self.discrete))]
+
+        neighbours = []
+        for offsets in self.neighbour_offsets:
+            neighbour = list(cell)
+            for j, offset in zip(self.continuous_cols, offsets):
+                neighbour[j] += offset
+            neighbours.append(tuple(neighbour))
+
+        return neighbours
+
+    def store(self, row, val):
+        key = self.key(row)
+        if key not in self.entries and self.use_grid:
+            self.grid.setdefault(self.cell(key), set()).add(key)
+
+        self.entries[key] = val
+        self.entries.move_to_end(key)
+
+        if self.max_size is not None and len(self.entries) > self.max_size:
+            old_key, _ = self.entries.popitem(last=False)
+            if self.use_grid:
+                cell = self.cell(old_key)
+                self.grid[cell].discard(old_key)
+                if not self.grid[cell]:
+                    del self.grid[cell]
+
+    # every evaluation held, as a list of rows and a list of values (e.g. to refit a surrogate after resume)
+    def items(self):
+        return [self.unkey(key) for key in self.entries], list(self.entries.values())
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,197 @@
+# constraint repair for PSO_optimizer / PSO_array_optimizer: brings positions that left the feasible region back in
+# rows are parameter values in sorted-name order, same as PSO_memo and array_PSO
+#
+# cheapest thing first, per row:
+#   1. clip to the box and snap discrete params to their lattice. if constraint_func is happy, done (one constraint call)
+#   2. projection onto the constraint boundary: bisect along the segment to the nearest known-feasible point (anchors, normally the
+#      particle bests). every infeasible row of a batch moves through the bisection together, n_bisections constraint calls per row.
+#      without anchors (single calls, an initialization that found nothing feasible) there's only SLSQP closest-point projection,
+#      and only if constraint_margin is given: SLSQP needs a continuous constraint, constraint_func's True/False gives it nothing
+#      to follow. constraint_margin(params) takes the same set of PSO_param as constraint_func and returns how far inside
+#      the feasible region they are, >= 0 has to mean constraint_func says yes (for value < limit that's limit - value - a little)
+#      without it the row goes to step 3 as it is
+#   3. discrete params: the projected point gets snapped to the closest lattice point that still satisfies the constraint.
+#      lattice points are generated lazily, closest first, instead of building a (2M+1)^d grid. after max_candidates tries
+#      the anchor itself is used (no anchor -> ValueError)
+
+import copy
+import heapq
+import time
+import numpy as np
+import numpy.linalg as LA
+import scipy.optimize as optimize
+from PSO_lattice import lattice_of
+
+
+class PSO_repair:
+    def __init__(self, params, constraint_func, constraint_margin=None, n_bisections=20, max_candidates=1000):
+        self.templates = sorted(params, key=lambda p: p.name)
+        self.names = [param.name for param in self.templates]
+        self.constraint_func = constraint_func
+        self.constraint_margin = constraint_margin
+        self.n_bisections = n_bisections
+        self.max_candidates = max_candidates
+
+        self.discrete = np.array([param.discrete for param in self.templates], dtype=bool)
+        self.min_vals = np.array([param.min_val for param in self.templates], dtype=float)
+        self.max_vals = np.array([param.max_val for param in self.templates], dtype=float)
+        self.discretizations = np.array([param.discretization if param.discrete else 1 for param in self.templates], dtype=float)
+        self.n_steps = np.array([lattice_of(param).n_steps if param.discrete else 1 for param in self.templates])
+        self.discrete_cols = list(np.flatnonzero(self.discrete))
+
+        self.stats = {'rows': 0, 'feasible': 0, 'projected': 0, 'slsqp': 0, 'searched': 0, 'candidates': 0,
+                      'fallback': 0, 'constraint_calls': 0, 'seconds': 0.0}
+
+    # values in sorted-name order, from a set of PSO_param objects
+    def row(self, params):
+        vals = {param.name: param.val for param in params}
+        return [vals[name] for name in self.names]
+
+    # the other way round, a fresh set of PSO_param for constraint_func / constraint_margin
+    def row_params(self, row):
+        params = set()
+        for template, val in zip(self.templates, row):
+            param = copy.copy(template)
+            param.val = val
+            params.add(param)
+        return params
+
+    def describe(self, row):
+        return ', '.join(f'{name}={float(val):g}' for name, val in zip(self.names, row))
+
+    def feasible(self, row):
+        self.stats['constraint_calls'] += 1
+        return bool(self.constraint_func(self.row_params(row)))
+
+    # same rounding as myround()
+    def snap(self, rows):
+        rows = np.array(rows, dtype=float)
+        disc = self.discretizations[self.discrete]
+        rows[..., self.discrete] = np.round(disc * np.round(rows[..., self.discrete] / disc), 2)
+        return rows
+
+    # rows: (n, n_params). anchors: (m, n_params) positions known to satisfy the constraint, can be empty
+    def repair_rows(self, rows, anchors=()):
+        start = time.time()
+        rows = self.snap(np.clip(np.array(rows, dtype=float), self.min_vals, self.max_vals))
+        anchors = np.array(anchors, dtype=float).reshape(-1, len(self.names))
+        self.stats['rows'] += len(rows)
+
+        infeasible = [i for i, row in enumerate(rows) if not self.feasible(row)]
+        self.stats['feasible'] += len(rows) - len(infeasible)
+
+        if infeasible:
+            if len(anchors):
+                # nearest anchor for every infeasible row in one go
+                dists = LA.norm(rows[infeasible, None, :] - anchors[None, :, :], axis=2)
+                row_anchors = anchors[np.argmin(dists, axis=1)]
+                projected = self.bisect(rows[infeasible], row_anchors)
+                self.stats['projected'] += len(infeasible)
+            elif self.constraint_margin is not None:
+                row_anchors = [None] * len(infeasible)
+                projected = [self.slsqp_project(rows[i]) for i in infeasible]
+                self.stats['slsqp'] += len(infeasible)
+            else:
+                row_anchors = [None] * len(infeasible)
+                projected = rows[infeasible]
+
+            for i, point, anchor in zip(infeasible, projected, row_anchors):
+                rows[i] = self.nearest_feasible(point, anchor)
+
+        self.stats['seconds'] += time.time() - start
+        return rows
+
+    # largest step from each anchor towards its row that still satisfies the constraint
+    def bisect(self, rows, anchors):
+        lo = np.zeros(len(rows))
+        hi = np.ones(len(rows))
+        for _ in range(self.n_bisections):
+            mid = (lo + hi) / 2
+            points = anchors + mid[:, None] * (rows - anchors)
+            ok = np.array([self.feasible(point) for point in points])
+            lo = np.where(ok, mid, lo)
+            hi = np.where(ok, hi, mid)
+
+        return anchors + lo[:, None] * (rows - anchors)
+
+    # closest point to row (euclidean) with constraint_margin >= 0 and within the bounds, discrete params still continuous afterwards
+    def slsqp_project(self, row):
+        result = optimize.minimize(
+            lambda x: LA.norm(x - row),
+            row,
+            method='SLSQP',
+            constraints={'type': 'ineq', 'fun': lambda x: float(self.constraint_margin(self.row_params(x)))},
+            bounds=list(zip(self.min_vals, self.max_vals))
+        )
+
+        if not result.success:
+            raise ValueError(f'Could not project {self.describe(row)} onto constraint_margin >= 0 with SLSQP: {result.message}')
+
+        return np.clip(result.x, self.min_vals, self.max_vals)
+
+    # closest lattice point to point that satisfies the constraint, continuous params stay where they are
+    def nearest_feasible(self, point, anchor=None):
+        candidates = self.lattice_neighbours(point)
+        tried = 0
+        for candidate in candidates:
+            if tried >= self.max_candidates:
+                break
+            tried += 1
+            self.stats['candidates'] += 1
+            if self.feasible(candidate):
+                self.stats['searched'] += tried > 1
+                return candidate
+
+        self.stats['searched'] += tried > 0
+        if anchor is not None:
+            self.stats['fallback'] += 1
+            return anchor
+
+        where = f'among the {tried} closest lattice points to' if self.discrete_cols else 'at'
+        how = 'the SLSQP projection' if self.constraint_margin is not None else 'the clipped position'
+        hint = '' if self.constraint_margin is not None else ' (a constraint_margin would let SLSQP project onto the constraint)'
+        raise ValueError(f'Could not find a point satisfying the constraint {where} {how} [{self.describe(point)}], '
+                         f'and there is no feasible point to fall back on{hint}')
+
+    # lattice points around point, closest first. every discrete param gets its own list of lattice steps sorted by distance,
+    # and a heap walks the combinations of positions in those lists best-first, so only what gets looked at is ever built
+    def lattice_neighbours(self, point):
+        point = np.asarray(point, dtype=float)
+        if not self.discrete_cols:
+            yield point
+            return
+
+        orders = []
+        for j in self.discrete_cols:
+            u = (point[j] - self.min_vals[j]) / self.discretizations[j]
+            steps = np.arange(self.n_steps[j])
+            dists = (steps - u) ** 2
+            order = np.argsort(dists, kind='stable')
+            orders.append((steps[order], dists[order]))
+
+        def cost(ranks):
+            return sum(dists[r] for (_, dists), r in zip(orders, ranks))
+
+        start = (0,) * len(orders)
+        heap = [(cost(start), start)]
+        seen = {start}
+        while heap:
+            _, ranks = heapq.heappop(heap)
+
+            candidate = point.copy()
+            for j, (steps, _), r in zip(self.discrete_cols, orders, ranks):
+                candidate[j] = np.round(self.min_vals[j] + steps[r] * self.discretizations[j], 2)
+            yield candidate
+
+            for k in range(len(ranks)):
+                if ranks[k] + 1 < len(orders[k][0]):
+                    successor = ranks[:k] + (ranks[k] + 1,) + ranks[k + 1:]
+                    if successor not in seen:
+                        seen.add(successor)
+                        heapq.heappush(heap, (cost(successor), successor))
+
+    def report(self):
+        stats = self.stats
+        return (f'repair: {stats["rows"]} positions, {stats["feasible"]} feasible after clipping, {stats["projected"]} projected, '
+                f'{stats["slsqp"]} via SLSQP, {stats["searched"]} needed a lattice search ({stats["candidates"]} candidates), '
+                f'{stats["fallback"]} fell back to an anchor, {stats["constraint_calls"]} constraint calls, {stats["seconds"]:.2f}s')
@@ -0,0 +1,238 @@
+# replay of a PSO run log (see PSO_log.py) as a video, a gif, or a live window following a run that's still going
+# IN ORDER TO WRITE MP4 YOU NEED FFMPEG ON THE PATH, gifs only need pillow
+#
+# the log is memory-mapped and read one iteration at a time, so a replay never holds more than a frame (and the finished pngs on disk)
+# frames are drawn by a pool of worker processes, each with its own reader and figure, and encoded once they're all there
+#
+# what goes on the axes:
+#   two of the parameters:  python PSO_replay.py --x pin_width --y n_width
+#   all of them at once:    python PSO_replay.py --projection pca     (first two principal axes of the whole run, each parameter scaled to its range)
+# particles are coloured by their value, pluses are the particle bests, the cross is the swarm best
+#
+#   python PSO_replay.py --out replay.mp4 replay.gif --every 2 --workers 8
+#   python PSO_replay.py --tail                                        (redraws as new iterations come in, ctrl+c to stop)
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+from config import path
+from PSO_log import PSO_run_reader
+
+# iterations read at a time when a whole-run statistic (axis limits, projection) is worked out
+CHUNK = 256
+
+
+# what a particle position (a row, parameters in the log's column order) becomes on screen
+# plain numpy arrays, so it pickles over to the worker processes
+class replay_view:
+    def __init__(self, names, x=None, y=None, projection=None):
+        self.names = names
+        self.projection = projection
+        if projection is None:
+            x = names[0] if x is None else x
+            y = names[min(1, len(names) - 1)] if y is None else y
+            for name in (x, y):
+                if name not in names:
+                    raise ValueError(f'{name} is not a parameter of this run, it has {names}')
+
+            self.labels = (x, y)
+            self.axes = np.zeros((len(names), 2))
+            self.axes[names.index(x), 0] = 1
+            self.axes[names.index(y), 1] = 1
+            self.center = np.zeros(len(names))
+            self.scale = np.ones(len(names))
+        elif projection != 'pca':
+            raise ValueError(f'Unknown projection {projection}, only pca')
+
+        self.limits = None
+
+    # rows: (..., n_params) -> (..., 2)
+    def project(self, rows):
+        return (rows - self.center) / self.scale @ self.axes
+
+    def chunks(self, reader):
+        for start in range(0, len(reader), CHUNK):
+            yield np.asarray(reader.records['pos'][start:start + CHUNK]).reshape(-1, len(self.names))
+
+    # pca axes and the axis limits from every position in the run, streamed through CHUNK iterations at a time
+    def fit(self, reader):
+        if self.projection == 'pca':
+            low, high = np.full(len(self.names), np.inf), np.full(len(self.names), -np.inf)
+            total, outer, count = np.zeros(len(self.names)), np.zeros((len(self.names), len(self.names))), 0
+            for rows in self.chunks(reader):
+                low, high = np.minimum(low, rows.min(axis=0)), np.maximum(high, rows.max(axis=0))
+                total += rows.sum(axis=0)
+                outer += rows.T @ rows
+                count += len(rows)
+
+            self.center = total / count
+            self.scale = np.where(high > low, high - low, 1)
+            cov = (outer / count - np.outer(self.center, self.center)) / np.outer(self.scale, self.scale)
+            eigvals, eigvecs = np.linalg.eigh(cov)
+            self.axes = eigvecs[:, ::-1][:, :2]
+            share = eigvals[::-1][:2] / max(eigvals.sum(), 1e-12)
+            self.labels = tuple(f'PC{k + 1} ({share[k]:.0%}): ' + ' '.join(f'{w:+.2f} {name}' for w, name in zip(self.axes[:, k], self.names))
+                                for k in range(2))
+
+        low, high = np.full(2, np.inf), np.full(2, -np.inf)
+        for rows in self.chunks(reader):
+            projected = self.project(rows)
+            low, high = np.minimum(low, projected.min(axis=0)), np.maximum(high, projected.max(axis=0))
+
+        margin = 0.05 * np.maximum(high - low, 1e-9)
+        self.limits = (low - margin, high + margin)
+
+
+# one figure, its artists updated for every frame
+class replay_figure:
+    def __init__(self, view, vrange=None):
+        import matplotlib.pyplot as plt
+
+        self.view = view
+        self.fig, self.ax = plt.subplots(figsize=(8, 6), dpi=100)
+        self.particles = self.ax.scatter([], [], c=[], s=36, cmap='viridis')
+        if vrange is not None:
+            self.particles.set_clim(*vrange)
+        self.pbests, = self.ax.plot([], [], '+', color='orange', markersize=10)
+        self.sbest, = self.ax.plot([], [], 'rx', markersize=10)
+        self.text = self.ax.text(0.02, 0.95, '', transform=self.ax.transAxes)
+
+        self.ax.set_xlabel(view.labels[0], fontsize=8)
+        self.ax.set_ylabel(view.labels[1], fontsize=8)
+        self.fig.colorbar(self.particles, ax=self.ax, label='value')
+
+    def draw(self, frame):
+        self.ax.set_xlim(self.view.limits[0][0], self.view.limits[1][0])
+        self.ax.set_ylim(self.view.limits[0][1], self.view.limits[1][1])
+
+        self.particles.set_offsets(self.view.project(np.asarray(frame.pos)))
+        self.particles.set_array(np.asarray(frame.vals))
+        pbests = self.view.project(np.asarray(frame.bpos))
+        self.pbests.set_data(pbests[:, 0], pbests[:, 1])
+        sbest = self.view.project(np.asarray(frame.swarm_bpos))
+        self.sbest.set_data([sbest[0]], [sbest[1]])
+        self.text.set_text(f'Iteration {frame.iteration}, best value: {frame.swarm_bval:.6g}')
+
+
+# per worker process: its own reader on the memory-mapped log, and its own figure
+_worker = {}
+
+def _start_worker(filepath, view, vrange):
+    import matplotlib
+    matplotlib.use('Agg')
+    _worker['reader'] = PSO_run_reader(filepath)
+    _worker['figure'] = replay_figure(view, vrange)
+
+def _render(job):
+    i, png_path = job
+    figure = _worker['figure']
+    figure.draw(_worker['reader'][i])
+    figure.fig.savefig(png_path)
+    return png_path
+
+
+# value range for the colour scale, the spread of the run's values without the outliers of the first iterations
+def value_range(reader):
+    vals = reader.column('vals')
+    vals = vals[np.isfinite(vals)]
+    if not len(vals):
+        return None
+    return tuple(np.percentile(vals, [2, 98]))
+
+
+def encode(pngs, out_path, fps):
+    if out_path.endswith('.gif'):
+        from PIL import Image
+
+        frames = (Image.open(png) for png in pngs)
+        first = next(frames)
+        first.save(out_path, save_all=True, append_images=frames, duration=int(1000 / fps), loop=0)
+        return
+
+    if shutil.which('ffmpeg') is None:
+        raise RuntimeError(f'ffmpeg is not on the PATH, install it or write a .gif instead of {out_path}')
+
+    folder = os.path.dirname(pngs[0])
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-framerate', str(fps), '-i', os.path.join(folder, 'frame_%06d.png'),
+                    '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', out_path], check=True)
+
+
+# renders iterations start, start + every, ... of the log to every path in out_paths (.mp4 through ffmpeg, .gif through pillow)
+def replay(filepath, out_paths, x=None, y=None, projection=None, every=1, start=0, stop=None, workers=None, fps=2):
+    reader = PSO_run_reader(filepath)
+    view = replay_view(reader.names, x, y, projection)
+    view.fit(reader)
+    indices = range(start, len(reader) if stop is None else min(stop, len(reader)), every)
+    if not len(indices):
+        raise ValueError(f'No iterations to replay in {filepath}')
+
+    folder = tempfile.mkdtemp(prefix='PSO_replay_')
+    try:
+        jobs = [(i, os.path.join(folder, f'frame_{k:06d}.png')) for k, i in enumerate(indices)]
+        workers = min(workers or os.cpu_count() or 1, len(jobs))
+        with multiprocessing.Pool(workers, initializer=_start_worker, initargs=(filepath, view, value_range(reader))) as pool:
+            pngs = list(pool.imap(_render, jobs, chunksize=max(1, len(jobs) // (4 * workers))))
+
+        for out_path in out_paths:
+            encode(pngs, out_path, fps)
+            print(f'{len(pngs)} frames written to {out_path}')
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+# live window following a run that's still writing its log, redrawn whenever an iteration comes in
+def tail(filepath, x=None, y=None, projection=None, poll=1.0):
+    import matplotlib.pyplot as plt
+
+    reader = PSO_run_reader(filepath)
+    while not reader.refresh():
+        time.sleep(poll)
+
+    view = replay_view(reader.names, x, y, projection)
+    view.fit(reader)
+    figure = replay_figure(view, value_range(reader))
+    plt.ion()
+
+    shown, fitted = 0, len(reader)
+    while plt.fignum_exists(figure.fig.number):
+        if reader.refresh() > shown:
+            # the swarm wanders off the first iterations' box (and the pca axes drift), refit whenever the run has doubled
+            if len(reader) >= 2 * fitted:
+                view.fit(reader)
+                if value_range(reader) is not None:
+                    figure.particles.set_clim(*value_range(reader))
+                fitted = len(reader)
+            shown = len(reader)
+            figure.draw(reader[shown - 1])
+            figure.fig.canvas.draw_idle()
+        plt.pause(poll)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a PSO run log')
+    parser.add_argument('--log', default=path('logging_run_read'))
+    parser.add_argument('--out', nargs='+', default=[path('vid_output'), path('gif_output')], help='.mp4 and/or .gif files to write')
+    parser.add_argument('--x', help='parameter on the x axis, the first one by default')
+    parser.add_argument('--y', help='parameter on the y axis, the second one by default')
+    parser.add_argument('--projection', choices=['pca'], help='show every parameter at once instead of --x and --y')
+    parser.add_argument('--every', type=int, default=1, help='only every n-th iteration')
+    parser.add_argument('--start', type=int, default=0)
+    parser.add_argument('--stop', type=int)
+    parser.add_argument('--workers', type=int, help='rendering processes, one per core by default')
+    parser.add_argument('--fps', type=float, default=2)
+    parser.add_argument('--tail', action='store_true', help='follow a running optimization in a window instead of writing files')
+    args = parser.parse_args(argv)
+
+    if args.tail:
+        tail(args.log, args.x, args.y, args.projection)
+    else:
+        replay(args.log, args.out, args.x, args.y, args.projection, args.every, args.start, args.stop, args.workers, args.fps)
+
+
+if __name__ == '__main__':
+    main()
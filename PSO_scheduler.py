@@ -0,0 +1,265 @@
+# splits one machine's cores and GPUs between the solves running on it at the same time
+# the bridge (ansys_socket, ansys_queue) asks for every evaluation's resources before it sends the request and gives them back
+# when the result is in, the request carries the processor and GPU count ansys_main launches Fluent with
+#
+# what a job gets is picked for throughput (designs per hour over the whole machine), not for the speed of that one solve:
+# a CFD solve stops scaling once each core has fewer than min_cells_per_core cells, and even before that every extra core
+# buys less than the one before (serial_fraction, Amdahl), so four solves on 10 cores each beat one solve on 40 followed by the next.
+#
+# with workers (the number of solves that can run at once, one per ansys_main worker) every job gets one of workers fixed slots:
+# the cores split evenly, rounded down to a multiple of granularity, with whatever the rounding leaves spread over the last slots
+# in granularity steps, GPUs the same way, so no core sits idle. a slot only stays with a worker if the job asks for it by number:
+# the socket bridge binds every worker to a slot when it says hello and asks for that one for each job the worker takes, so a
+# worker's Fluent keeps the processor and GPU count it was launched with (ansys_main relaunches Fluent whenever they change).
+# a job that doesn't say which slot (the file queue, which never knows which worker will claim a request) gets any free one
+#
+# without workers, a job gets the smaller of
+#   its knee: the most cores its predicted cell count can keep busy (cells / min_cells_per_core)
+#   its share: the cores split evenly between every job running or waiting right now, itself included
+# rounded down to a multiple of granularity, between min_cores and max_cores (license limits). the last job in line (nobody waiting
+# behind it) also takes the free cores its knee can use. a job that can't get min_cores waits. sized to every design, but the
+# allocations vary from job to job, and every change costs a Fluent relaunch
+#
+#     with scheduler.job(cells, slot) as resources:
+#         ... send the design to the worker bound to slot, with resources
+
+import time
+import random
+import threading
+
+
+# how many seconds a solve of `cells` cells takes on `cores` cores, if one core gets through a million cells in a minute
+# only the ratios matter to the scheduler
+class parallel_speedup:
+    def __init__(self, serial_fraction=0.05, min_cells_per_core=50000):
+        self.serial_fraction = serial_fraction
+        self.min_cells_per_core = min_cells_per_core
+
+    def knee(self, cells):
+        return max(1, int(cells // self.min_cells_per_core))
+
+    def speedup(self, cells, cores):
+        useful = min(cores, self.knee(cells))
+        return useful / (1 + (useful - 1) * self.serial_fraction)
+
+    def solve_time(self, cells, cores):
+        return 60 * cells / 1e6 / self.speedup(cells, cores)
+
+
+class PSO_scheduler:
+    def __init__(self, cores, gpus=0, min_cores=1, max_cores=None, granularity=1, speedup=None, workers=None):
+        self.cores = cores
+        self.gpus = gpus
+        self.min_cores = min_cores
+        self.max_cores = cores if max_cores is None else max_cores
+        self.granularity = granularity
+        self.speedup = parallel_speedup() if speedup is None else speedup
+        self.slots = None if workers is None else self.make_slots(workers)
+        self.free_slots = None if workers is None else list(range(workers))
+        self.held = {}              # id of the resources handed out -> their slot
+
+        self.condition = threading.Condition()
+        self.free_cores = cores
+        self.free_gpus = gpus
+        self.running = 0
+        self.waiting = 0
+
+        # for report(), the clock starts with the first job
+        self.start_time = None
+        self.last_change = None
+        self.core_seconds = 0.0
+        self.gpu_seconds = 0.0
+        self.n_jobs = 0
+        self.wait_time = 0.0
+        self.allocations = []
+
+    # workers fixed allocations ({'processors': n, 'gpus': n}) that add up to the whole machine, as far as max_cores allows
+    def make_slots(self, workers):
+        base = min(self.cores // workers, self.max_cores) // self.granularity * self.granularity
+        if base < self.min_cores:
+            raise ValueError(f'{self.cores} cores can\'t give {workers} workers min_cores={self.min_cores} each in steps of {self.granularity}')
+
+        processors = [base] * workers
+        leftover = self.cores - base * workers
+        while leftover >= self.granularity and any(n + self.granularity <= self.max_cores for n in processors):
+            for i in reversed(range(workers)):
+                if leftover >= self.granularity and processors[i] + self.granularity <= self.max_cores:
+                    processors[i] += self.granularity
+                    leftover -= self.granularity
+        # less than a granularity step left, the last slot takes it if max_cores allows
+        if processors[-1] + leftover <= self.max_cores:
+            processors[-1] += leftover
+
+        gpus = [self.gpus // workers + (i >= workers - self.gpus % workers) for i in range(workers)]
+        return [{'processors': n, 'gpus': g} for n, g in zip(processors, gpus)]
+
+    # cores for a job without slots. the job asking has already left waiting, it's counted in the share separately
+    def plan(self, cells):
+        share = self.cores // (self.running + self.waiting + 1)
+        knee = self.speedup.knee(cells)
+        cores = min(knee, share, self.free_cores, self.max_cores)
+        cores = max(cores // self.granularity * self.granularity, self.min_cores)
+        # the last one in line: nobody else is asking for the cores the rounding and the uneven shares left, they'd just sit idle
+        if not self.waiting:
+            cores = max(cores, min(self.free_cores, self.max_cores, knee))
+        return cores
+
+    # keeps the busy core-seconds and GPU-seconds integral up to date, call with the condition held before anything changes
+    def tick(self):
+        now = time.time()
+        if self.start_time is None:
+            self.start_time = self.last_change = now
+        self.core_seconds += (self.cores - self.free_cores) * (now - self.last_change)
+        self.gpu_seconds += (self.gpus - self.free_gpus) * (now - self.last_change)
+        self.last_change = now
+
+    def can_start(self, slot=None):
+        if self.slots is None:
+            return self.free_cores >= self.min_cores
+        return slot in self.free_slots if slot is not None else bool(self.free_slots)
+
+    # blocks until a slot (that slot, if one is given; without slots: min_cores) is free, returns {'processors': n, 'gpus': n}
+    # slot is ignored without slots
+    def acquire(self, cells, slot=None):
+        start = time.time()
+        with self.condition:
+            self.waiting += 1
+            while not self.can_start(slot):
+                self.condition.wait()
+            self.waiting -= 1
+
+            self.tick()
+            if self.slots is not None:
+                slot = self.free_slots[0] if slot is None else slot
+                self.free_slots.remove(slot)
+                resources = dict(self.slots[slot])
+                self.held[id(resources)] = slot
+            else:
+                resources = {'processors': self.plan(cells), 'gpus': 1 if self.free_gpus > 0 else 0}
+            self.free_cores -= resources['processors']
+            self.free_gpus -= resources['gpus']
+            self.running += 1
+
+            self.n_jobs += 1
+            self.wait_time += time.time() - start
+            self.allocations.append(resources['processors'])
+
+        return resources
+
+    def release(self, resources):
+        with self.condition:
+            self.tick()
+            self.free_cores += resources['processors']
+            self.free_gpus += resources['gpus']
+            self.running -= 1
+            if self.slots is not None:
+                self.free_slots.append(self.held.pop(id(resources)))
+            self.condition.notify_all()
+
+    def job(self, cells, slot=None):
+        return _allocation(self, cells, slot)
+
+    # time_scale: seconds of real time per second being modelled, for simulate()
+    def report(self, time_scale=1):
+        with self.condition:
+            self.tick()
+            elapsed = max(self.last_change - self.start_time, 1e-9)
+            per_hour = self.n_jobs / elapsed * 3600 * time_scale
+            mean_cores = sum(self.allocations) / len(self.allocations) if self.allocations else 0
+            line = (f'scheduler: {self.n_jobs} jobs, {per_hour:.3g} per hour, '
+                    f'core utilization {self.core_seconds / (self.cores * elapsed):.1%}, mean {mean_cores:.1f} cores per job, '
+                    f'mean wait {self.wait_time / max(self.n_jobs, 1) / time_scale:.3g} s')
+            if self.gpus:
+                line += f', GPU utilization {self.gpu_seconds / (self.gpus * elapsed):.1%}'
+            return line
+
+
+class _allocation:
+    def __init__(self, scheduler, cells, slot):
+        self.scheduler = scheduler
+        self.cells = cells
+        self.slot = slot
+
+    def __enter__(self):
+        self.resources = self.scheduler.acquire(self.cells, self.slot)
+        return self.resources
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.scheduler.release(self.resources)
+        return False
+
+
+# simulated jobs: n_workers ansys_main workers solving designs, solve time from the speedup model scaled by time_scale
+# (1e-3: a modelled minute takes 60 ms). the designs come in batches of batch (an iteration of the swarm, the next one starts when
+# the last design of this one is in), None for one long stream. whenever a worker's allocation changes it pays relaunch_time
+# modelled seconds for a new Fluent first (a typical design of the run below solves in about 7 on 10 cores)
+#   bound=True   worker i asks for slot i, like the socket bridge does (without slots it's sized like any job)
+#   bound=False  the allocation is made first and the design goes to whichever worker is idle, picked at random, like the file queue
+# returns the scheduler's report() in modelled time and the relaunch count
+def simulate(scheduler, cell_counts, n_workers, time_scale=1e-3, relaunch_time=1, bound=True, batch=None, seed=0):
+    cell_counts = list(cell_counts)
+    lock = threading.Lock()
+    rng = random.Random(seed)
+    idle = list(range(n_workers))
+    launched = [None] * n_workers
+    relaunches = [0]
+
+    def solve(worker, cells, resources):
+        if launched[worker] is not None and launched[worker] != resources:
+            with lock:
+                relaunches[0] += 1
+            time.sleep(relaunch_time * time_scale)
+        launched[worker] = resources
+        time.sleep(scheduler.speedup.solve_time(cells, resources['processors']) * time_scale)
+
+    # one of these per worker (bound) or per optimizer thread (not bound)
+    def run(i, jobs):
+        while True:
+            with lock:
+                if not jobs:
+                    return
+                cells = jobs.pop()
+
+            if bound:
+                with scheduler.job(cells, i if scheduler.slots is not None else None) as resources:
+                    solve(i, cells, resources)
+                continue
+
+            with scheduler.job(cells) as resources:
+                with lock:
+                    worker = idle.pop(rng.randrange(len(idle)))
+                solve(worker, cells, resources)
+                with lock:
+                    idle.append(worker)
+
+    batch = batch or len(cell_counts)
+    for start in range(0, len(cell_counts), batch):
+        jobs = cell_counts[start:start + batch]
+        threads = [threading.Thread(target=run, args=(i, jobs)) for i in range(n_workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    return f'{scheduler.report(time_scale)}, {relaunches[0]} Fluent relaunches'
+
+
+if __name__ == '__main__':
+    import numpy as np
+
+    cells = np.random.default_rng(0).lognormal(np.log(8e5), 0.5, 200)
+    runs = [('one job at a time on all 40 cores', PSO_scheduler(40, gpus=2, min_cores=40), 1, True),
+            ('1 worker, slots', PSO_scheduler(40, gpus=2, min_cores=2, granularity=2, workers=1), 1, True),
+            ('4 workers, a fixed 10 cores each', PSO_scheduler(40, gpus=2, min_cores=10, max_cores=10), 4, True),
+            ('4 workers, scheduled', PSO_scheduler(40, gpus=2, min_cores=2, granularity=2), 4, True),
+            ('4 workers, slots', PSO_scheduler(40, gpus=2, min_cores=2, granularity=2, workers=4), 4, True),
+            ('4 workers, slots, not bound (file queue)', PSO_scheduler(40, gpus=2, min_cores=2, granularity=2, workers=4), 4, False),
+            ('8 workers, scheduled', PSO_scheduler(40, gpus=2, min_cores=2, granularity=2), 8, True),
+            ('8 workers, slots', PSO_scheduler(40, gpus=2, min_cores=2, granularity=2, workers=8), 8, True),
+            ('6 workers, slots', PSO_scheduler(40, gpus=2, min_cores=2, granularity=4, workers=6), 6, True),
+            ('6 workers, slots, not bound (file queue)', PSO_scheduler(40, gpus=2, min_cores=2, granularity=4, workers=6), 6, False)]
+
+    # iterations of 16 designs, like cpython_script's swarm
+    for name, scheduler, n_workers, bound in runs:
+        print(f'{name}:' + ('' if scheduler.slots is None else f' {[slot["processors"] for slot in scheduler.slots]}'))
+        print('   ', simulate(scheduler, cells, n_workers, bound=bound, batch=16))
@@ -0,0 +1,125 @@
+# persistent record of every evaluation we've paid for, shared between optimization runs (and between runs going on at the same time)
+# backed by a single SQLite file, so a crash or a restart with different PSO coefficients doesn't throw away any CFD solves
+#
+# a stored value only counts for the same objective setup: every row carries a fingerprint of the objective name and
+# the files that define it (mesh script, fluent journal...), change any of them and the old values stop matching
+#
+# only finite values are stored: a NaN (a diverged solve) or an inf (a failed one, see cpython_script) isn't written, the run
+# that got it carries on with it in its own memo and the next run solves the design again
+
+import json
+import math
+import time
+import hashlib
+import sqlite3
+import threading
+
+
+# objective name plus the contents of every file that shapes the objective, extra keyword args get folded in too
+def fingerprint(objective_name, *filepaths, **extra):
+    h = hashlib.sha256(objective_name.encode('utf-8'))
+    for filepath in filepaths:
+        with open(filepath, 'rb') as f:
+            h.update(f.read())
+    h.update(json.dumps(extra, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+
+
+# names sorted, values as floats with a fixed number of significant digits so 2.7500000000000004 and 2.75 are the same design
+def canonical_key(param_dict):
+    return json.dumps([[name, float('%.12g' % param_dict[name])] for name in sorted(param_dict)])
+
+
+class PSO_eval_store:
+    def __init__(self, db_path, fingerprint):
+        self.db_path = db_path
+        self.fingerprint = fingerprint
+        self.lock = threading.Lock()
+        self.conn = None
+
+    # the connection can't be pickled (the swarm gets pickled into checkpoints), so it's opened lazily and dropped on pickling
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['conn'] = None
+        state['lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def connect(self):
+        if self.conn is None:
+            # timeout: other runs writing to the same file just make us wait a bit, WAL lets readers carry on while they do
+            self.conn = sqlite3.connect(self.db_path, timeout=60, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            with self.conn:
+                self.conn.execute('''CREATE TABLE IF NOT EXISTS evaluations (
+                                         fingerprint TEXT NOT NULL,
+                                         key TEXT NOT NULL,
+                                         params TEXT NOT NULL,
+                                         value REAL NOT NULL,
+                                         created REAL NOT NULL,
+                                         PRIMARY KEY (fingerprint, key))''')
+        return self.conn
+
+    def lookup(self, param_dict):
+        with self.lock:
+            row = self.connect().execute('SELECT value FROM evaluations WHERE fingerprint = ? AND key = ?',
+                                         (self.fingerprint, canonical_key(param_dict))).fetchone()
+        return None if row is None else row[0]
+
+    # first value stored for a design wins, a second run evaluating it concurrently doesn't overwrite it
+    # a value that isn't finite is skipped (sqlite would turn a NaN into NULL and refuse it halfway through the run)
+    def store(self, param_dict, value):
+        if not math.isfinite(value):
+            return
+
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                conn.execute('INSERT OR IGNORE INTO evaluations VALUES (?, ?, ?, ?, ?)',
+                             (self.fingerprint, canonical_key(param_dict), json.dumps(param_dict, sort_keys=True), float(value), time.time()))
+
+    ### query API
+
+    # every evaluation for this fingerprint (or for every fingerprint with all_setups=True), oldest first
+    # each record is a dict: {'params': {name: value}, 'value': ..., 'created': unix time, 'fingerprint': ...}
+    def records(self, all_setups=False):
+        query = 'SELECT fingerprint, params, value, created FROM evaluations'
+        args = ()
+        if not all_setups:
+            query += ' WHERE fingerprint = ?'
+            args = (self.fingerprint,)
+
+        with self.lock:
+            rows = self.connect().execute(query + ' ORDER BY created', args).fetchall()
+
+        return [{'fingerprint': fp, 'params': json.loads(params), 'value': value, 'created': created} for fp, params, value, created in rows]
+
+    def best(self, n=1):
+        with self.lock:
+            rows = self.connect().execute('SELECT params, value FROM evaluations WHERE fingerprint = ? ORDER BY value LIMIT ?',
+                                          (self.fingerprint, n)).fetchall()
+        return [(json.loads(params), value) for params, value in rows]
+
+    def __len__(self):
+        with self.lock:
+            return self.connect().execute('SELECT COUNT(*) FROM evaluations WHERE fingerprint = ?', (self.fingerprint,)).fetchone()[0]
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+# quick look at what's in a store file: python PSO_store.py <db file> [n]
+if __name__ == '__main__':
+    import sys
+
+    conn = sqlite3.connect(sys.argv[1])
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    for fp, count, best in conn.execute('SELECT fingerprint, COUNT(*), MIN(value) FROM evaluations GROUP BY fingerprint'):
+        print(f'{fp[:12]}: {count} evaluations, best {best}')
+        for params, value in conn.execute('SELECT params, value FROM evaluations WHERE fingerprint = ? ORDER BY value LIMIT ?', (fp, n)):
+            print(f'    {value}: {params}')
@@ -0,0 +1,102 @@
+# optional surrogate stage between PSO_optimizer and f: a small Gaussian process fitted on every real evaluation so far,
+# used to skip candidates the data already says are hopeless
+#
+# a candidate goes to the real f if it could plausibly beat its own particle's best (mean - kappa * std < particle best),
+# or if the model just doesn't know much about that spot (std above max_std, in units of the spread of observed values)
+# everything else gets the predicted mean as its value. predicted values never go into the memo, the store or the model
+#
+# kappa is the trust knob: 0 believes the mean outright, bigger values send more candidates to f
+# nothing gets screened until min_points real evaluations are in
+
+import numpy as np
+import scipy.linalg as SLA
+
+
+class PSO_surrogate:
+    def __init__(self, params, kappa=2.0, max_std=0.5, min_points=10, max_points=400, length_scales=(0.05, 0.1, 0.2, 0.4)):
+        templates = sorted(params, key=lambda p: p.name)
+        self.names = [param.name for param in templates]
+        self.min_vals = np.array([param.min_val for param in templates], dtype=float)
+        self.spans = np.array([param.max_val - param.min_val for param in templates], dtype=float)
+        self.spans[self.spans == 0] = 1
+
+        self.kappa = kappa
+        self.max_std = max_std
+        self.min_points = min_points
+        self.max_points = max_points
+        self.length_scales = length_scales
+
+        self.data = {}          # normalized row (tuple) -> value, so repeat observations don't pile up
+        self.stale = True
+        self.n_evaluated = 0
+        self.n_screened = 0
+
+    def normalize(self, rows):
+        return (np.asarray(rows, dtype=float) - self.min_vals) / self.spans
+
+    # non-finite values (failed solves) would wreck the fit, they're left out
+    def observe(self, rows, vals):
+        if len(rows) == 0:
+            return
+        for row, val in zip(self.normalize(rows), vals):
+            if np.isfinite(val):
+                self.data[tuple(row)] = float(val)
+        self.stale = True
+
+    def kernel(self, a, b, length_scale):
+        sq_dists = np.sum(a**2, axis=1)[:, None] + np.sum(b**2, axis=1)[None, :] - 2 * a @ b.T
+        return np.exp(-0.5 * np.maximum(sq_dists, 0) / length_scale**2)
+
+    # refit on the best max_points observations (the region PSO cares about), length scale picked by marginal likelihood
+    def fit(self):
+        items = sorted(self.data.items(), key=lambda item: item[1])[:self.max_points]
+        self.X = np.array([row for row, _ in items])
+        y = np.array([val for _, val in items])
+        self.y_mean = y.mean()
+        self.y_std = y.std() if y.std() > 0 else 1.0
+        y = (y - self.y_mean) / self.y_std
+
+        best = None
+        for length_scale in self.length_scales:
+            K = self.kernel(self.X, self.X, length_scale) + 1e-6 * np.eye(len(self.X))
+            try:
+                chol = SLA.cho_factor(K, lower=True)
+            except np.linalg.LinAlgError:
+                continue
+            alpha = SLA.cho_solve(chol, y)
+            log_likelihood = -0.5 * y @ alpha - np.sum(np.log(np.diag(chol[0])))
+            if best is None or log_likelihood > best[0]:
+                best = (log_likelihood, length_scale, chol, alpha)
+
+        _, self.length_scale, self.chol, self.alpha = best
+        self.stale = False
+
+    # mean and std in the units of f
+    def predict(self, rows):
+        if self.stale:
+            self.fit()
+
+        K_star = self.kernel(self.normalize(rows), self.X, self.length_scale)
+        mean = K_star @ self.alpha
+        v = SLA.cho_solve(self.chol, K_star.T)
+        var = np.maximum(1 - np.sum(K_star * v.T, axis=1), 0)
+        return self.y_mean + self.y_std * mean, self.y_std * np.sqrt(var)
+
+    # which candidates deserve a real evaluation, plus the predicted value for the ones that don't
+    # bvals are the personal bests of the particles the candidates belong to
+    def screen(self, rows, bvals):
+        if len(rows) == 0 or len(self.data) < self.min_points:
+            self.n_evaluated += len(rows)
+            return np.ones(len(rows), dtype=bool), np.full(len(rows), np.nan)
+
+        mean, std = self.predict(rows)
+        send = (mean - self.kappa * std < np.asarray(bvals, dtype=float)) | (std > self.max_std * self.y_std)
+
+        self.n_evaluated += int(np.sum(send))
+        self.n_screened += int(np.sum(~send))
+        return send, mean
+
+    def report(self):
+        total = self.n_evaluated + self.n_screened
+        saved = 100 * self.n_screened / total if total else 0
+        return f'surrogate: {self.n_evaluated} candidates evaluated, {self.n_screened} screened out ({saved:.1f}% of evaluations saved)'
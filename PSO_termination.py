@@ -0,0 +1,124 @@
+# extra stopping rules for PSO_optimizer.optimize / optimize_async, on top of convergence and max_iterations
+# what a CFD run really budgets is solver time, so these look at real evaluations (memo/store hits and surrogate predictions
+# don't count), the clock, and whether the swarm best is still getting better
+#
+# a policy's check(optimizer) returns None to keep going, or a short description of why the run should stop
+# optimize() checks after every iteration, so a synchronous run can overshoot an evaluation budget by up to one iteration's batch
+# policies are combined with any_of / all_of, a plain list passed to optimize() means any_of
+#
+#   termination=[max_evaluations(300), wall_clock(48 * 3600), stagnation(60)]
+#
+# policies keep their own history and get pickled into checkpoints with the rest of the run, so a resumed run carries on
+# counting where it left off (wall_clock included: the deadline is a time of day, downtime counts)
+
+import time
+
+
+class PSO_termination:
+    # called once when optimize() starts a run (not on resume)
+    def start(self):
+        pass
+
+    def check(self, optimizer):
+        return None
+
+
+class max_evaluations(PSO_termination):
+    def __init__(self, n):
+        self.n = n
+
+    def check(self, optimizer):
+        if optimizer.n_evaluations >= self.n:
+            return f'max_evaluations: {optimizer.n_evaluations} real evaluations, budget was {self.n}'
+        return None
+
+
+class wall_clock(PSO_termination):
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.deadline = time.time() + seconds
+
+    def start(self):
+        self.deadline = time.time() + self.seconds
+
+    def check(self, optimizer):
+        if time.time() >= self.deadline:
+            return f'wall_clock: {self.seconds} s deadline reached'
+        return None
+
+
+# the swarm best hasn't improved by more than tolerance in the last n real evaluations
+class stagnation(PSO_termination):
+    def __init__(self, n, tolerance=0):
+        self.n = n
+        self.tolerance = tolerance
+        self.start()
+
+    def start(self):
+        self.best = float('inf')
+        self.improved_at = 0
+
+    def check(self, optimizer):
+        if optimizer.swarm.bval < self.best - self.tolerance:
+            self.best = optimizer.swarm.bval
+            self.improved_at = optimizer.n_evaluations
+
+        if optimizer.n_evaluations - self.improved_at >= self.n:
+            return f'stagnation: best value {self.best} unchanged for {optimizer.n_evaluations - self.improved_at} evaluations'
+        return None
+
+
+# the swarm best improved by less than min_rate (in units of f) per real evaluation over the last window evaluations
+class improvement_rate(PSO_termination):
+    def __init__(self, min_rate, window):
+        self.min_rate = min_rate
+        self.window = window
+        self.start()
+
+    def start(self):
+        self.history = []       # (n_evaluations, best value) at every check
+
+    def check(self, optimizer):
+        n, best = optimizer.n_evaluations, optimizer.swarm.bval
+        self.history.append((n, best))
+
+        # latest check at least window evaluations ago
+        past = [(past_n, past_best) for past_n, past_best in self.history if past_n <= n - self.window]
+        if not past:
+            return None
+
+        self.history = self.history[len(past) - 1:]
+        past_n, past_best = past[-1]
+        rate = (past_best - best) / (n - past_n)
+        if rate < self.min_rate:
+            return f'improvement_rate: {rate:.3g} per evaluation over the last {n - past_n} evaluations, minimum {self.min_rate}'
+        return None
+
+
+class any_of(PSO_termination):
+    def __init__(self, *policies):
+        self.policies = policies
+
+    def start(self):
+        for policy in self.policies:
+            policy.start()
+
+    # every policy gets checked, so each one's history stays up to date
+    def check(self, optimizer):
+        reasons = [policy.check(optimizer) for policy in self.policies]
+        return next((reason for reason in reasons if reason is not None), None)
+
+
+class all_of(PSO_termination):
+    def __init__(self, *policies):
+        self.policies = policies
+
+    def start(self):
+        for policy in self.policies:
+            policy.start()
+
+    def check(self, optimizer):
+        reasons = [policy.check(optimizer) for policy in self.policies]
+        if all(reason is not None for reason in reasons):
+            return ' and '.join(reasons)
+        return None
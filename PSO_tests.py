@@ -17,8 +17,8 @@ def test_objective1(params):
 
         return None
 
-    x = get_param('plate_width').val
-    y = get_param('n_plates').val
+    x = get_param('x').val
+    y = get_param('y').val
     return x**2 + y**2
 
 def test_constraint1(params):
@@ -123,19 +123,34 @@ def test_objective4(params):
 
         return None
 
-    x = get_param('plate_width').val
-    y = get_param('n_plates').val
+    x = get_param('x').val
+    y = get_param('y').val
 
     first_exp = -20 * np.exp(-0.2 * np.sqrt(0.5 * (x**2 + y**2)))
     second_exp = -np.exp(0.5 * (np.cos(x) + np.cos(y)))
 
     return first_exp + second_exp + 20 + np.exp(1)
 
+# mixed continuous/discrete, only meant to be run with test_constraint3: wide plates and 40 of them don't fit together,
+# so the optimum sits on the constraint boundary
+# solution is f(~1.5963, 38) = ~0.2030 (plate_width = 60.658446 / 38, just inside the constraint)
 input_params5 = {
     PSO_param('plate_width', False, 0.5, 3),
     PSO_param('n_plates', True, 15, 60)    
 }
 
+def test_objective5(params):
+    def get_param(name):
+        for param in params:
+            if param.name == name:
+                return param
+
+        return None
+
+    pw = get_param('plate_width').val
+    n = get_param('n_plates').val
+    return (pw - 2)**2 + (n - 40)**2 / 100
+
 def test_constraint3(params):
     def get_param(name):
         for param in params:
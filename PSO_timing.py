@@ -0,0 +1,126 @@
+# where the wall time goes: named spans (how long each phase took) and counters (cache hits, surrogate skips...)
+# shared by the optimizer side (mixedvar_PSO, cpython_script) and the ANSYS side (ansys_main, see bridge_protocol.py for what that rules out)
+#
+# with an events_path every finished span is appended to it as one JSON line:
+#   {"source": "optimizer", "span": "evaluate", "start": unix time, "duration": seconds, ...extra fields}
+# the end of run summary (totals and percentiles per span, counters, hit rates) goes in as one last line {"source": ..., "summary": {...}}
+# every process writes its own file, the lines carry the source so the files can be concatenated and read together
+#
+#     with timer.span('mesh', fidelity='fine'):
+#         ...
+
+import json
+import time
+import threading
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(int(round(q / 100.0 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class _span:
+    def __init__(self, timer, name, fields):
+        self.timer = timer
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.fields['error'] = exc_type.__name__
+        self.duration = time.time() - self.start
+        self.timer.record(self.name, self.start, self.duration, **self.fields)
+        return False
+
+
+class PSO_timer:
+    def __init__(self, events_path=None, source='optimizer'):
+        self.events_path = events_path
+        self.source = source
+        self.durations = {}     # span name -> every duration seen
+        self.counters = {}
+        self.lock = threading.Lock()    # executor threads time their evaluations too
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def span(self, name, **fields):
+        return _span(self, name, fields)
+
+    def record(self, name, start, duration, **fields):
+        with self.lock:
+            self.durations.setdefault(name, []).append(duration)
+
+            if self.events_path:
+                event = {'source': self.source, 'span': name, 'start': start, 'duration': duration}
+                event.update(fields)
+                self.write(event)
+
+    # mark() then since(mark): total seconds per span recorded in between, for handing one evaluation's phases back with its result
+    def mark(self):
+        with self.lock:
+            return dict((name, len(durations)) for name, durations in self.durations.items())
+
+    def since(self, mark):
+        with self.lock:
+            return dict((name, sum(durations[mark.get(name, 0):])) for name, durations in self.durations.items()
+                        if len(durations) > mark.get(name, 0))
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def write(self, event):
+        with open(self.events_path, 'a') as f:
+            f.write(json.dumps(event) + '\n')
+
+    # hits / (hits + misses) for every <name>_hit / <name>_miss counter pair
+    def hit_rates(self):
+        rates = {}
+        for name in self.counters:
+            if name.endswith('_hit'):
+                base = name[:-len('_hit')]
+                total = self.counters[name] + self.counters.get(base + '_miss', 0)
+                if total:
+                    rates[base] = float(self.counters[name]) / total
+        return rates
+
+    def summary(self):
+        with self.lock:
+            spans = {}
+            for name, durations in self.durations.items():
+                ordered = sorted(durations)
+                spans[name] = {'count': len(ordered), 'total': sum(ordered), 'mean': sum(ordered) / len(ordered),
+                               'p50': percentile(ordered, 50), 'p90': percentile(ordered, 90), 'p99': percentile(ordered, 99), 'max': ordered[-1]}
+
+            return {'spans': spans, 'counters': dict(self.counters), 'hit_rates': self.hit_rates()}
+
+    # human readable version of summary(), spans with the most total time first. also writes the summary event
+    def report(self):
+        summary = self.summary()
+        if self.events_path:
+            with self.lock:
+                self.write({'source': self.source, 'summary': summary})
+
+        lines = ['timing (%s): span, count, total s, mean s, p50, p90, p99, max' % self.source]
+        for name, stats in sorted(summary['spans'].items(), key=lambda item: -item[1]['total']):
+            lines.append('    %-24s %7d %10.3f %9.4f %9.4f %9.4f %9.4f %9.4f' % (name, stats['count'], stats['total'], stats['mean'],
+                                                                              stats['p50'], stats['p90'], stats['p99'], stats['max']))
+        for name, n in sorted(summary['counters'].items()):
+            lines.append('    %-24s %7d' % (name, n))
+        for name, rate in sorted(summary['hit_rates'].items()):
+            lines.append('    %-24s %6.1f%% hit rate' % (name, 100 * rate))
+
+        return '\n'.join(lines)
@@ -0,0 +1,46 @@
+# when is a Fluent solve done: fluent_script.jou hands Fluent the residual targets and a report convergence condition on
+# heatsink_temp (relative change over the last temp_window iterations, after min_iterations), capped at max_iterations.
+# Fluent stops on whichever it meets first, this file reads the heatsink_temp report file back and decides whether to trust the result
+#
+# a solve counts as converged if Fluent stopped by itself before the cap, ran at least min_iterations,
+# and heatsink_temp moved less than temp_tolerance (relative) over the last temp_window iterations.
+# stopping on residuals alone while the temperature still drifts is flagged too
+
+
+# (iteration, value) rows of a Fluent report file (.out), skipping the quoted header lines
+# start is a byte offset, a file that lives through several solves (persistent session) is read from where the last one ended
+def read_report_file(filepath, start=0):
+    history = []
+    with open(filepath, 'r') as f:
+        f.seek(start)
+        for line in f:
+            fields = line.split()
+            if len(fields) < 2:
+                continue
+            try:
+                history.append((int(fields[0]), float(fields[1])))
+            except ValueError:
+                continue
+
+    return history
+
+
+def relative_change(values):
+    return (max(values) - min(values)) / max(abs(values[-1]), 1e-12)
+
+
+# settings is a fidelity_settings() dict, numbers as strings straight out of config.ini
+# returns {'iterations': iterations run, 'converged': bool, 'relative_change': over the last window, None if the solve was shorter}
+def solve_info(history, settings):
+    n_iterations = len(history)
+    window = int(settings['temp_window'])
+
+    change = None
+    if n_iterations >= window:
+        change = relative_change([value for _, value in history[-window:]])
+
+    converged = (change is not None
+                 and change <= float(settings['temp_tolerance'])
+                 and int(settings['min_iterations']) <= n_iterations < int(settings['max_iterations']))
+
+    return {'iterations': n_iterations, 'converged': converged, 'relative_change': change}
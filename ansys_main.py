@@ -1,8 +1,81 @@
 import os
-import time
+from string import Template
 
 os.chdir(os.path.dirname(__file__))
-from config import path
+from config import path, config
+from ansys_queue import ansys_queue
+from bridge_protocol import make_dirs
+import ansys_socket
+from ansys_warmstart import solution_library, fluent_path
+from ansys_convergence import read_report_file, solve_info
+from PSO_timing import PSO_timer
+
+
+# what this worker keeps between evaluations, so a new design doesn't pay for Workbench's startup all over again
+# parameter handles are looked up once instead of scanning Parameters.GetAllParameters() on every set/get, and with [session] persistent = yes:
+#   parameters whose value didn't change aren't set again,
+#   the Mechanical and Fluent editors stay open, Fluent gets the new mesh through a Setup refresh and only fluent_design.jou,
+#   fluent_script.jou (models, boundary conditions, reports) is replayed once per session
+# any error throws all of it away (reset()), the next design starts from a clean Setup like the non-persistent mode always does
+class ansys_session:
+    def __init__(self, persistent, reset_every=0):
+        self.persistent = persistent
+        self.reset_every = reset_every     # full reset after this many designs anyway, 0 = never
+        self.handles = None
+        self.applied = {}
+        self.open_containers = []
+        self.fluent_ready = False
+        self.launched = None     # resources the open Fluent was launched with
+        self.n_designs = 0
+
+    def parameter(self, display_name):
+        if self.handles is None:
+            self.handles = {}
+            for p in Parameters.GetAllParameters():
+                self.handles[p.GetProperties()['DisplayText']] = p
+        return self.handles[display_name]
+
+    # returns how many parameters actually changed
+    def set_params(self, params):
+        changed = 0
+        for name, value in params.items():
+            if not self.persistent or self.applied.get(name) != value:
+                set_ANSYS_param(name, value)
+                self.applied[name] = value
+                changed += 1
+        return changed
+
+    def send(self, container, cmd, language=None):
+        if self.persistent:
+            send_container_cmd(container, cmd, language, keep_open=True)
+            if container not in self.open_containers:
+                self.open_containers.append(container)
+        else:
+            send_container_cmd(container, cmd, language)
+
+    def run_script(self, container, filepath, language=None, substitutions=None):
+        self.send(container, read_script(filepath, substitutions), language)
+
+    # closes whatever editors are open and forgets everything, the next design gets a full Setup reset
+    def reset(self):
+        for container in self.open_containers:
+            try:
+                container.Exit()
+            except Exception:   # an editor that crashed can't be closed, it's gone either way
+                pass
+        self.open_containers = []
+        self.handles = None
+        self.applied = {}
+        self.fluent_ready = False
+        self.launched = None
+
+    # a Fluent launched with a different processor or GPU count than this design was given has to be relaunched
+    def needs_setup(self, resources):
+        if self.persistent and self.reset_every and self.n_designs and self.n_designs % self.reset_every == 0:
+            self.reset()
+        if self.fluent_ready and self.launched != resources:
+            self.reset()
+        return not (self.persistent and self.fluent_ready)
 
 
 '''
@@ -11,41 +84,88 @@ value as float
 ''' 
 def set_ANSYS_param(display_name, value):
     dp = Parameters.GetFirstDesignPoint()
-
-    value_str=str(value)
-
-    for p in Parameters.GetAllParameters():
-        if p.GetProperties()['DisplayText'] == display_name:
-            dp.SetParameterExpression(
-                Parameter=p,
-                Expression=value_str)
+    dp.SetParameterExpression(
+        Parameter=session.parameter(display_name),
+        Expression=str(value))
 
 
 def get_ANSYS_param(display_name):
-    for p in Parameters.GetAllParameters():
-        if p.GetProperties()['DisplayText'] == display_name:
-            return p.Value.Value # p.Value is a Quantity object, Value of Quantity object is float (I know, cringe, blame Ansys)
+    return session.parameter(display_name).Value.Value # p.Value is a Quantity object, Value of Quantity object is float (I know, cringe, blame Ansys)
 
 
 '''
 for now filename is in same folder as everything
+substitutions fill in the $placeholders of the script (mesh sizes, iteration count...)
 '''
-def exec_container_cmd(container, filepath, language=None):
-    container.Edit()
-
+def read_script(filepath, substitutions=None):
     f = open(filepath, 'r')
     cmd = f.read()
+    f.close()
+    if substitutions:
+        cmd = Template(cmd).substitute(substitutions)
+    return cmd
+
+
+# keep_open leaves the editor (Mechanical, Fluent) running for the next command instead of closing it
+def send_container_cmd(container, cmd, language=None, keep_open=False):
+    container.Edit()
 
     if language:
         container.SendCommand(Language=language, Command=cmd)
     else:
         container.SendCommand(Command=cmd)
 
-    container.Exit()
+    if not keep_open:
+        container.Exit()
+
+
+# mesh sizes and iteration range of a fidelity level, the [fidelity_coarse] / [fidelity_fine] sections of config.ini,
+# plus the stopping criteria of [convergence] that every level shares
+def fidelity_settings(fidelity):
+    settings = config.items('fidelity_' + fidelity)
+    if not settings:
+        raise ValueError('No [fidelity_%s] section in config.ini' % fidelity)
+    settings.update(config.items('convergence'))
+    return settings
 
 
 # see https://www.cfd-online.com/Forums/ansys-meshing/162493-model-information-incompatible-incoming-mesh.html
-def run_ansys_update(params):
+# returns heatsink_temp and the solve info of ansys_convergence.solve_info (iterations used, converged or not),
+# plus the seconds spent in each phase under 'phases', so the optimizer side can tell queueing from solving
+# resources is the {'processors': n, 'gpus': n} the optimizer's scheduler gave this design, None for the [resources] defaults
+def run_ansys_update(params, fidelity='fine', resources=None):
+    if not resources:
+        resources = {'processors': int(config.get('resources', 'default_processors')), 'gpus': int(config.get('resources', 'default_gpus'))}
+
+    mark = timer.mark()
+    try:
+        with timer.span('evaluation', fidelity=fidelity, processors=resources['processors']):
+            result, info = update_design(params, fidelity, resources)
+    except Exception:
+        # whatever state Workbench is in now can't be trusted, the next design starts over
+        timer.count('session_reset')
+        session.reset()
+        raise
+
+    info['phases'] = timer.since(mark)
+    return result, info
+
+
+def update_design(params, fidelity, resources):
+    settings = fidelity_settings(fidelity)
+
+    # fluent appends to its report file, and holds it open while the session lives. only what this solve adds gets read
+    report_file = os.path.join(path('fluent_reports'), worker_name + '.out')
+    if not session.persistent and os.path.exists(report_file):
+        os.remove(report_file)
+    settings['report_file'] = fluent_path(report_file)
+
+    # start from the nearest design solved so far (see ansys_warmstart.py), $initialization stays empty for a cold start
+    with timer.span('warmstart_lookup'):
+        settings['initialization'], distance = warmstart.initialization(params) if warmstart else ('', None)
+    if distance is not None:
+        print('Warm start from a design at relative distance %.3g' % distance)
+
     f_system = GetSystem(Name='FFF')
     f_mesh_component = f_system.GetComponent(Name='Mesh')
     f_mesh_container = f_system.GetContainer(ComponentName='Mesh')
@@ -53,38 +173,84 @@ def run_ansys_update(params):
     f_setup_component = f_system.GetComponent(Name='Setup')
     f_setup_container = f_system.GetContainer(ComponentName='Setup')
 
-    for name, value in params.items():
-        set_ANSYS_param(name, value)
+    with timer.span('set_params'):
+        timer.count('params_changed', session.set_params(params))
     
-    f_mesh_component.Refresh() # load geometry with new Ansys parameter values
-    exec_container_cmd(f_mesh_container, path('mesh_script'), 'Python')
+    with timer.span('geometry_refresh'):
+        f_mesh_component.Refresh() # load geometry with new Ansys parameter values
+    with timer.span('mesh', fidelity=fidelity):
+        session.run_script(f_mesh_container, path('mesh_script'), 'Python', settings)
     
-    f_setup_component.Reset()
-    fluent_settings = f_setup_container.GetFluentLauncherSettings()
-    fluent_settings.SetEntityProperties(Properties=Set(DisplayText='Fluent Launcher Settings', Precision='Double', EnvPath={}, RunParallel=True, NumberOfProcessorsMeshing=20, NumberOfProcessors=20, NumberOfGPGPUs=1))
+    if session.needs_setup(resources):
+        with timer.span('setup_reset'):
+            f_setup_component.Reset()
+            fluent_settings = f_setup_container.GetFluentLauncherSettings()
+            fluent_settings.SetEntityProperties(Properties=Set(DisplayText='Fluent Launcher Settings', Precision='Double', EnvPath={}, RunParallel=True,
+                                                               NumberOfProcessorsMeshing=resources['processors'], NumberOfProcessors=resources['processors'],
+                                                               NumberOfGPGPUs=resources['gpus']))
+            session.launched = resources
+
+        # launches Fluent and replays the journal
+        with timer.span('fluent_setup'):
+            session.run_script(f_setup_container, path('fluent_script'), substitutions=settings)
+        # # remember to use backslashes to cancel any "special characters" in path (\n, \t etc.) I don't think r"" works here
+        # f_setup_container.Edit()
+        # f_setup_container.SendCommand(Command="/file/read-journal \"C:\Users\AeroDesigN\Desktop\\triumf_heatsink\plate_GUI_v1.jou\" ")
+        # f_setup_container.Exit()
+        session.fluent_ready = True
+    else:
+        # Fluent is still open with the models and boundary conditions of the last design, it only needs the new mesh
+        with timer.span('mesh_transfer'):
+            f_setup_component.Refresh()
 
-    exec_container_cmd(f_setup_container, path('fluent_script'))
-    # # remember to use backslashes to cancel any "special characters" in path (\n, \t etc.) I don't think r"" works here
-    # f_setup_container.Edit()
-    # f_setup_container.SendCommand(Command="/file/read-journal \"C:\Users\AeroDesigN\Desktop\\triumf_heatsink\plate_GUI_v1.jou\" ")
-    # f_setup_container.Exit()
+    with timer.span('fluent_design'):
+        session.run_script(f_setup_container, path('fluent_design'), substitutions=settings)
 
-    f_sol_component.Update()
+    report_start = os.path.getsize(report_file) if os.path.exists(report_file) else 0
+    with timer.span('solve', fidelity=fidelity, warm_start=distance is not None):
+        f_sol_component.Update()
+    session.n_designs += 1
     
-    result = get_ANSYS_param('heatsink_temp-op')
-    return result
+    with timer.span('read_results'):
+        result = get_ANSYS_param('heatsink_temp-op')
+        info = solve_info(read_report_file(report_file, report_start), settings)
+    if not info['converged']:
+        print('Solve not converged after %d iterations (heatsink_temp relative change %s)' % (info['iterations'], info['relative_change']))
 
+    # only converged flow fields are worth starting from. a persistent session writes them from the open Fluent
+    if warmstart and info['converged']:
+        with timer.span('warmstart_save'):
+            solution_file = warmstart.new_file()
+            fluent_container = f_setup_container if session.persistent else f_system.GetContainer(ComponentName='Solution')
+            session.send(fluent_container, warmstart.save_command(solution_file))
+            if os.path.exists(solution_file):
+                warmstart.add(params, solution_file, fidelity)
 
-    
-while not os.path.exists(path('optimization_result')):
-    if os.path.exists(path('ansys_request')):
-        with open(path('ansys_request'), 'r') as f:
-            params = eval(f.read())
-        os.remove(path('ansys_request'))
-        
-        result = run_ansys_update(params)
-        
-        with open(path('ansys_response'), 'w') as f:
-            f.write(str(result))
-    
-    time.sleep(0.1)  # Small delay to prevent busy-waiting
+    return result, info
+
+
+# several copies of this script can run at once, each in its own Workbench session with its own copy of the project,
+# they all pull designs from the same optimizer. set ANSYS_WORKER to tell them apart
+worker_name = os.environ.get('ANSYS_WORKER', 'worker%d' % os.getpid())
+
+# every phase of every evaluation, in this worker's own events file next to the optimizer's (PSO_timing.<worker>.jsonl)
+timing_root, timing_ext = os.path.splitext(path('timing_events'))
+timer = PSO_timer('%s.%s%s' % (timing_root, worker_name, timing_ext), source=worker_name)
+
+session = ansys_session(config.get('session', 'persistent') == 'yes', int(config.get('session', 'reset_every') or 0))
+
+# solved designs shared by every worker, leave warmstart_library out of config.ini to always cold start
+warmstart = None
+if config.get('paths', 'warmstart_library'):
+    warmstart = solution_library(path('warmstart_library'), float(config.get('warmstart', 'max_distance') or 0.25))
+
+make_dirs(path('fluent_reports'))
+
+try:
+    if config.get('bridge', 'transport') == 'file':
+        queue = ansys_queue(path('ansys_queue'))
+        queue.serve(run_ansys_update, worker_name, stop=lambda: os.path.exists(path('optimization_result')))
+    else:
+        ansys_socket.serve(run_ansys_update, worker_name, port=int(config.get('bridge', 'port')))
+finally:
+    print(timer.report())
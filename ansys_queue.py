@@ -0,0 +1,155 @@
+# file-based request queue between cpython_script (submits designs) and any number of ansys_main workers (solve them)
+#
+# layout of the queue folder:
+#   pending/<id>.json              requests nobody has picked up yet
+#   claimed/<id>.<worker>.json     requests a worker is busy with
+#   responses/<id>.json            results, one file per request, deleted by the client once read
+#
+# claiming is a single os.rename() from pending/ to claimed/, the filesystem only lets one worker win that race
+# every file is written under a temporary name and renamed into place, so nobody ever reads half a file
+# file contents are bridge_protocol messages, the same ones ansys_socket sends over the wire
+#
+# request_timeout (seconds, None = forever) bounds how long the client waits for a response. nothing here can tell a hung worker
+# from a slow one, so a request that runs out of time just fails (BridgeError), it isn't handed to another worker. if nobody has
+# claimed it yet it's taken back out of pending/, a late response from a worker that did is left in responses/
+#
+# with a scheduler (PSO_scheduler.py) a request gets its resources when it's submitted, before anyone knows which worker will claim it:
+# fixed slots can't follow a worker here, and a worker handed a different slot than last time relaunches Fluent. ansys_socket binds them
+
+import os
+import time
+import uuid
+from bridge_protocol import make_message, parse_message, response_result, response_info, make_dirs, BridgeError
+
+
+def _write_atomic(filepath, text):
+    tmp_path = filepath + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.rename(tmp_path, filepath)
+
+
+def _read_message(filepath):
+    with open(filepath, 'r') as f:
+        return parse_message(f.read())
+
+
+class ansys_queue:
+    def __init__(self, queue_dir, poll_interval=0.1, request_timeout=None, scheduler=None):
+        self.queue_dir = queue_dir
+        self.poll_interval = poll_interval
+        self.request_timeout = request_timeout
+        self.scheduler = scheduler
+        self.pending_dir = os.path.join(queue_dir, 'pending')
+        self.claimed_dir = os.path.join(queue_dir, 'claimed')
+        self.response_dir = os.path.join(queue_dir, 'responses')
+
+        for folder in (self.pending_dir, self.claimed_dir, self.response_dir):
+            make_dirs(folder)
+
+    ### client side (cpython_script)
+
+    # ids start with the submit time so sorting pending/ gives first-in first-out
+    def submit(self, params, fidelity='fine', resources=None):
+        request_id = '%017.6f_%s' % (time.time(), uuid.uuid4().hex[:8])
+        _write_atomic(os.path.join(self.pending_dir, request_id + '.json'), make_message('request', id=request_id, params=params, fidelity=fidelity, resources=resources))
+        return request_id
+
+    def wait(self, request_id):
+        response_path = os.path.join(self.response_dir, request_id + '.json')
+        deadline = None if self.request_timeout is None else time.time() + self.request_timeout
+        while not os.path.exists(response_path):
+            if deadline is not None and time.time() > deadline:
+                try:
+                    os.remove(os.path.join(self.pending_dir, request_id + '.json'))
+                except OSError:     # a worker has it
+                    pass
+                raise BridgeError('Request %s got no response within request_timeout (%s s)' % (request_id, self.request_timeout))
+            time.sleep(self.poll_interval)
+
+        response = _read_message(response_path)
+        os.remove(response_path)
+
+        return response_result(response), response_info(response)
+
+    # blocking, thread-safe: every call has its own request id and response file
+    # returns the result and the solve info, see bridge_protocol.py
+    # cells is the design's predicted cell count, the scheduler sizes requests that come without resources by it
+    def evaluate(self, params, fidelity='fine', resources=None, cells=None):
+        if self.scheduler is None or resources is not None:
+            return self.wait(self.submit(params, fidelity, resources))
+
+        resources = self.scheduler.acquire(cells)
+        try:
+            return self.wait(self.submit(params, fidelity, resources))
+        finally:
+            self.scheduler.release(resources)
+
+    # nothing to tear down, workers stop when optimization_result shows up (same interface as ansys_socket.bridge_server)
+    def close(self):
+        pass
+
+    ### worker side (ansys_main)
+
+    # returns (request_id, params, fidelity, resources) for the oldest pending request this worker managed to grab, or None if the queue is empty
+    def claim(self, worker_name):
+        for filename in sorted(os.listdir(self.pending_dir)):
+            if not filename.endswith('.json'):
+                continue
+
+            request_id = filename[:-len('.json')]
+            claimed_path = os.path.join(self.claimed_dir, '%s.%s.json' % (request_id, worker_name))
+            try:
+                os.rename(os.path.join(self.pending_dir, filename), claimed_path)
+            except OSError:     # some other worker got it first, try the next one
+                continue
+
+            request = _read_message(claimed_path)
+            return request['id'], request['params'], request['fidelity'], request.get('resources')
+
+        return None
+
+    def respond(self, request_id, worker_name, result, info=None, error=None):
+        _write_atomic(os.path.join(self.response_dir, request_id + '.json'), make_message('response', id=request_id, result=result, info=info, error=error))
+        os.remove(os.path.join(self.claimed_dir, '%s.%s.json' % (request_id, worker_name)))
+
+    # worker main loop, handler gets the params dict, the fidelity level and the resources, and returns the result and a solve info dict
+    # a handler exception goes back to the client as an error response instead of killing the worker
+    # runs until stop() returns True
+    def serve(self, handler, worker_name, stop=lambda: False):
+        while not stop():
+            claimed = self.claim(worker_name)
+            if claimed is None:
+                time.sleep(self.poll_interval)     # Small delay to prevent busy-waiting
+                continue
+
+            request_id, params, fidelity, resources = claimed
+            try:
+                result, info = handler(params, fidelity, resources)
+            except Exception as e:
+                self.respond(request_id, worker_name, None, error=repr(e))
+            else:
+                self.respond(request_id, worker_name, result, info)
+
+
+# dummy workers for trying the queue out without ANSYS, e.g. python ansys_queue.py <queue folder> 4
+# each one "solves" a design by sleeping for a bit and summing the parameter values, coarse requests sleep less
+if __name__ == '__main__':
+    import sys
+    import random
+    import threading
+
+    queue = ansys_queue(sys.argv[1])
+    n_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    def dummy_handler(params, fidelity, resources):
+        time.sleep(random.uniform(0.5, 2) * (0.25 if fidelity == 'coarse' else 1))
+        return sum(params.values()), {'iterations': random.randint(30, 200), 'converged': True}
+
+    for i in range(n_workers):
+        worker = threading.Thread(target=queue.serve, args=(dummy_handler, 'dummy%d' % i))
+        worker.daemon = True
+        worker.start()
+
+    while True:
+        time.sleep(1)
@@ -0,0 +1,194 @@
+# stand-in for ansys_main on a machine without Workbench: N worker processes that speak the bridge protocol over the same transport
+# (config.ini [bridge]) and answer each design with a synthetic heatsink temperature after a random delay
+# meant for load-testing cpython_script and the bridge end to end, queueing, latency and throughput, before booking solver time
+#
+# every request gets exactly one outcome, drawn with the configured rates:
+#   ok        sleeps for a latency drawn from --latency (coarse requests --coarse-factor of that) and answers
+#   failure   sleeps, then raises, the optimizer gets an error response (a diverged solve, a meshing error...)
+#   hang      the solve never finishes, heartbeats keep going (Workbench stuck on a dialog), sleeps for --hang-time
+#   crash     the worker process dies mid-request, no response and no more heartbeats (Workbench crashed)
+# crashed workers are started again with --restart, like someone relaunching ansys_main
+#
+# every request is appended to --stats as one JSON line, the summary at the end (Ctrl-C) is worked out from that file
+#
+# python ansys_simulator.py --workers 4 --latency lognormal:30:0.4 --failure-rate 0.02 --crash-rate 0.01 --restart --time-scale 0.01
+
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+import numpy as np
+from config import path, config
+from ansys_queue import ansys_queue
+import ansys_socket
+from PSO_scheduler import parallel_speedup
+
+
+# not physics, just shaped like it: more and bigger pins add surface but choke the flow, so the best pin counts are inside the box
+# takes the cpython_script params (mm and counts), returns a temperature in K
+def synthetic_temperature(params):
+    pw, nw = params['pin_width'], params['n_width']
+    ph, nl = params['pin_height'], params['n_length']
+
+    blockage = min(pw * nw / 60.65846, 0.95) * min(ph * nl / 58, 0.95) ** 0.5
+    velocity = 3.4646 * (1 - blockage) ** 1.5
+    area = nw * nl * 2 * (pw + ph) * 10 + 60.65846 * 58        # mm^2, 10 mm tall pins on the base plate
+    h = 20 * velocity ** 0.8 / ((pw + ph) / 2) ** 0.2
+
+    return 300 + 2.2e6 / (h * area) ** 0.9
+
+
+# "fixed:seconds", "uniform:low:high" or "lognormal:median:sigma"
+def latency_sampler(spec):
+    kind, *args = spec.split(':')
+    args = [float(arg) for arg in args]
+
+    if kind == 'fixed':
+        return lambda rng: args[0]
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(args[0], args[1])
+    if kind == 'lognormal':
+        return lambda rng: args[0] * np.exp(args[1] * rng.standard_normal())
+
+    raise ValueError(f'Unknown latency distribution {spec!r}, use fixed:s, uniform:low:high or lognormal:median:sigma')
+
+
+class simulated_worker:
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.latency = latency_sampler(args.latency)
+        self.rng = np.random.default_rng([args.seed, os.getpid()])
+
+    def record(self, **fields):
+        fields.update(worker=self.name, time=time.time())
+        with open(self.args.stats, 'a') as f:
+            f.write(json.dumps(fields) + '\n')
+
+    def handler(self, params, fidelity, resources):
+        args = self.args
+        start = time.time()
+        latency = self.latency(self.rng) * (args.coarse_factor if fidelity == 'coarse' else 1) * args.time_scale
+
+        # --latency is for the default 20 processors, a scheduled job gets faster or slower like a million-cell solve would
+        if resources:
+            model = parallel_speedup()
+            latency *= model.speedup(1e6, 20) / model.speedup(1e6, resources['processors'])
+        outcome = self.rng.choice(['ok', 'failure', 'hang', 'crash'],
+                                  p=[1 - args.failure_rate - args.hang_rate - args.crash_rate, args.failure_rate, args.hang_rate, args.crash_rate])
+
+        if outcome == 'crash':
+            self.record(fidelity=fidelity, outcome=outcome, latency=None)
+            time.sleep(self.rng.uniform(0, latency))
+            os._exit(1)
+
+        if outcome == 'hang':
+            self.record(fidelity=fidelity, outcome=outcome, latency=None)
+            time.sleep(args.hang_time)
+            latency = 0
+
+        time.sleep(latency)
+        if outcome == 'failure':
+            self.record(fidelity=fidelity, outcome=outcome, latency=time.time() - start)
+            raise RuntimeError('simulated solver failure')
+
+        result = synthetic_temperature(params)
+        if fidelity == 'coarse':
+            result += args.coarse_bias + args.coarse_noise * self.rng.standard_normal()
+
+        max_iterations = 60 if fidelity == 'coarse' else 200
+        iterations = int(self.rng.integers(max_iterations // 3, max_iterations + 1))
+        info = {'iterations': iterations, 'converged': iterations < max_iterations, 'phases': {'evaluation': time.time() - start}}
+
+        if outcome == 'ok':
+            self.record(fidelity=fidelity, outcome=outcome, latency=time.time() - start, iterations=iterations,
+                        processors=resources['processors'] if resources else None)
+        return result, info
+
+    def serve(self):
+        if config.get('bridge', 'transport') == 'file':
+            queue = ansys_queue(path('ansys_queue'))
+            queue.serve(self.handler, self.name, stop=lambda: os.path.exists(path('optimization_result')))
+        else:
+            ansys_socket.serve(self.handler, self.name, port=int(config.get('bridge', 'port')))
+
+
+def run_worker(name, args):
+    simulated_worker(name, args).serve()
+
+
+def summarize(stats_path, started):
+    with open(stats_path, 'r') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records = [record for record in records if record['time'] >= started]
+    if not records:
+        print('No requests handled')
+        return
+
+    elapsed = max(record['time'] for record in records) - started
+    print(f'{len(records)} requests in {elapsed:.1f} s')
+    for outcome in ('ok', 'failure', 'hang', 'crash'):
+        count = sum(record['outcome'] == outcome for record in records)
+        print(f'    {outcome:<8} {count:>6} ({count / len(records):.1%})')
+
+    for fidelity in ('coarse', 'fine'):
+        latencies = [record['latency'] for record in records if record['fidelity'] == fidelity and record['outcome'] == 'ok']
+        if latencies:
+            p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+            print(f'{fidelity}: {len(latencies)} solves, {len(latencies) / elapsed:.3g} per s, latency p50 {p50:.3g} s, p90 {p90:.3g} s, p99 {p99:.3g} s')
+
+    busy = {}
+    for record in records:
+        if record['latency'] is not None:
+            busy[record['worker']] = busy.get(record['worker'], 0) + record['latency']
+    for worker in sorted(busy):
+        print(f'    {worker} busy {busy[worker] / elapsed:.0%}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulated ansys_main workers for testing the bridge without ANSYS')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--latency', default='lognormal:60:0.3', help='fine solve time: fixed:s, uniform:low:high or lognormal:median:sigma')
+    parser.add_argument('--coarse-factor', type=float, default=0.25, help='coarse solve time as a fraction of the fine one')
+    parser.add_argument('--coarse-bias', type=float, default=1.5, help='K added to coarse results')
+    parser.add_argument('--coarse-noise', type=float, default=0.3, help='K, standard deviation of the coarse error')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='multiplies every delay, 0.01 runs a 60 s solve in 0.6 s')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--hang-rate', type=float, default=0.0)
+    parser.add_argument('--hang-time', type=float, default=3600.0, help='seconds a hung solve blocks its worker')
+    parser.add_argument('--crash-rate', type=float, default=0.0)
+    parser.add_argument('--restart', action='store_true', help='start a crashed worker again')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stats', default='ansys_simulator_stats.jsonl')
+    args = parser.parse_args()
+
+    started = time.time()
+    workers = {}
+    for i in range(args.workers):
+        name = f'sim{i}'
+        workers[name] = multiprocessing.Process(target=run_worker, args=(name, args))
+        workers[name].start()
+
+    try:
+        while workers:
+            time.sleep(0.5)
+            for name, process in list(workers.items()):
+                if process.is_alive():
+                    continue
+
+                # exit code 0 is a normal shutdown (optimizer said so, or optimization_result showed up)
+                if process.exitcode != 0 and args.restart:
+                    print(f'{name} crashed, restarting it')
+                    workers[name] = multiprocessing.Process(target=run_worker, args=(name, args))
+                    workers[name].start()
+                else:
+                    del workers[name]
+
+    except KeyboardInterrupt:
+        for process in workers.values():
+            process.terminate()
+
+    summarize(args.stats, started)
+    sys.exit(0)
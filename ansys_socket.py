@@ -0,0 +1,267 @@
+# loopback socket transport between cpython_script and ansys_main workers, the low-latency alternative to ansys_queue
+# nothing polls: workers block on their socket until a request shows up, the optimizer blocks on an Event until the response does
+#
+# the optimizer side runs bridge_server, every worker connects to it with serve()
+# messages are bridge_protocol JSON, one per line. workers send heartbeats from a side thread,
+# a worker that goes quiet for heartbeat_timeout seconds mid-request is dropped and its request goes back in the queue.
+# so is a worker that keeps heartbeating but hasn't answered after request_timeout seconds (Workbench stuck on a dialog).
+# a request that has lost max_attempts workers like that fails, evaluate() raises BridgeError instead of handing it to the next one
+#
+# with a scheduler (PSO_scheduler.py) the resources are picked when a worker takes the request, not when it's submitted: with fixed
+# slots every worker is bound to one slot by the name it says hello with, and keeps it when it reconnects, so its Fluent is never
+# relaunched for a different processor or GPU count. workers beyond the scheduler's slot count share slots and take turns
+
+import socket
+import threading
+import time
+import uuid
+from bridge_protocol import make_message, parse_message, response_result, response_info, BridgeError
+
+try:
+    import Queue as queue   # IronPython / python 2
+except ImportError:
+    import queue
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 50007
+HEARTBEAT_INTERVAL = 5
+
+
+class _connection:
+    def __init__(self, sock):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)     # tiny messages, don't let Nagle sit on them
+        self.sock = sock
+        self.reader = sock.makefile('rb')
+        self.send_lock = threading.Lock()
+
+    def send(self, text):
+        with self.send_lock:
+            self.sock.sendall((text + '\n').encode('utf-8'))
+
+    # blocks until a whole message arrives, None once the other end hangs up
+    def receive(self):
+        line = self.reader.readline()
+        if not line:
+            return None
+        return parse_message(line.decode('utf-8'))
+
+    def close(self):
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+
+class _job:
+    def __init__(self, params, fidelity, resources, cells):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.fidelity = fidelity
+        self.resources = resources
+        self.cells = cells
+        self.done = threading.Event()
+        self.response = None
+        self.failures = []      # why each worker that had it didn't answer
+
+
+# optimizer side. evaluate() is blocking and thread-safe, so an executor can keep one call per connected worker waiting
+class bridge_server:
+    # request_timeout: seconds a worker gets to answer one request, None waits as long as it heartbeats
+    # scheduler: sizes every request that comes without resources, None leaves them to ansys_main's defaults
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, heartbeat_timeout=6 * HEARTBEAT_INTERVAL, request_timeout=None, max_attempts=2, scheduler=None):
+        self.host = host
+        self.port = port
+        self.heartbeat_timeout = heartbeat_timeout
+        self.request_timeout = request_timeout
+        self.max_attempts = max_attempts
+        self.scheduler = scheduler
+        self.jobs = queue.Queue()
+        self.connections = []
+        self.worker_slots = {}      # worker name -> its slot, kept after it disconnects
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def start(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((self.host, self.port))
+        self.listener.listen(64)
+        self.port = self.listener.getsockname()[1]     # in case port 0 asked the OS to pick one
+
+        accept_thread = threading.Thread(target=self._accept_loop)
+        accept_thread.daemon = True
+        accept_thread.start()
+        return self
+
+    # returns the result and the solve info, see bridge_protocol.py
+    # cells is the design's predicted cell count, what the scheduler sizes a job by
+    def evaluate(self, params, fidelity='fine', resources=None, cells=None):
+        job = _job(params, fidelity, resources, cells)
+        self.jobs.put(job)
+        job.done.wait()
+        if job.response is None:
+            raise BridgeError('Request %s got no answer from %d workers: %s' % (job.id, len(job.failures), '; '.join(job.failures)))
+        return response_result(job.response), response_info(job.response)
+
+    # tells every worker the run is over
+    def close(self):
+        self.closed = True
+        for _ in self.connections:
+            self.jobs.put(None)
+        for connection in list(self.connections):
+            try:
+                connection.send(make_message('shutdown'))
+            except socket.error:
+                pass
+        self.listener.close()
+
+    def _accept_loop(self):
+        while not self.closed:
+            try:
+                sock, _ = self.listener.accept()
+            except socket.error:
+                return
+
+            worker_thread = threading.Thread(target=self._worker_loop, args=(_connection(sock),))
+            worker_thread.daemon = True
+            worker_thread.start()
+
+    # one thread per connected worker: hand it a job, wait for the answer, repeat
+    def _worker_loop(self, connection):
+        try:
+            hello = connection.receive()
+            if hello is None or hello['type'] != 'hello':
+                raise BridgeError('Worker did not say hello')
+        except (BridgeError, socket.error):
+            connection.close()
+            return
+
+        with self.lock:
+            connection.slot = self._bind(hello.get('worker'))
+            self.connections.append(connection)
+        connection.sock.settimeout(self.heartbeat_timeout)
+
+        try:
+            while not self.closed:
+                job = self.jobs.get()
+                if job is None:
+                    break
+
+                allocated = self.scheduler is not None and job.resources is None
+                resources = self.scheduler.acquire(job.cells, connection.slot) if allocated else job.resources
+                try:
+                    connection.send(make_message('request', id=job.id, params=job.params, fidelity=job.fidelity, resources=resources))
+                    response = self._wait_response(connection, job)
+                    if response is None:
+                        job.failures.append('worker hung up')
+                except socket.timeout:
+                    response = None
+                    job.failures.append('no heartbeat for %s s' % self.heartbeat_timeout)
+                except (BridgeError, socket.error) as e:
+                    response = None
+                    job.failures.append(str(e))
+                finally:
+                    if allocated:
+                        self.scheduler.release(resources)
+
+                # worker died or hung, someone else gets the design, unless it's been through max_attempts workers already
+                if response is None:
+                    if len(job.failures) < self.max_attempts:
+                        self.jobs.put(job)
+                    else:
+                        job.done.set()
+                    break
+
+                job.response = response
+                job.done.set()
+        finally:
+            with self.lock:
+                self.connections.remove(connection)
+            connection.close()
+
+    # the slot a worker had before, unless a connected worker has it now, else the first one nobody connected has (one nobody ever had
+    # if there is one). None without fixed slots. call with self.lock held
+    def _bind(self, worker):
+        if self.scheduler is None or self.scheduler.slots is None:
+            return None
+
+        taken = [connection.slot for connection in self.connections]
+        slot = self.worker_slots.get(worker)
+        if slot is None or slot in taken:
+            n_slots = len(self.scheduler.slots)
+            free = [i for i in range(n_slots) if i not in taken]
+            unused = [i for i in free if i not in self.worker_slots.values()]
+            slot = (unused or free or [len(taken) % n_slots])[0]
+
+        self.worker_slots[worker] = slot
+        return slot
+
+    # the heartbeats wake this up every HEARTBEAT_INTERVAL, that's how often request_timeout gets checked
+    def _wait_response(self, connection, job):
+        deadline = None if self.request_timeout is None else time.time() + self.request_timeout
+        while True:
+            message = connection.receive()      # raises socket.timeout when even the heartbeats stop
+            if message is None:
+                return None
+            if message['type'] == 'response' and message.get('id') == job.id:
+                return message
+            if deadline is not None and time.time() > deadline:
+                raise BridgeError('no answer within request_timeout (%s s)' % self.request_timeout)
+
+
+# worker side (ansys_main): connect to the optimizer and answer requests with handler(params, fidelity, resources) -> (result, info) until told to shut down
+# keeps retrying the connection for connect_timeout seconds, since the optimizer may not be up yet
+# a connection that ends without a shutdown means the optimizer dropped this worker (it took too long, see request_timeout)
+# or went down itself, either way the worker connects again and carries on with the next request
+def serve(handler, worker_name, host=DEFAULT_HOST, port=DEFAULT_PORT, connect_timeout=600):
+    while not _serve_connection(handler, worker_name, host, port, connect_timeout):
+        print('Connection to the optimizer lost, connecting again')
+
+
+# one connection's worth of serve(), True once the optimizer said shutdown
+def _serve_connection(handler, worker_name, host, port, connect_timeout):
+    deadline = time.time() + connect_timeout
+    while True:
+        try:
+            sock = socket.create_connection((host, port))
+            break
+        except socket.error:
+            if time.time() > deadline:
+                raise
+            time.sleep(1)
+
+    connection = _connection(sock)
+    stopped = threading.Event()
+
+    def heartbeat():
+        while not stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                connection.send(make_message('heartbeat'))
+            except socket.error:
+                return
+
+    try:
+        connection.send(make_message('hello', worker=worker_name))
+        heartbeat_thread = threading.Thread(target=heartbeat)
+        heartbeat_thread.daemon = True
+        heartbeat_thread.start()
+
+        while True:
+            message = connection.receive()
+            if message is None:
+                return False
+            if message['type'] == 'shutdown':
+                return True
+
+            if message['type'] == 'request':
+                try:
+                    result, info = handler(message['params'], message['fidelity'], message.get('resources'))
+                except Exception as e:
+                    connection.send(make_message('response', id=message['id'], result=None, error=repr(e)))
+                else:
+                    connection.send(make_message('response', id=message['id'], result=result, info=info))
+    except socket.error:
+        return False
+    finally:
+        stopped.set()
+        connection.close()
@@ -0,0 +1,99 @@
+# library of converged Fluent solutions, so a new design can start from the flow field of the closest design already solved
+# instead of a cold initialization. PSO particles bunch up late in a run, the closest solved design is usually a near neighbour
+#
+# layout of the library folder, shared by every ansys_main worker:
+#   <id>.ip      Fluent interpolation file (file/interpolate/write-data), mesh independent so any design can read it
+#   <id>.json    {"params": {display name: value}, "fidelity": level, "file": "<id>.ip", "created": unix time}
+# the .json goes in last (written under a temporary name and renamed), an entry without one is still being written
+#
+# distance between designs is euclidean over relative parameter differences, |a - b| / max(|a|, |b|),
+# so parameters in mm and plate counts weigh the same without ansys_main knowing the PSO ranges
+
+import os
+import json
+import time
+import uuid
+from bridge_protocol import make_dirs
+
+# Fluent TUI lines, the zones are the ones fluent_script.jou sets up. check them against your Fluent version's prompts
+WRITE_COMMAND = '/file/interpolate/write-data "%s" fluid heatsink () pressure x-velocity y-velocity z-velocity temperature k omega ()'
+READ_COMMAND = '/solve/initialize/initialize-flow\n/file/interpolate/read-data "%s" fluid heatsink ()'
+
+
+def relative_distance(a, b):
+    total = 0.0
+    for name in a:
+        scale = max(abs(a[name]), abs(b[name]), 1e-12)
+        total += ((a[name] - b[name]) / scale) ** 2
+    return total ** 0.5
+
+
+# Fluent wants forward slashes, backslashes in a journal string are escapes
+def fluent_path(filepath):
+    return filepath.replace('\\', '/')
+
+
+class solution_library:
+    def __init__(self, folder, max_distance=0.25):
+        self.folder = folder
+        self.max_distance = max_distance
+        self.entries = {}       # id -> entry, only files not seen before get read on refresh
+
+        make_dirs(folder)
+
+    def refresh(self):
+        for filename in os.listdir(self.folder):
+            if not filename.endswith('.json'):
+                continue
+
+            entry_id = filename[:-len('.json')]
+            if entry_id not in self.entries:
+                with open(os.path.join(self.folder, filename), 'r') as f:
+                    self.entries[entry_id] = json.load(f)
+
+    # closest solved design with the same parameters and its distance, None if nothing is within max_distance
+    def nearest(self, params):
+        self.refresh()
+
+        best, best_distance = None, self.max_distance
+        for entry in self.entries.values():
+            if set(entry['params']) != set(params):
+                continue
+
+            distance = relative_distance(params, entry['params'])
+            if distance <= best_distance:
+                best, best_distance = entry, distance
+
+        if best is None:
+            return None
+        return best, best_distance
+
+    # where the next solution goes, hand it to add() once Fluent has written it
+    def new_file(self):
+        return os.path.join(self.folder, '%d_%s.ip' % (time.time(), uuid.uuid4().hex[:8]))
+
+    def add(self, params, filepath, fidelity):
+        entry_id = os.path.basename(filepath)[:-len('.ip')]
+        entry = {'params': params, 'fidelity': fidelity, 'file': os.path.basename(filepath), 'created': time.time()}
+
+        json_path = os.path.join(self.folder, entry_id + '.json')
+        with open(json_path + '.tmp', 'w') as f:
+            json.dump(entry, f)
+        os.rename(json_path + '.tmp', json_path)
+
+        self.entries[entry_id] = entry
+
+    def file_path(self, entry):
+        return os.path.join(self.folder, entry['file'])
+
+    # journal lines that initialize the solve: interpolated from the nearest solved design, or nothing (cold start) if there isn't one
+    def initialization(self, params):
+        found = self.nearest(params)
+        if found is None:
+            return '', None
+
+        entry, distance = found
+        return READ_COMMAND % fluent_path(self.file_path(entry)), distance
+
+    def save_command(self, filepath):
+        return WRITE_COMMAND % fluent_path(filepath)
@@ -0,0 +1,224 @@
+# array-backed swarm core for PSO_optimizer
+# same algorithm as mixedvar_PSO, but the whole swarm lives in (n_particles, n_params) numpy arrays instead of sets of PSO_param objects,
+# so the velocity update, the discrete resampling and the convergence check are each one vectorized step
+#
+# PSO_param is still what the user sees: f and constraint_func get handed a set of PSO_param objects built from a row of the arrays
+
+import numpy as np
+import numpy.linalg as LA
+from mixedvar_PSO import PSO_param, PSO_optimizer_base
+from PSO_memo import PSO_memo
+from PSO_lattice import lattice_of
+
+
+# lightweight stand-in for PSO_particle so anything reading swarm.particles (logs, replays) keeps working
+class PSO_array_particle:
+    def __init__(self, swarm, i):
+        self.swarm = swarm
+        self.i = i
+
+    @property
+    def params(self):
+        return self.swarm.row_params(self.swarm.pos[self.i], self.swarm.vel[self.i])
+
+    @property
+    def bparams(self):
+        return self.swarm.row_params(self.swarm.bpos[self.i])
+
+    @property
+    def bval(self):
+        return self.swarm.bvals[self.i]
+
+    def bparam_val(self, name):
+        j = self.swarm.index.get(name)
+        return None if j is None else self.swarm.bpos[self.i, j]
+
+
+# columns are the template params sorted by name, self.index maps name -> column
+class PSO_array_swarm:
+    def __init__(self, params, n_particles, memo, store=None):
+        self.memo = memo
+        self.store = store
+        self.templates = sorted(params, key=lambda p: p.name)
+        self.names = [param.name for param in self.templates]
+        self.index = {name: j for j, name in enumerate(self.names)}
+
+        self.discrete = np.array([param.discrete for param in self.templates], dtype=bool)
+        self.min_vals = np.array([param.min_val for param in self.templates], dtype=float)
+        self.max_vals = np.array([param.max_val for param in self.templates], dtype=float)
+        self.discretizations = np.array([param.discretization if param.discrete else 0 for param in self.templates], dtype=float)
+
+        # legal values of every discrete param, built once instead of every update
+        self.lattices = {j: lattice_of(param) for j, param in enumerate(self.templates) if param.discrete}
+
+        n_dims = len(self.templates)
+        self.n_particles = n_particles
+        self.pos = np.zeros((n_particles, n_dims))
+        self.vel = np.zeros((n_particles, n_dims))
+        self.vals = np.full(n_particles, float('inf'))
+        self.bpos = np.zeros((n_particles, n_dims))
+        self.bvals = np.full(n_particles, float('inf'))
+
+        self.swarm_bpos = None
+        self.bval = float('inf')
+
+    @property
+    def particles(self):
+        return [PSO_array_particle(self, i) for i in range(self.n_particles)]
+
+    @property
+    def bparams(self):
+        if self.swarm_bpos is None:
+            return None
+        return self.row_params(self.swarm_bpos)
+
+    def bparam_val(self, name):
+        return self.swarm_bpos[self.index[name]]
+
+    # user-facing view of one row, a fresh set every time so f and constraint_func can't edit the arrays
+    def row_params(self, row, vel_row=None):
+        return {PSO_param(param.name, param.discrete, param.min_val, param.max_val, row[j], None if vel_row is None else vel_row[j], param.discretization)
+                for j, param in enumerate(self.templates)}
+
+    def params_row(self, params):
+        row = np.empty(len(self.templates))
+        for param in params:
+            row[self.index[param.name]] = param.val
+        return row
+
+    # myround() on every discrete column at once
+    def snap(self, rows):
+        rows = np.array(rows, dtype=float)
+        disc = self.discretizations[self.discrete]
+        rows[..., self.discrete] = np.round(disc * np.round(rows[..., self.discrete] / disc), 2)
+        return rows
+
+    # rows are already in the memo's sorted-name order
+    def swarm_inform(self, row, val):
+        self.memo.store(row, val)
+
+        if self.store is not None:
+            self.store.store(dict(zip(self.names, map(float, row))), val)
+
+    def swarm_memory(self, row):
+        val = self.memo.lookup(row)
+
+        if val is None and self.store is not None:
+            val = self.store.lookup(dict(zip(self.names, map(float, row))))
+            if val is not None:
+                self.memo.store(row, val)
+
+        return val
+
+    def record(self, i, val):
+        self.vals[i] = val
+        if val < self.bvals[i]:
+            self.bvals[i] = val
+            self.bpos[i] = self.pos[i]
+
+    def snapshot(self):
+        return {'pos': self.pos, 'vel': self.vel, 'vals': self.vals, 'bpos': self.bpos, 'bvals': self.bvals,
+                'swarm_bpos': self.swarm_bpos, 'swarm_bval': self.bval}
+
+    # same as PSO_swarm.immigrate, rows are in column order already
+    def immigrate(self, rows, vals):
+        for row, val in zip(rows, vals):
+            i = np.argmax(self.bvals)
+            if val >= self.bvals[i]:
+                continue
+
+            self.pos[i] = self.bpos[i] = row
+            self.vals[i] = self.bvals[i] = val
+            self.memo.store(self.pos[i], val)
+
+        self.update_best_location()
+
+    # same as PSO_swarm: a swarm best even when every value so far is inf
+    def update_best_location(self):
+        i = np.argmin(self.bvals)
+        if self.swarm_bpos is None or self.bvals[i] < self.bval:
+            self.bval = float(self.bvals[i])
+            self.swarm_bpos = self.bpos[i].copy()
+
+    # for discrete PSO parameters, a Gaussian probability curve centered around the "continuous" point decides where to jump next
+    # one column at a time, every particle at once (see PSO_lattice)
+    def sample_lattices(self, pos):
+        for j, lattice in self.lattices.items():
+            pos[:, j] = lattice.sample(pos[:, j])
+
+        return pos
+
+
+# drop-in replacement for PSO_optimizer, optimize() and resume() have the same signature and return value
+# there's no optimize_async, that moves one particle at a time, use PSO_optimizer for it
+class PSO_array_optimizer(PSO_optimizer_base):
+
+    # the whole swarm goes through PSO_repair in one batch, projecting towards the nearest particle best that's been evaluated
+    def clip_rows(self, rows):
+        return self.repair.repair_rows(rows, self.swarm.bpos[np.isfinite(self.swarm.bvals)])
+
+    # same batching as PSO_optimizer.evaluate_particles, with rows as keys
+    def evaluate_rows(self):
+        swarm = self.swarm
+        keys = [tuple(row) for row in swarm.pos]
+        with self.timer.span('memory_lookup'):
+            recollections = [swarm.swarm_memory(row) for row in swarm.pos]
+        self.count_recollections(recollections)
+
+        predictions = [None] * len(keys)
+        if self.surrogate is not None:
+            with self.timer.span('surrogate_screen'):
+                candidates = [i for i, recollection in enumerate(recollections) if recollection is None]
+                send, means = self.surrogate.screen(swarm.pos[candidates], swarm.bvals[candidates])
+            for i, send_i, mean in zip(candidates, send, means):
+                if not send_i:
+                    predictions[i] = float(mean)
+            self.timer.count('surrogate_skipped', sum(prediction is not None for prediction in predictions))
+
+        to_evaluate = list({key: None for key, recollection, prediction in zip(keys, recollections, predictions)
+                            if recollection is None and prediction is None})
+        values, from_f = self.evaluate_designs(to_evaluate, [swarm.row_params(key) for key in to_evaluate])
+        results = dict(zip(to_evaluate, values))
+        real_keys = [key for key, is_real in zip(to_evaluate, from_f) if is_real]
+        for key in real_keys:
+            swarm.swarm_inform(key, results[key])
+
+        if self.surrogate is not None:
+            known = [(key, recollection) for key, recollection in zip(keys, recollections) if recollection is not None]
+            known += [(key, results[key]) for key in real_keys]
+            self.surrogate.observe([key for key, _ in known], [val for _, val in known])
+
+        for i, (key, recollection, prediction) in enumerate(zip(keys, recollections, predictions)):
+            if recollection is not None:
+                swarm.record(i, recollection)
+            elif prediction is not None:
+                swarm.record(i, prediction)
+            else:
+                swarm.record(i, results[key])
+
+    def place_particles(self, n_particles, box_init):
+        self.n_particles = n_particles
+        self.swarm = PSO_array_swarm(self.params, n_particles, PSO_memo(self.params, self.cache_tolerance, self.cache_size), self.store)
+        self.swarm.pos, self.swarm.vel = self.initial_rows(n_particles, box_init)
+        # the starting position is the best one until something beats it, inf (a failed solve) doesn't
+        self.swarm.bpos = self.swarm.pos.copy()
+
+    def move_swarm(self, w_inertia, c_cog, c_social):
+        swarm = self.swarm
+        r_cog = np.random.rand(*swarm.pos.shape)
+        r_social = np.random.rand(*swarm.pos.shape)
+
+        with self.timer.span('move'):
+            swarm.vel = w_inertia * swarm.vel + c_cog * r_cog * (swarm.bpos - swarm.pos) + c_social * r_social * (swarm.swarm_bpos - swarm.pos)
+            rows = swarm.sample_lattices(swarm.pos + swarm.vel)
+        with self.timer.span('repair'):
+            swarm.pos = self.clip_rows(rows)
+
+    def evaluate_swarm(self, logging):
+        with self.timer.span('evaluate_swarm'):
+            self.evaluate_rows()
+        self.log_particles(self.swarm.vals, logging)
+        self.swarm.update_best_location()
+
+    def bests_within_range(self, convergence_range):
+        return bool(np.all(LA.norm(self.swarm.bpos - self.swarm.swarm_bpos, axis=1) < convergence_range))
@@ -0,0 +1,69 @@
+# message schema shared by every transport between cpython_script and ansys_main (ansys_queue.py, ansys_socket.py)
+#
+# ansys_main runs inside Workbench's IronPython 2.7, so it and everything it imports has to stay python 2 compatible:
+# this file, ansys_queue, ansys_socket, ansys_warmstart, ansys_convergence, config and PSO_timing. no f-strings, no
+# keyword-only arguments, no exist_ok, no numpy
+#
+# every message is one JSON object with a protocol version "v" and a "type":
+#   hello       worker -> optimizer   {"worker": name}
+#   request     optimizer -> worker   {"id": request id, "params": {display name: value}, "fidelity": "coarse" or "fine"}
+#               fidelity picks the mesh sizes and iteration count ansys_main uses, from the [fidelity_<level>] section of config.ini
+#               "resources": {"processors": n, "gpus": n} or null, what Fluent gets launched with (see PSO_scheduler.py), null for the defaults
+#   response    worker -> optimizer   {"id": request id, "result": value, "info": {...}} or {"id": request id, "error": message}
+#               info describes the solve: {"iterations": solver iterations used, "converged": bool, ...} (see ansys_convergence.py)
+#   heartbeat   worker -> optimizer   {} while the worker is alive, solving or not
+#   shutdown    optimizer -> worker   {} the run is over, worker can exit
+#
+# bump PROTOCOL_VERSION whenever a field changes meaning, both ends refuse messages from a different version
+
+import os
+import json
+
+PROTOCOL_VERSION = 4
+
+
+class BridgeError(Exception):
+    pass
+
+
+# os.makedirs for the folders every worker (and the optimizer) shares: they all start at once and race to create them
+def make_dirs(folder):
+    if not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:     # somebody else made it first
+            if not os.path.isdir(folder):
+                raise
+
+
+def make_message(msg_type, **fields):
+    message = {'v': PROTOCOL_VERSION, 'type': msg_type}
+    message.update(fields)
+    return json.dumps(message)
+
+
+def parse_message(text):
+    try:
+        message = json.loads(text)
+    except ValueError:
+        raise BridgeError('Not a bridge message: %r' % text[:200])
+
+    if not isinstance(message, dict) or 'type' not in message:
+        raise BridgeError('Not a bridge message: %r' % text[:200])
+
+    if message.get('v') != PROTOCOL_VERSION:
+        raise BridgeError('Bridge protocol version %s, expected %s' % (message.get('v'), PROTOCOL_VERSION))
+
+    return message
+
+
+# what the client hands back to the optimizer, worker-side failures come back as an exception instead of a number
+def response_result(message):
+    if message.get('error') is not None:
+        raise BridgeError('Request %s failed on the worker: %s' % (message.get('id'), message['error']))
+
+    return message['result']
+
+
+def response_info(message):
+    return message.get('info') or {}
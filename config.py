@@ -29,6 +29,10 @@ class Config:
     def get(self, section, key):
         return self.config.get(section, {}).get(key)
 
+    # whole section as a dict of strings
+    def items(self, section):
+        return dict(self.config.get(section, {}))
+
 # Create a global instance
 config = Config()
 
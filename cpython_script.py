@@ -1,7 +1,17 @@
-import os
-import time
+import sys
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from mixedvar_PSO import PSO_param, PSO_optimizer
-from config import path
+from config import path, config
+from ansys_queue import ansys_queue
+from ansys_socket import bridge_server
+from bridge_protocol import BridgeError
+from PSO_store import PSO_eval_store, fingerprint
+from PSO_fidelity import PSO_fidelity
+from PSO_termination import max_evaluations, stagnation
+from PSO_timing import PSO_timer
+from PSO_scheduler import PSO_scheduler, parallel_speedup
+from PSO_cost import PSO_cost_model
 
 
 input_ANSYS_params = {
@@ -12,22 +22,111 @@ input_ANSYS_params = {
 }
 
 
-def optimization_function(params):
+# number of ansys_main workers connected to the bridge, one design per worker at a time
+ANSYS_WORKERS = 1
+
+
+# the socket transport is the default, the queue folder is the fallback for when sockets aren't an option
+# the bridge sizes every solve with the scheduler, over the socket each worker keeps its own slot (see ansys_socket.py)
+def make_bridge(scheduler):
+    settings = config.items('bridge')
+    request_timeout = float(settings['request_timeout']) if settings.get('request_timeout') else None
+    if settings.get('transport') == 'file':
+        return ansys_queue(path('ansys_queue'), request_timeout=request_timeout, scheduler=scheduler)
+
+    return bridge_server(port=int(settings['port']), request_timeout=request_timeout, max_attempts=int(settings.get('max_attempts', 2)),
+                         scheduler=scheduler).start()
+
+bridge = None # made in __main__, so importing this file doesn't open a port
+
+
+# splits the [resources] machine between the solves running at once, None (every solve gets ansys_main's defaults) without a core count
+def make_scheduler():
+    resources = config.items('resources')
+    if not resources.get('cores'):
+        return None
+
+    speedup = parallel_speedup(float(resources['serial_fraction']), float(resources['min_cells_per_core']))
+    workers = ANSYS_WORKERS if resources.get('fixed_slots', 'yes') == 'yes' else None
+    return PSO_scheduler(int(resources['cores']), int(resources['gpus']), min_cores=int(resources['min_cores']),
+                         granularity=int(resources['granularity']), speedup=speedup, workers=workers)
+
+scheduler = None # made in __main__
+
+
+# rough cell count of a design: the fluid around the pins at the fluid element size plus the pins at the solid one
+# only used to size the solve's process count. PIN_EXTRUSION is a guess at how tall the pins are (mm), check it against the geometry
+PIN_EXTRUSION = 10
+
+def predicted_cells(param_dict, fidelity):
+    sizes = config.items('fidelity_' + fidelity)
+    solid = param_dict['n_width'] * param_dict['n_length'] * param_dict['pin_width'] * param_dict['pin_height'] * PIN_EXTRUSION
+    fluid = 60.65846 * 58 * PIN_EXTRUSION - solid
+    return fluid / (float(sizes['fluid_element_size']) * 1e3) ** 3 + solid / (float(sizes['solid_element_size']) * 1e3) ** 3
+
+
+# what the cost model predicts a solve's time from: meshing and solving time grow with the pin count and the cell count,
+# solve time roughly like a power of the cells, hence the log. one model per fidelity, so the fine cell count stands in for both
+def cost_features(params):
     param_dict = {param.name: float(param.val) for param in params}
-    
-    # Write params to a file for IronPython to read
-    with open(path('ansys_request'), 'w') as f:
-        f.write(str(param_dict))
-    
-    # Wait for ANSYS result
-    while not os.path.exists(path('ansys_response')):
-        time.sleep(0.1)
-    
-    with open(path('ansys_response'), 'r') as f:
-        result = float(f.read().strip())
-    
-    os.remove(path('ansys_response'))
-    return result
+    return [param_dict['n_width'] * param_dict['n_length'], np.log(predicted_cells(param_dict, 'fine'))]
+
+
+# a design is within this many degrees of the best one so far on the coarse mesh -> it gets a fine solve
+PROMOTE_MARGIN = 2.0
+
+
+# designs whose solve hit the iteration cap or stopped with heatsink_temp still drifting (see ansys_convergence.py)
+# their values still steer the swarm, but they're listed next to the result so nobody trusts them blindly
+unconverged = []
+
+# designs that never got a result, scored FAILURE_VALUE after RETRIES more tries ([bridge] in config.ini)
+# the eval store only keeps finite values, so with the default inf they're solved again by the next run
+failed = []
+RETRIES = int(config.get('bridge', 'retries') or 0)
+FAILURE_VALUE = float(config.get('bridge', 'failure_value') or 'inf')
+
+# shared with the optimizer, its report at the end of the run covers both (see PSO_timing.py)
+timer = PSO_timer()
+
+
+# a failed solve mustn't take the whole optimization down with it (executor.map re-raises in optimize), after RETRIES more tries
+# the design is scored FAILURE_VALUE and the run carries on
+def solve(params, fidelity):
+    param_dict = {param.name: float(param.val) for param in params}
+    for attempt in range(RETRIES + 1):
+        try:
+            with timer.span('bridge', fidelity=fidelity) as span:
+                result, info = bridge.evaluate(param_dict, fidelity, cells=predicted_cells(param_dict, fidelity))
+            break
+        except BridgeError as e:
+            timer.count('bridge_errors')
+            print(f'{fidelity} solve failed (attempt {attempt + 1} of {RETRIES + 1}): {param_dict}: {e}')
+            error = e
+    else:
+        failed.append((fidelity, param_dict, str(error)))
+        return FAILURE_VALUE
+
+    # whatever the worker didn't spend on the evaluation itself went to waiting for resources, queueing and transport
+    if 'evaluation' in info.get('phases', {}):
+        timer.record('bridge_wait', span.start, span.duration - info['phases']['evaluation'], fidelity=fidelity)
+
+    if not info.get('converged', True):
+        timer.count('unconverged')
+        print(f'Unconverged {fidelity} solve after {info.get("iterations")} iterations: {param_dict} -> {result}')
+        unconverged.append((fidelity, param_dict, float(result), info))
+
+    return float(result)
+
+
+# blocking and thread-safe, so the optimizer can have ANSYS_WORKERS of these waiting at once
+def optimization_function(params):
+    return solve(params, 'fine')
+
+
+# same design on the [fidelity_coarse] mesh and iteration range, a fraction of the cost
+def coarse_optimization_function(params):
+    return solve(params, 'coarse')
 
 
 def input_constraint(params):
@@ -48,15 +147,59 @@ def input_constraint(params):
     return pw < (60.65846 - clearance * (nw - 1)) / nw and ph < (58 - clearance * (nl - 1)) / nl 
 
 
+# input_constraint as a number, >= 0 exactly when it holds (the 1e-6 keeps the boundary itself out, the limits are strict)
+# gives PSO_repair something to project onto when it has no feasible design to repair towards
+def input_constraint_margin(params):
+    vals = {param.name: param.val for param in params}
+    clearance = 0.5
+
+    return min((60.65846 - clearance * (vals['n_width'] - 1)) / vals['n_width'] - vals['pin_width'],
+               (58 - clearance * (vals['n_length'] - 1)) / vals['n_length'] - vals['pin_height']) - 1e-6
+
+
 if __name__ == '__main__':
-    HUGE_NUCLEAR_OPTIMIZER = PSO_optimizer(input_ANSYS_params, optimization_function, input_constraint)
-    result = HUGE_NUCLEAR_OPTIMIZER.optimize(n_particles=16, 
-                                             w_inertia=0.8, 
-                                             c_cog=0.1, 
-                                             c_social=0.1, 
-                                             range_count_thresh=5, 
-                                             convergence_range=5,
-                                             max_iterations=50)
+    scheduler = make_scheduler()
+    bridge = make_bridge(scheduler)
+    timer.events_path = path('timing_events')
+
+    # every solve ever done with this mesh script, journal and fidelity settings is reused, change any of them and the old values no longer match
+    # coarse and fine solves are kept apart by their fidelity settings, both depend on the stopping criteria
+    store = PSO_eval_store(path('eval_store'), fingerprint('heatsink_temp-op', path('mesh_script'), path('fluent_script'), path('fluent_design'), **config.items('fidelity_fine'), **config.items('convergence')))
+    coarse_store = PSO_eval_store(path('eval_store'), fingerprint('heatsink_temp-op', path('mesh_script'), path('fluent_script'), path('fluent_design'), **config.items('fidelity_coarse'), **config.items('convergence')))
+    fidelity = PSO_fidelity(input_ANSYS_params, coarse_optimization_function, promote_margin=PROMOTE_MARGIN, store=coarse_store)
+
+    cost_model = PSO_cost_model(cost_features, n_workers=ANSYS_WORKERS)
+
+    HUGE_NUCLEAR_OPTIMIZER = PSO_optimizer(input_ANSYS_params, optimization_function, input_constraint, store=store, fidelity=fidelity, timer=timer,
+                                           cost_model=cost_model, constraint_margin=input_constraint_margin)
+
+    # python cpython_script.py --resume picks a crashed run back up from its last checkpoint
+    if '--resume' in sys.argv:
+        result = HUGE_NUCLEAR_OPTIMIZER.resume(path('checkpoint'), executor=ThreadPoolExecutor(max_workers=ANSYS_WORKERS))
+    else:
+        result = HUGE_NUCLEAR_OPTIMIZER.optimize(n_particles=16, 
+                                                 w_inertia=0.8, 
+                                                 c_cog=0.1, 
+                                                 c_social=0.1, 
+                                                 range_count_thresh=5, 
+                                                 convergence_range=5,
+                                                 max_iterations=50,
+                                                 executor=ThreadPoolExecutor(max_workers=ANSYS_WORKERS),
+                                                 checkpoint_path=path('checkpoint'),
+                                                 # every real evaluation is a full CFD solve: cap them, and give up once 10 iterations' worth bring nothing
+                                                 termination=[max_evaluations(400), stagnation(160)])
 
     with open(path('optimization_result'), 'w') as f:
-        f.write(str(result))
\ No newline at end of file
+        f.write(str(result))
+        if unconverged:
+            f.write(f'\n\n{len(unconverged)} unconverged solves (fidelity, params, value, solve info):\n')
+            f.write('\n'.join(str(entry) for entry in unconverged))
+        if failed:
+            persisted = 'kept in the eval store, later runs won\'t retry them' if np.isfinite(FAILURE_VALUE) else 'not kept in the eval store, the next run retries them'
+            f.write(f'\n\n{len(failed)} failed solves, scored {FAILURE_VALUE} ({persisted}) (fidelity, params, error):\n')
+            f.write('\n'.join(str(entry) for entry in failed))
+
+    if scheduler is not None:
+        print(scheduler.report())
+
+    bridge.close()
\ No newline at end of file
@@ -1,3 +1,5 @@
+# the element sizes below are placeholders, filled in by ansys_main from the [fidelity_<level>] section of config.ini
+
 named_selection_list = Model.NamedSelections.GetChildren(DataModelObjectCategory.NamedSelection, True)
 
 heatsink_ns = next((obj for obj in named_selection_list if obj.Name == "heatsink"), None)
@@ -16,17 +18,17 @@ mesh.ClearGeneratedData()
 for meshcontrol in Model.Mesh.GetChildren(DataModelObjectCategory.MeshControl, True):
     meshcontrol.Delete()
     
-mesh.ElementSize = Quantity(1e-3, "m")
+mesh.ElementSize = Quantity(float("$element_size"), "m")
 
 fluid_sizing = mesh.AddSizing()
 fluid_sizing.NamedSelection = fluid_ns
 fluid_sizing.Type = SizingType.BodyOfInfluence
 fluid_sizing.BodyOfInfluence = boi_ns
-fluid_sizing.ElementSize = Quantity(3.5e-4, "m")
+fluid_sizing.ElementSize = Quantity(float("$fluid_element_size"), "m")
 
 solid_sizing = mesh.AddSizing()
 solid_sizing.NamedSelection = heatsink_ns
-solid_sizing.ElementSize = Quantity(8e-4, "m")
+solid_sizing.ElementSize = Quantity(float("$solid_element_size"), "m")
 
 geo = Model.Geometry
 solid_part = next((obj for obj in geo.Children[0].Children if obj.Name == "solid"), None)
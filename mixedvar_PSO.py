@@ -2,20 +2,39 @@
 # wiki: https://en.wikipedia.org/wiki/Particle_swarm_optimization
 # good intro: https://machinelearningmastery.com/a-gentle-introduction-to-particle-swarm-optimization/
 
+import os
+import time
 import numpy as np
 import datetime
 import copy
+import concurrent.futures
 import pickle
-from scipy.stats import norm
-import scipy.optimize as optimize
-import numpy.linalg as LA
 from config import path
+from PSO_memo import PSO_memo
+from PSO_log import PSO_run_log
+from PSO_repair import PSO_repair
+from PSO_init import PSO_initializer
+from PSO_lattice import lattice_of
+from PSO_termination import any_of, max_evaluations
+from PSO_timing import PSO_timer
 
 # tiny helper function so cuteeee
 def myround(x, base, prec=2):
     return np.round(base * np.round(float(x)/base), prec)
 
 
+# f as an executor runs it: the value, plus when the call started and how long it took, measured wherever f runs
+# a plain object rather than a closure so it pickles over to a ProcessPoolExecutor (as long as f does), the caller records the time
+class timed_call:
+    def __init__(self, f):
+        self.f = f
+
+    def __call__(self, params):
+        start = time.time()
+        val = self.f(params)
+        return val, start, time.time() - start
+
+
 # parameter is just a container to hold its own information
 # eq and hash are defined so that we can index into a dictionary containing past evaluations, if all the parameters are discrete
 class PSO_param:
@@ -53,41 +72,25 @@ class PSO_param:
 
 
 # params and bparams are sets of PSO_param objects
+# particles don't evaluate themselves, the optimizer does (evaluate_particles, optimize_async) and hands each its value through record()
 class PSO_particle:
-    def __init__(self, f, swarm):
-        self.f = f
+    def __init__(self, swarm):
         self.bparams = None
         self.bval = float('inf')
+        self.val = float('inf')
         self.swarm = swarm
 
-    # run this once when initializing all particles
-    def set_motion(self, params):
-        self.params = params
-        return self.evaluate()
-
-    # all new values discovered are automatically fed to the swarm
-    def evaluate(self):
-        recollection = self.swarm.swarm_memory(self.params)
-
-        if recollection:
-            val = recollection
-        else:
-            val = self.f(self.params)
-            self.swarm.swarm_inform(self.params, val)
-
-        if val < self.bval:         # recollection could be from other particles, so need to do this for both cases
+    # val is the output of f at self.params, wherever it was computed
+    def record(self, val):
+        self.val = val
+        # recollection could be from other particles, so need to do this for both cases
+        # the first value is the best so far even if it's inf (a failed solve), the particle needs a best position to move relative to
+        if self.bparams is None or val < self.bval:
             self.bval = val
             self.bparams = copy.deepcopy(self.params)
 
         return val
 
-    def param_val(self, name):
-        for param in self.params:
-            if param.name == name:
-                return param.val
-
-        return None
-
     def bparam_val(self, name):
         for param in self.bparams:
             if param.name == name:
@@ -97,30 +100,41 @@ class PSO_particle:
 
 
 # bparams is set of PSO_param objects
+# memo is the PSO_memo.PSO_memo holding this run's evaluations
+# store is an optional PSO_store.PSO_eval_store, evaluations from earlier runs are remembered through it
 class PSO_swarm:
-    def __init__(self):
+    def __init__(self, memo, store=None):
         self.bparams = None
         self.bval = float('inf')
+        self.memo = memo
+        self.store = store
 
     # call this once right after __init__ to add particle associations, needs to be outside of __init__ because objects defs would be circular that way
     # swarm would need particle objects for init but particle object needs swarm for init
-    def add_particles(self, PSO_particles, all_params_discrete):
+    def add_particles(self, PSO_particles):
         self.particles = PSO_particles
-        if all_params_discrete:
-            self.param_val_dict = {}
 
-    def swarm_inform(self, params, val):      
-        # deepcopy() needed because otherwise ELEMENTS of frozenset() can be edited
-        if hasattr(self, 'param_val_dict'):
-            self.param_val_dict[frozenset(copy.deepcopy(params))] = val
+    # flat tuple that identifies the position of params, two particles on the same point share it
+    def memo_key(self, params):
+        return self.memo.key(self.memo.row(params))
+
+    def swarm_inform(self, params, val):
+        self.memo.store(self.memo.row(params), val)
+
+        if self.store is not None:
+            self.store.store({param.name: float(param.val) for param in params}, val)
 
     def swarm_memory(self, params):
-        # I do not know why I need to use copy.deepcopy() to do indexing correctly and I do not care
-        # need to use hasattr() and get() because no guarantees for either condition (don't want errors)
-        if hasattr(self, 'param_val_dict') and self.param_val_dict.get(frozenset(copy.deepcopy(params))):
-            return self.param_val_dict[frozenset(copy.deepcopy(params))]
+        row = self.memo.row(params)
+        val = self.memo.lookup(row)
 
-        return None
+        # anything evaluated in an earlier run with the same setup, pulled into the memo so the database is only asked once
+        if val is None and self.store is not None:
+            val = self.store.lookup({param.name: float(param.val) for param in params})
+            if val is not None:
+                self.memo.store(row, val)
+
+        return val
 
     def bparam_val(self, name):
         for param in self.bparams:
@@ -128,10 +142,44 @@ class PSO_swarm:
                 return param.val
 
         return None
+
+    # the numbers PSO_log records, as arrays with columns in sorted-name order (same order as the memo)
+    def snapshot(self):
+        names = self.memo.names
+
+        def row(params, attr='val'):
+            by_name = {param.name: getattr(param, attr) for param in params}
+            return [by_name[name] for name in names]
+
+        return {'pos': np.array([row(particle.params) for particle in self.particles], dtype=float),
+                'vel': np.array([row(particle.params, 'vel') for particle in self.particles], dtype=float),
+                'vals': np.array([particle.val for particle in self.particles], dtype=float),
+                'bpos': np.array([row(particle.bparams) if particle.bparams else [np.nan] * len(names) for particle in self.particles], dtype=float),
+                'bvals': np.array([particle.bval for particle in self.particles], dtype=float),
+                'swarm_bpos': None if self.bparams is None else np.array(row(self.bparams), dtype=float),
+                'swarm_bval': self.bval}
     
+    # migrants from other swarms (see PSO_islands): every (row in memo column order, value) takes over the particle with the worst best,
+    # position and best both, if it beats that best. velocities stay, the newcomer keeps moving the way the old particle did
+    def immigrate(self, rows, vals):
+        for row, val in zip(rows, vals):
+            worst = max(self.particles, key=lambda particle: particle.bval)
+            if val >= worst.bval:
+                continue
+
+            by_name = dict(zip(self.memo.names, row))
+            for param in worst.params:
+                param.val = by_name[param.name]
+            worst.params = set(worst.params)
+            worst.val = worst.bval = val
+            worst.bparams = copy.deepcopy(worst.params)
+            self.memo.store(self.memo.row(worst.params), val)
+
+        self.update_best_location()
+
     def update_best_location(self):
         for particle in self.particles:
-            if particle.bval < self.bval:
+            if particle.bparams is not None and (self.bparams is None or particle.bval < self.bval):
                 self.bval = particle.bval
                 self.bparams = copy.deepcopy(particle.bparams)
 
@@ -141,243 +189,593 @@ class PSO_swarm:
 # as they're just a template to define what TYPE of parameter the optimizer is dealing with, and initialize the particles that way
 #
 # f is the optimization function that receives a set of PSO_param objects and is minimized
-class PSO_optimizer:
-    def __init__(self, params, f, constraint_func=None):
+# store is an optional PSO_store.PSO_eval_store, checked before f is ever called and fed every new evaluation
+# cache_tolerance lets a new point reuse a past evaluation within that distance (continuous params only, see PSO_memo),
+# cache_size caps how many evaluations the run keeps in memory
+# surrogate is an optional PSO_surrogate.PSO_surrogate that screens out candidates before they reach f
+# fidelity is an optional PSO_fidelity.PSO_fidelity, a coarse solve for every design and f only for the ones near the swarm best
+# timer is an optional PSO_timing.PSO_timer (give it an events_path to get every span as a JSON line), its report ends up in the log
+# cost_model is an optional PSO_cost.PSO_cost_model, fed every evaluation's time: batches go to the executor most expensive first
+# and the iteration log gets a predicted remaining run time
+# constraint_margin is an optional continuous version of constraint_func (>= 0 inside), lets PSO_repair project a point onto the
+# constraint when there's no feasible point to bisect towards
+#
+# this is everything optimize() and resume() need, shared by the object core (PSO_optimizer below) and the array core (array_PSO)
+class PSO_optimizer_base:
+    def __init__(self, params, f, constraint_func=None, store=None, cache_tolerance=0, cache_size=None, surrogate=None, fidelity=None, timer=None,
+                 cost_model=None, constraint_margin=None):
         self.params = params
         self.f = f
+        self.store = store
+        self.cache_tolerance = cache_tolerance
+        self.cache_size = cache_size
+        self.surrogate = surrogate
+        self.fidelity = fidelity
+        self.timer = PSO_timer() if timer is None else timer
+        self.cost_model = cost_model
+        self.executor = None
+        self.initializer = None
         
         if constraint_func == None:
             self.constraint_func = lambda _ : True
         else:
             self.constraint_func = constraint_func
 
-    # this function exists just to bring particles originally outside the allowed boundary back into the viable region
-    # the region is not just defined by param min and max values, but also constraint_func of PSO_optimizer
-    def clip_to_constraint(self, params):
-        # do NOT use self.params as those are empty templates we don't want edited remember, use deepcopy
-        temp_params = sorted(copy.deepcopy(params), key=lambda p: p.name)
-        x0 = np.array([param.val for param in temp_params])
-
-        def objective(x):
-            return LA.norm(np.subtract(x, x0))  # Sum of squared distances from original point - find closest point to x0 that obeys constraint
-
-        def constraint(x):
-            # assign values being tested by scipy optimize to temp_params for constraint_func to evaluate
-            for param, value in zip(temp_params, x):
-                param.val = value
-
-            # inequality of optimize.minimize() expects a number, not a bool - so tack on float()
-            return float(self.constraint_func(set(temp_params)))
-
-        bounds = [(param.min_val, param.max_val) for param in temp_params]
-
-        result = optimize.minimize(
-            objective,
-            x0,
-            method='SLSQP',
-            constraints={'type': 'ineq', 'fun': constraint},
-            bounds=bounds
-        )
-
-        if not result.success:
-            print('Warning: Could not find a point satisfying the constraint')
-            raise ValueError('Warning: Could not find a point satisfying the constraint')
-
-        for param, value in zip(temp_params, result.x):
-            param.val = value
-
-        # result just optimized points to be as close to the original point as possible while obeying constraint,
-        # but now every parameter holds a continuous value, including discrete parameters
-        # 
-        # need to snap the discrete parameters to a nearby legal point
-        if next((x for x in temp_params if x.discrete == True), None):
-            def generate_rounded_combinations(params, MU_MU_MU_MULTIPLIER):
-                combinations = []
-                for param in params:
-                    if param.discrete:
-                        # for discrete parameters, try snapping to every legal point in a square, range defined by MU_MU_MU_MULTIPLIER value
-                        rounded_value = myround(param.val, param.discretization)
-                        combinations.append([max(min(rounded_value + i * param.discretization, param.max_val), param.min_val) for i in range(-MU_MU_MU_MULTIPLIER, MU_MU_MU_MULTIPLIER + 1)])
-                    else:
-                        # don't change the continuous variables
-                        combinations.append([param.val])
-
-                all_combinations = np.array(np.meshgrid(*combinations)).T.reshape(-1, len(params))
-                return all_combinations
-
-            MU_MU_MU_MULTIPLIER = 0
-            while True:
-                rounded_combinations = generate_rounded_combinations(temp_params, MU_MU_MU_MULTIPLIER)
-                # try every discrete parameter combination in the MU_MU_MU_MULTIPLIER range to see what works
-                for rounded_vals in rounded_combinations:
-                    if constraint(rounded_vals):
-                        for param, value in zip(temp_params, rounded_vals):
-                            param.val = value
-                        return set(temp_params)
-                
-                MU_MU_MU_MULTIPLIER += 1
-
-                if MU_MU_MU_MULTIPLIER > 50: # yeah 50 for now is too bad, magic number yeah so what
-                    print('Warning: Could not find a point satisfying the constraint with discrete rounding')
-                    raise ValueError('Warning: Could not find a point satisfying the constraint with discrete rounding')
+        self.repair = PSO_repair(params, self.constraint_func, constraint_margin)
 
-        else:
-            return set(temp_params)
-    
-    def initialize_particles(self, n_particles, logging, box_init):
-        self.n_particles = n_particles
-        self.swarm = PSO_swarm()
-        self.swarm.add_particles([PSO_particle(self.f, self.swarm) for _ in range(n_particles)], all(param.discrete for param in self.params))
+    # brings a batch of freshly moved particles back into the viable region, projecting towards the nearest particle best
+    def repair_particles(self, particles):
+        anchors = [self.repair.row(particle.bparams) for particle in self.swarm.particles if particle.bparams is not None]
+        rows = self.repair.repair_rows([self.repair.row(particle.params) for particle in particles], anchors)
 
-        if box_init:
-            # make a grid of points
-            # Calculate the number of points along each dimension
-            points_per_dim = int(np.ceil(n_particles ** (1 / len(self.params))))
+        for particle, row in zip(particles, rows):
+            vals = dict(zip(self.repair.names, row))
+            for param in particle.params:
+                param.val = vals[param.name]
+            # vals changed, so the set has to rehash
+            particle.params = set(particle.params)
+
+    # run f on a list of param sets, through the executor if there is one
+    # executor is anything with a concurrent.futures style map() (ThreadPoolExecutor, ProcessPoolExecutor, or your own),
+    # map() hands results back in submission order so the outcome doesn't depend on which evaluation finishes first
+    # with a cost model the batch is submitted longest predicted job first (executors start jobs in submission order),
+    # so the slow designs don't end up alone at the end of the iteration. results still come back in params_list order
+    # self.n_evaluations counts every real solve (f, or f_coarse of a fidelity stage), for the termination policies
+    def map_f(self, params_list, f=None):
+        f = self.f if f is None else f
+        kind = 'objective' if f is self.f else 'objective_coarse'
+        # every design of the batch was remembered
+        if not params_list:
+            return []
+        self.n_evaluations += len(params_list)
+
+        order = range(len(params_list)) if self.cost_model is None else self.cost_model.order(kind, params_list)
+        ordered = [params_list[i] for i in order]
+        outcomes = map(timed_call(f), ordered) if self.executor is None else self.executor.map(timed_call(f), ordered)
+
+        results = [None] * len(params_list)
+        for i, params, (val, start, duration) in zip(order, ordered, outcomes):
+            self.record_evaluation(kind, params, start, duration)
+            results[i] = val
+        return results
+
+    # every real evaluation's time, as an 'objective' span ('objective_coarse' for anything else, e.g. the fidelity stage's f_coarse)
+    # the same name is the kind of evaluation the cost model learns from. always called in this process, whatever the executor
+    def record_evaluation(self, kind, params, start, duration):
+        self.timer.record(kind, start, duration)
+        if self.cost_model is not None:
+            self.cost_model.observe(kind, params, duration)
+
+    # real evaluations still to come: this many per iteration so far, for the iterations max_iterations has left,
+    # cut down to what the max_evaluations policies in termination allow
+    def remaining_evaluations(self):
+        per_iteration = self.n_evaluations / (self.iterations + 1)
+        remaining = per_iteration * (self.run_args['max_iterations'] - self.iterations)
+
+        policies = [self.run_args['termination']]
+        while policies:
+            policy = policies.pop()
+            if isinstance(policy, max_evaluations):
+                remaining = min(remaining, policy.n - self.n_evaluations)
+            elif isinstance(policy, any_of):
+                policies.extend(policy.policies)
+
+        return max(remaining, 0)
+
+    # '' if there is no cost model or it has nothing to go on yet
+    def remaining_time_line(self):
+        if self.cost_model is None:
+            return ''
+
+        seconds = self.cost_model.remaining_time([particle.params for particle in self.swarm.particles], self.remaining_evaluations())
+        if seconds is None:
+            return ''
+        return f', predicted remaining {datetime.timedelta(seconds=round(seconds))}'
+
+    # values for a batch of distinct designs nobody remembers: f for all of them, or whatever the fidelity stage decides
+    # returns the values and, per design, whether it came from f (only those go into the memo, the store and the surrogate)
+    def evaluate_designs(self, rows, params_list):
+        if self.fidelity is None:
+            return self.map_f(params_list), [True] * len(params_list)
+
+        return self.fidelity.evaluate(rows, params_list, self.swarm.bval, self.map_f)
+
+    # evaluate every particle's current params as one batch, then feed the results back to the particles
+    # positions the swarm remembers are skipped, and two particles landing on the same point only cost one evaluation
+    # with a surrogate, candidates it screens out get its prediction instead of a real evaluation
+    def evaluate_particles(self, particles):
+        with self.timer.span('memory_lookup'):
+            recollections = [self.swarm.swarm_memory(particle.params) for particle in particles]
+        memo = self.swarm.memo
+        self.count_recollections(recollections)
+
+        predictions = [None] * len(particles)
+        if self.surrogate is not None:
+            with self.timer.span('surrogate_screen'):
+                candidates = [i for i, recollection in enumerate(recollections) if recollection is None]
+                send, means = self.surrogate.screen([memo.row(particles[i].params) for i in candidates], [particles[i].bval for i in candidates])
+            for i, send_i, mean in zip(candidates, send, means):
+                if not send_i:
+                    predictions[i] = float(mean)
+            self.timer.count('surrogate_skipped', sum(prediction is not None for prediction in predictions))
+
+        to_evaluate = {}
+        for particle, recollection, prediction in zip(particles, recollections, predictions):
+            if recollection is None and prediction is None:
+                to_evaluate.setdefault(self.swarm.memo_key(particle.params), particle.params)
+
+        keys = list(to_evaluate)
+        values, from_f = self.evaluate_designs([memo.row(to_evaluate[key]) for key in keys], [to_evaluate[key] for key in keys])
+        results = dict(zip(keys, values))
+        real_keys = [key for key, is_real in zip(keys, from_f) if is_real]
+        for key in real_keys:
+            self.swarm.swarm_inform(to_evaluate[key], results[key])
+
+        if self.surrogate is not None:
+            known = [(memo.row(particle.params), recollection) for particle, recollection in zip(particles, recollections) if recollection is not None]
+            known += [(memo.row(to_evaluate[key]), results[key]) for key in real_keys]
+            self.surrogate.observe([row for row, _ in known], [val for _, val in known])
+
+        f_outputs = []
+        for particle, recollection, prediction in zip(particles, recollections, predictions):
+            if recollection is not None:
+                f_outputs.append(particle.record(recollection))
+            elif prediction is not None:
+                f_outputs.append(particle.record(prediction))
+            else:
+                f_outputs.append(particle.record(results[self.swarm.memo_key(particle.params)]))
 
-            grids = [np.linspace(0, 1, points_per_dim, endpoint=False) + 1 / (2 * points_per_dim) for _ in range(len(self.params))]
-            grid = np.array(np.meshgrid(*grids)).T.reshape(-1, len(self.params))
+        return f_outputs
 
-            # If we have more points than needed, randomly select n_particles
-            if len(grid) > n_particles:
-                indices = np.random.choice(len(grid), n_particles, replace=False)
-                grid = grid[indices]
+    # memory_hit / memory_miss counters, the timer report turns them into a hit rate
+    def count_recollections(self, recollections):
+        hits = sum(recollection is not None for recollection in recollections)
+        self.timer.count('memory_hit', hits)
+        self.timer.count('memory_miss', len(recollections) - hits)
 
+    def log_particles(self, f_outputs, logging):
+        if logging:
+            for i, (particle, f_output) in enumerate(zip(self.swarm.particles, f_outputs)):
+                self.log_lines.append(f'Particle {i}, Output: {f_output}, {particle.params}, {datetime.datetime.now()}')
+                print(f'Particle {i}, Output: {f_output}, {particle.params}')
 
-            for i, particle in enumerate(self.swarm.particles):
-                particle_params = set()
+    def initialize_particles(self, n_particles, logging, box_init):
+        self.place_particles(n_particles, box_init)
 
-                for j, param in enumerate(self.params):
-                    if param.discrete:
-                        grid_pos = myround(grid[i, j] * (param.max_val - param.min_val) + param.min_val, param.discretization)
-                    else:
-                        grid_pos = grid[i, j] * (param.max_val - param.min_val) + param.min_val
+        # every starting position is known at this point, evaluate them all in one go
+        self.evaluate_swarm(logging)
 
-                    vel = np.random.uniform(-1, 1) * (param.max_val - param.min_val) * 0.2 # found that this 0.2 scaling works nicely on initial vel, another day another magic number
+    # builds the swarm and gives every particle its starting params, without evaluating anything yet
+    def place_particles(self, n_particles, box_init):
+        self.n_particles = n_particles
+        self.swarm = PSO_swarm(PSO_memo(self.params, self.cache_tolerance, self.cache_size), self.store)
+        self.swarm.add_particles([PSO_particle(self.swarm) for _ in range(n_particles)])
+
+        rows, vels = self.initial_rows(n_particles, box_init)
+        for particle, row, vel_row in zip(self.swarm.particles, rows, vels):
+            particle.params = {PSO_param(param.name, param.discrete, param.min_val, param.max_val, row[j], vel_row[j], param.discretization)
+                               for j, param in enumerate(self.repair.templates)}
+
+    # starting rows and velocities in sorted-name order (see PSO_init), shared by both cores
+    # box_init: True for a space-filling start (Sobol), False for uniform random, or one of PSO_init.METHODS by name
+    def initial_rows(self, n_particles, box_init):
+        method = box_init if isinstance(box_init, str) else ('sobol' if box_init else 'random')
+        self.initializer = PSO_initializer(self.params, self.constraint_func, method, repair=self.repair)
+        return self.initializer.sample(n_particles)
+
+    # new velocities and positions for a batch of particles, pulled towards their own bests and whatever the swarm best is right now
+    def move_particles(self, particles, w_inertia, c_cog, c_social):
+        targets = {}
+        for particle in particles:
+            # by name, a set's order isn't stable across pickling and every param draws its own random numbers (resume has to match)
+            for param in sorted(particle.params, key=lambda param: param.name):
+                r_cog, r_social = np.random.rand(2)
 
-                    particle_params.add(PSO_param(param.name, param.discrete, param.min_val, param.max_val, grid_pos, vel, param.discretization))
+                param.vel = w_inertia * param.vel + c_cog * r_cog * (particle.bparam_val(param.name) - param.val) + c_social * r_social * (self.swarm.bparam_val(param.name) - param.val)
+                param.val = param.val + param.vel
 
-                particle_params = self.clip_to_constraint(particle_params)
-                
-                f_output = particle.set_motion(particle_params)
+                if param.discrete:
+                    targets.setdefault(param.name, []).append(param)
 
-                if logging:
-                    self.log_lines.append(f'Particle {i}, Output: {f_output}, {particle.params}, {datetime.datetime.now()}')
-                    print(f'Particle {i}, Output: {f_output}, {particle.params}')
+        # for discrete PSO parameters, a Gaussian probability curve centered around the "continuous" point determines
+        # where to jump next, drawn for every particle at once (see PSO_lattice)
+        for params in targets.values():
+            new_vals = lattice_of(params[0]).sample([param.val for param in params])
+            for param, new_val in zip(params, new_vals):
+                param.val = new_val
 
-        else:
-            # Initialize particles using random sampling within constraints
-            constraints_satisfied = 0
-            while constraints_satisfied < n_particles:
-                particle_params = set()
-                for param in self.params:
-                    if param.discrete:
-                        rand_val = np.random.uniform(param.min_val, param.max_val)
-                        rand_val = myround(rand_val, param.discretization)
-                    else:
-                        rand_val = np.random.uniform(param.min_val, param.max_val)
+    def move_particle(self, particle, w_inertia, c_cog, c_social):
+        self.move_particles([particle], w_inertia, c_cog, c_social)
 
-                    vel = np.random.uniform(-1, 1) * (param.max_val - param.min_val) * 0.2 # found that this 0.2 scaling works nicely on initial vel, another day another magic number
-                    particle_params.add(PSO_param(param.name, param.discrete, param.min_val, param.max_val, rand_val, vel, param.discretization))
+    # every particle moves, then the whole swarm gets repaired as one batch
+    def move_swarm(self, w_inertia, c_cog, c_social):
+        with self.timer.span('move'):
+            self.move_particles(self.swarm.particles, w_inertia, c_cog, c_social)
+        with self.timer.span('repair'):
+            self.repair_particles(self.swarm.particles)
 
-                # Check if the constraints are satisfied
-                if self.constraint_func(particle_params):
-                    # Set particle parameters and add to swarm
-                    f_output = self.swarm.particles[constraints_satisfied].set_motion(particle_params)
+    # evaluates wherever the particles are now as one batch, then updates the swarm best
+    def evaluate_swarm(self, logging):
+        with self.timer.span('evaluate_swarm'):
+            f_outputs = self.evaluate_particles(self.swarm.particles)
+        self.log_particles(f_outputs, logging)
 
-                    if logging:
-                        self.log_lines.append(f'Particle {constraints_satisfied}, Output: {f_output}, {particle_params}, {datetime.datetime.now()}')
-                        print(f'Particle {constraints_satisfied}, Output: {f_output}, {particle_params}')
+        self.swarm.update_best_location()
 
-                    constraints_satisfied += 1
+    # moves every particle first, then evaluates the whole iteration as one batch before the swarm best is updated
+    def update(self, w_inertia, c_cog, c_social, logging):
+        self.move_swarm(w_inertia, c_cog, c_social)
+        self.evaluate_swarm(logging)
+
+
+    # check that all "particle bests" are within range of "swarm best"
+    def bests_within_range(self, convergence_range):
+        particle_dists = []
+        for particle in self.swarm.particles:
+            param_dists = []
+            for param in sorted(particle.params, key=lambda param: param.name):
+                param_dists.append(self.swarm.bparam_val(param.name) - particle.bparam_val(param.name))
+            particle_dists.append(np.sqrt(sum(param_dist**2 for param_dist in param_dists)))
+
+        return all(dist < convergence_range for dist in particle_dists)
+
+
+    # appends the swarm's numbers to the run log (see PSO_log) and flushes self.log_lines to the text log, clear=True starts both files over
+    def write_log(self, iteration, clear=False):
+        with self.timer.span('write_log'):
+            self.append_log(iteration, clear)
+
+    def append_log(self, iteration, clear):
+        if clear or not hasattr(self, 'run_log'):
+            self.run_log = PSO_run_log(path('logging_run_write'), self.swarm.memo.names, self.n_particles, clear=clear)
+        self.run_log.append(iteration, **self.swarm.snapshot())
+
+        with open(path('logging_txt_write'), 'w' if clear else 'a') as f:
+            for line in self.log_lines:
+                f.write(line + '\n')
+
+        self.log_lines = []
+
+
+    # end of run statistics of the repair, surrogate and fidelity stages and the timer, printed and added to the text log
+    def write_reports(self):
+        reports = [self.repair.report()]
+        if self.initializer is not None:
+            reports.insert(0, self.initializer.report())
+        if self.surrogate is not None:
+            reports.append(self.surrogate.report())
+        if self.fidelity is not None:
+            reports.append(self.fidelity.report())
+        if self.cost_model is not None:
+            reports.append(self.cost_model.report())
+        reports.append(self.timer.report())
+
+        with open(path('logging_txt_write'), 'a') as f:
+            for report in reports:
+                print(report)
+                f.write(report + '\n')
+
+    # everything needed to pick the run back up: swarm (positions, velocities, bests, memo), RNG state, counters, run settings
+    # written after the particles have moved but before they're evaluated, so a resume re-dispatches exactly the evaluations
+    # that were in flight (anything that finished before the crash is in the store, if there is one, and costs nothing)
+    #
+    # written to a temporary file and renamed over the old checkpoint, a crash mid-write never leaves a broken one behind
+    def write_checkpoint(self):
+        with self.timer.span('checkpoint'):
+            self.dump_checkpoint()
+
+    def dump_checkpoint(self):
+        state = {'swarm': self.swarm,
+                 'rng_state': np.random.get_state(),
+                 'n_particles': self.n_particles,
+                 'iterations': self.iterations,
+                 'within_range_count': self.within_range_count,
+                 'n_evaluations': self.n_evaluations,
+                 'fidelity_offsets': None if self.fidelity is None else self.fidelity.offsets,
+                 'cost_data': None if self.cost_model is None else (self.cost_model.data, self.cost_model.errors),
+                 'pending': self.pending,
+                 'run_args': self.run_args}
+
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    # the main loop, shared by optimize() and resume()
+    # self.iterations counts finished iterations (0 is the initial placement), self.pending means the particles have moved but
+    # nobody has evaluated them yet
+    def run(self):
+        args = self.run_args
+        logging = args['logging']
 
+        # when all particles' bests are within the range of the swarm best for multiple iterations, solution is said to have converged
+        # not just one iteration, because particles have a tendency to overshoot and swing by what it currently thinks is the best, which is good behaviour
+        while True:
+            if self.pending:
+                self.evaluate_swarm(logging)
+                self.pending = False
 
-    def update(self, w_inertia, c_cog, c_social, logging):
-        for i, particle in enumerate(self.swarm.particles):
-            for param in particle.params:
-                r_cog, r_social = np.random.rand(2)
+                if logging:
+                    remaining = self.remaining_time_line()
+                    self.log_lines.append(f'Iteration {self.iterations}, best value: {self.swarm.bval}, {self.swarm.bparams}{remaining}')
 
-                param.vel = w_inertia * param.vel + c_cog * r_cog * (particle.bparam_val(param.name) - param.val) + c_social * r_social * (self.swarm.bparam_val(param.name) - param.val)
-                new_val = param.val + param.vel
+                    print(f'Iteration {self.iterations}, best value: {self.swarm.bval}, {self.swarm.bparams}{remaining}')
 
-                # for discrete PSO parameters, create a Gaussian probability curve centered around "continuous" point to determine
-                # where to jump next
-                if param.discrete:
-                    # scale = param.discretization means one grid point is one standard deviation
-                    probabilities = norm.pdf(list(np.arange(param.min_val, param.max_val + param.discretization, param.discretization)), loc=new_val, scale=param.discretization)
-                    probabilities /= np.sum(probabilities)
-                    new_val = np.random.choice(list(np.arange(param.min_val, param.max_val + param.discretization, param.discretization)), p=probabilities)
+                    # iteration 0 clears the log files
+                    self.write_log(self.iterations, clear=self.iterations == 0)
 
-                param.val = new_val
+                if self.iterations > 0:
+                    if self.bests_within_range(args['convergence_range']):
+                        self.within_range_count += 1
+                    else:
+                        # reset consecutive count if some particle bests are out of range
+                        self.within_range_count = 0
 
-            particle.params = self.clip_to_constraint(particle.params)
+            if self.within_range_count >= args['range_count_thresh']:
+                self.stop_reason = f'converged: particle bests within {args["convergence_range"]} of the swarm best for {self.within_range_count} iterations'
+            elif self.iterations >= args['max_iterations']:
+                self.stop_reason = f'max_iterations: {self.iterations} iterations'
+            elif args['termination'] is not None:
+                self.stop_reason = args['termination'].check(self)
 
-            f_output = particle.evaluate()
+            if self.stop_reason is not None:
+                if logging:
+                    print(f'Stopped after {self.n_evaluations} evaluations, {self.stop_reason}')
+                    with open(path('logging_txt_write'), 'a') as f:
+                        f.write(f'Stopped after {self.n_evaluations} evaluations, {self.stop_reason}\n')
+                break
 
-            if logging:
-                self.log_lines.append(f'Particle {i}, Output: {f_output}, {particle.params}, {datetime.datetime.now()}')
-                print(f'Particle {i}, Output: {f_output}, {particle.params}')
+            self.iterations += 1
+            self.move_swarm(args['w_inertia'], args['c_cog'], args['c_social'])
+            self.pending = True
 
-        self.swarm.update_best_location()
+            if self.checkpoint_path and self.iterations % self.checkpoint_every == 0:
+                self.write_checkpoint()
 
+        # a finished run's checkpoint says so, resuming it just hands back the result
+        if self.checkpoint_path:
+            self.write_checkpoint()
 
-    def optimize(self, n_particles, w_inertia, c_cog, c_social, range_count_thresh, convergence_range, max_iterations=200, logging=True, box_init=False):
         if logging:
-            self.log_lines = []
-            self.log_lines.append(f'PSO_optimizer initialized at {datetime.datetime.now()}')
-        
-        self.initialize_particles(n_particles, logging, box_init)
-        
-        self.swarm.update_best_location()
+            self.write_reports()
 
-        if logging:
-            self.log_lines.append(f'Iteration 0, best value: {self.swarm.bval}, {self.swarm.bparams}')
+        return self.swarm.bparams, self.swarm.bval
 
-            print(f'Iteration 0, best value: {self.swarm.bval}, {self.swarm.bparams}')
 
-            # clear pickle file
-            with open(path('logging_pkl_write'), 'wb') as f:
-                pickle.dump(self.swarm, f)
+    # executor: optional concurrent.futures style executor that evaluates each iteration's particles in parallel (see map_f)
+    # checkpoint_path: where to keep a checkpoint for resume(), refreshed every checkpoint_every iterations
+    # termination: a PSO_termination policy, or a list of them (first one to fire stops the run), checked after every iteration
+    # whatever stopped the run ends up in self.stop_reason
+    def optimize(self, n_particles, w_inertia, c_cog, c_social, range_count_thresh, convergence_range, max_iterations=200, logging=True, box_init=False, executor=None,
+                 checkpoint_path=None, checkpoint_every=1, termination=None):
+        self.executor = executor
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        if isinstance(termination, (list, tuple)):
+            termination = any_of(*termination)
+        if termination is not None:
+            termination.start()
+        self.run_args = {'w_inertia': w_inertia, 'c_cog': c_cog, 'c_social': c_social, 'range_count_thresh': range_count_thresh,
+                         'convergence_range': convergence_range, 'max_iterations': max_iterations, 'logging': logging, 'termination': termination}
+
+        self.log_lines = []
+        if logging:
+            self.log_lines.append(f'PSO_optimizer initialized at {datetime.datetime.now()}')
 
-            with open(path('logging_txt_write'), 'w') as f:
-                for line in self.log_lines:
-                    f.write(line + '\n')
+        self.place_particles(n_particles, box_init)
+        self.iterations = 0
+        self.n_evaluations = 0
+        self.stop_reason = None
+
+        if self.surrogate is not None:
+            self.feed_surrogate()
+
+        self.within_range_count = 0
+        self.pending = True
+
+        if checkpoint_path:
+            self.write_checkpoint()
+
+        return self.run()
+
+
+    # the surrogate starts out knowing everything earlier runs paid for (the store) and everything this run has (the memo, after a resume)
+    def feed_surrogate(self):
+        if self.store is not None:
+            records = self.store.records()
+            self.surrogate.observe([[record['params'][name] for name in self.surrogate.names] for record in records], [record['value'] for record in records])
+
+        rows, vals = self.swarm.memo.items()
+        self.surrogate.observe(rows, vals)
+
+
+    # carries on a run from the checkpoint optimize() left at checkpoint_path, with the same return value as optimize()
+    # build the optimizer exactly like the original run (same params, f, constraint_func, store), the checkpoint holds the rest
+    def resume(self, checkpoint_path, executor=None, checkpoint_every=1):
+        with open(checkpoint_path, 'rb') as f:
+            state = pickle.load(f)
+
+        self.executor = executor
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.run_args = state['run_args']
+        self.n_particles = state['n_particles']
+        self.iterations = state['iterations']
+        self.within_range_count = state['within_range_count']
+        self.n_evaluations = state['n_evaluations']
+        if self.fidelity is not None and state['fidelity_offsets'] is not None:
+            self.fidelity.offsets = state['fidelity_offsets']
+        # older checkpoints have no cost_data, the model starts from scratch then
+        if self.cost_model is not None and state.get('cost_data') is not None:
+            self.cost_model.data, self.cost_model.errors = state['cost_data']
+        self.stop_reason = None
+        self.pending = state['pending']
+        np.random.set_state(state['rng_state'])
+
+        # the store connection doesn't survive pickling, hook this run's one back up
+        self.swarm = state['swarm']
+        self.swarm.store = self.store
+
+        # the surrogate isn't in the checkpoint, it's refitted on what the store and the checkpointed memo already know
+        if self.surrogate is not None:
+            self.feed_surrogate()
+
+        self.log_lines = []
+        if self.run_args['logging']:
+            self.log_lines.append(f'PSO_optimizer resumed from {checkpoint_path} at iteration {self.iterations}, {datetime.datetime.now()}')
+
+        return self.run()
+
+
+# the object core: PSO_optimizer_base plus optimize_async, which moves and resubmits one PSO_particle at a time
+# (the array core only ever moves the whole swarm at once, so it doesn't have it)
+class PSO_optimizer(PSO_optimizer_base):
+    # asynchronous PSO: there are no iterations, each particle is moved and resubmitted as soon as its own evaluation comes back,
+    # using whatever the swarm best is at that moment. nobody waits for the slowest design of the batch
+    #
+    # max_evaluations replaces max_iterations as the budget, convergence is the same "all particle bests within convergence_range"
+    # test as optimize(), but it has to hold for range_count_thresh * n_particles evaluations in a row (roughly range_count_thresh iterations)
+    #
+    # executor needs a concurrent.futures style submit(), a thread pool with one worker per particle is made if none is given
+    # termination works like in optimize(), checked after every evaluation that comes back. a cost_model is fed the timings but has no batch
+    # to order, a surrogate or fidelity stages aren't supported
+    def optimize_async(self, n_particles, w_inertia, c_cog, c_social, max_evaluations, range_count_thresh, convergence_range, logging=True, box_init=False, executor=None,
+                       termination=None):
+        # the surrogate and the fidelity stages both work on whole batches of candidates (screening them against their particles,
+        # sending only the best of a coarse batch on to f), there are no batches here
+        if self.surrogate is not None:
+            raise ValueError('optimize_async has no batches for the surrogate to screen, use optimize() with a surrogate')
+        if self.fidelity is not None:
+            raise ValueError('optimize_async has no batches to stage from coarse to fine, use optimize() with fidelity')
+
+        if isinstance(termination, (list, tuple)):
+            termination = any_of(*termination)
+        if termination is not None:
+            termination.start()
+
+        own_executor = executor is None
+        if own_executor:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=n_particles)
+        self.executor = executor
 
+        if logging:
+            self.log_lines = []
+            self.log_lines.append(f'PSO_optimizer (async) initialized at {datetime.datetime.now()}')
 
-        iterations = 1
+        self.place_particles(n_particles, box_init)
+        self.n_evaluations = 0
+        self.stop_reason = None
+        submitted = 0
         within_range_count = 0
+        remembered_count = 0    # moves in a row that landed on designs the swarm already knew, they cost nothing so they don't touch the budget
+        in_flight = {}
+
+        # remembered positions don't go to the executor, they get an already finished future so they come back through the same loop
+        def dispatch(particle):
+            nonlocal submitted
+            recollection = self.swarm.swarm_memory(particle.params)
+            self.count_recollections([recollection])
+
+            if recollection is not None:
+                future = concurrent.futures.Future()
+                future.set_result(recollection)
+                in_flight[future] = (particle, False)
+            else:
+                in_flight[executor.submit(timed_call(self.f), particle.params)] = (particle, True)
+                submitted += 1
 
-        # when all particles' bests are within the range of the swarm best for multiple iterations, solution is said to have converged
-        # not just one iteration, because particles have a tendency to overshoot and swing by what it currently thinks is the best, which is good behaviour
-        while within_range_count < range_count_thresh and iterations <= max_iterations:
-            self.log_lines = [] # clear log lines every iteration
-            self.update(w_inertia, c_cog, c_social, logging)
+        try:
+            for particle in self.swarm.particles:
+                dispatch(particle)
 
             if logging:
-                self.log_lines.append(f'Iteration {iterations}, best value: {self.swarm.bval}, {self.swarm.bparams}')
+                self.write_log(0, clear=True)
 
-                print(f'Iteration {iterations}, best value: {self.swarm.bval}, {self.swarm.bparams}')
+            while in_flight:
+                done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
 
-                with open(path('logging_pkl_write'), 'ab') as f:
-                    pickle.dump(self.swarm, f)
+                for future in done:
+                    particle, evaluated = in_flight.pop(future)
+                    if evaluated:
+                        val, start, duration = future.result()
+                        self.record_evaluation('objective', particle.params, start, duration)
+                    else:
+                        val = future.result()
 
-                with open(path('logging_txt_write'), 'a') as f:
-                    for line in self.log_lines:
-                        f.write(line + '\n')
+                    if evaluated:
+                        self.swarm.swarm_inform(particle.params, val)
+                        self.n_evaluations += 1
+                        remembered_count = 0
+                    else:
+                        remembered_count += 1
 
-            iterations += 1
+                    particle.record(val)
+                    self.swarm.update_best_location()
 
-            # check that all "particle bests" are within range of "swarm best"
-            particle_dists = []
-            for particle in self.swarm.particles:
-                param_dists = []
-                for param in particle.params:
-                    param_dists.append(self.swarm.bparam_val(param.name) - particle.bparam_val(param.name))
-                particle_dists.append(np.sqrt(sum(param_dist**2 for param_dist in param_dists)))
+                    # particles whose first evaluation hasn't come back yet don't have a best to compare
+                    if all(other.bparams is not None for other in self.swarm.particles) and self.bests_within_range(convergence_range):
+                        within_range_count += 1
+                    else:
+                        within_range_count = 0
 
-            if all(dist < convergence_range for dist in particle_dists):
-                within_range_count += 1
-            else:
-                # reset consecutive count if some particle bests are out of range
-                within_range_count = 0
+                    if logging:
+                        self.log_lines.append(f'Evaluation {self.n_evaluations}, Particle {self.swarm.particles.index(particle)}, Output: {val}, {particle.params}, best value: {self.swarm.bval}, {datetime.datetime.now()}')
+                        print(f'Evaluation {self.n_evaluations}, Particle {self.swarm.particles.index(particle)}, Output: {val}, best value: {self.swarm.bval}')
+
+                        # one run log record per n_particles evaluations keeps the replay file about as dense as optimize()
+                        if evaluated and self.n_evaluations % n_particles == 0:
+                            self.write_log(self.n_evaluations // n_particles)
+
+                    if self.stop_reason is None:
+                        if within_range_count >= range_count_thresh * n_particles:
+                            self.stop_reason = f'converged: particle bests within {convergence_range} of the swarm best for {within_range_count} evaluations'
+                        elif submitted >= max_evaluations:
+                            self.stop_reason = f'max_evaluations: {submitted} evaluations submitted'
+                        # a small discrete space can be explored completely, after that the budget would never run out
+                        elif remembered_count >= max_evaluations:
+                            self.stop_reason = f'exhausted: the last {remembered_count} moves all landed on remembered designs'
+                        elif termination is not None:
+                            self.stop_reason = termination.check(self)
+
+                    # once stopped, in-flight evaluations are still collected (they're paid for) but nothing new goes out
+                    if self.stop_reason is None:
+                        with self.timer.span('move'):
+                            self.move_particle(particle, w_inertia, c_cog, c_social)
+                        with self.timer.span('repair'):
+                            self.repair_particles([particle])
+                        dispatch(particle)
+
+        finally:
+            if own_executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+        if logging:
+            self.log_lines.append(f'Finished after {self.n_evaluations} evaluations ({self.stop_reason}), best value: {self.swarm.bval}, {self.swarm.bparams}')
+            print(f'Finished after {self.n_evaluations} evaluations ({self.stop_reason}), best value: {self.swarm.bval}, {self.swarm.bparams}')
+            # the run log numbers its records with ints, the last one comes after every per-n_particles record written above
+            self.write_log(self.n_evaluations // n_particles + 1)
+            self.write_reports()
 
         return self.swarm.bparams, self.swarm.bval